@@ -0,0 +1,176 @@
+"""
+Answer cache for repeated /ask questions.
+
+Answers are keyed on the normalized instruction, the model choice and the SEE system prompt
+version, so editing the prompt invalidates old answers. Only questions that don't depend on
+earlier turns are cached (see is_cacheable). Entries live in an in-memory LRU with a TTL and,
+if ANSWER_CACHE_DIR is set, in a size-bounded on-disk tier shared by all workers.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from telemetry import log
+
+# --- ANSWER CACHE CONFIG ---
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+ANSWER_CACHE_DIR = os.environ.get("ANSWER_CACHE_DIR", "")
+ANSWER_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_DISK_MAX_ENTRIES", "20000"))
+
+# Words that usually mean the question leans on an earlier answer
+FOLLOW_UP_MARKERS = re.compile(
+    r"\b(explain|why|how did you|what does|this|that|it|above|previous|again|same|step|last)\b"
+)
+_OPERATOR_SPACING = re.compile(r"\s*([+\-*/=^×÷⇒(),])\s*")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_instruction(text):
+    """Normalizes a question so trivially different spellings share a cache entry."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _WHITESPACE.sub(" ", text).strip()
+    text = _OPERATOR_SPACING.sub(r"\1", text)
+    return text.rstrip(" ?.!")
+
+
+def is_cacheable(chat_history, instruction):
+    """First turns are always cacheable; later turns only if they read as self-contained problems."""
+    if not chat_history:
+        return True
+    normalized = normalize_instruction(instruction)
+    return bool(re.search(r"\d", normalized)) and "=" in normalized and not FOLLOW_UP_MARKERS.search(normalized)
+
+
+def cache_key(instruction, model_choice, prompt_version):
+    raw = f"{prompt_version}|{model_choice}|{normalize_instruction(instruction)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """In-memory LRU with TTL, optionally backed by one JSON file per answer on disk."""
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL,
+                 disk_dir=None, disk_max_entries=ANSWER_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached answer or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, created_at = entry
+                if now - created_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return answer
+                del self._entries[key]
+
+        answer = self._disk_get(key, now)
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._memory_put(key, answer, now)
+        return answer
+
+    def put(self, key, answer):
+        now = time.time()
+        self._memory_put(key, answer, now)
+        self._disk_put(key, answer, now)
+
+    def _memory_put(self, key, answer, created_at):
+        with self._lock:
+            self._entries[key] = (answer, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if now - entry.get('created_at', 0) > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # Touch the file so the disk tier evicts least recently used entries first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get('answer')
+
+    def _disk_put(self, key, answer, created_at):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'answer': answer, 'created_at': created_at}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("Answer cache write failed: %s", e)
+            return
+        # Scanning the directory is O(entries), so only check the bound every few writes
+        self._disk_writes += 1
+        if self._disk_writes % 50 == 0:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        entries = [e for e in os.scandir(self.disk_dir) if e.name.endswith(".json")]
+        overflow = len(entries) - self.disk_max_entries
+        if overflow <= 0:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:overflow]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "disk_tier": bool(self.disk_dir),
+            }
+
+
+def create_answer_cache():
+    """Builds the answer cache from the ANSWER_CACHE_* settings."""
+    return AnswerCache(disk_dir=ANSWER_CACHE_DIR or None)
@@ -0,0 +1,214 @@
+"""
+Background answer jobs with resumable streams for /ask.
+
+An answer is generated by a job keyed by (user_id, chat_id, message_id), which runs on its own
+(a thread in the WSGI app, a task in the ASGI app) instead of inside the response generator.
+The job keeps going when the client disconnects, and saves the answer when it ends. The HTTP
+response only follows the job, so a dropped connection costs nothing: the page reconnects to
+/answer_stream/<chat_id>/<message_id> with the Last-Event-ID it got, and the stream resumes from
+there. Re-posting the same message_id to /ask attaches to the running job too, without
+counting another message or calling the provider again.
+
+Token events carry the answer's length so far as their event ID. The most recent events are
+kept in a ring buffer of ANSWER_JOB_BUFFER_EVENTS; a client that fell further behind gets the
+text it missed as one catch-up event instead. Finished jobs are evicted once nobody has read
+them for ANSWER_JOB_IDLE_SECONDS (the answer is in the chat history by then).
+
+Jobs live in the worker process that started them, so resuming needs the same worker (true for
+the single-worker deployments; sticky sessions otherwise). Elsewhere the page falls back to
+reloading the saved chat.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from sse import KEEPALIVE, error_event, token_event
+from telemetry import log
+
+# --- ANSWER JOB CONFIG ---
+ANSWER_JOB_BUFFER_EVENTS = int(os.environ.get("ANSWER_JOB_BUFFER_EVENTS", "256"))
+ANSWER_JOB_IDLE_SECONDS = float(os.environ.get("ANSWER_JOB_IDLE_SECONDS", "300"))
+# Seconds without events before a follower sends a keep-alive comment
+ANSWER_JOB_KEEPALIVE_SECONDS = float(os.environ.get("ANSWER_JOB_KEEPALIVE_SECONDS", "15"))
+
+INTERRUPTED_MESSAGE = "The answer stopped unexpectedly. Please try again."
+
+
+def parse_event_id(value):
+    """A Last-Event-ID header value as an answer offset (0 if missing or malformed)."""
+    try:
+        return max(int(value or 0), 0)
+    except ValueError:
+        return 0
+
+
+class AnswerJob:
+    """One answer being generated; producers call token() and end(), followers read events."""
+
+    def __init__(self, key, generation, buffer_events=ANSWER_JOB_BUFFER_EVENTS):
+        self.key = key
+        self.generation = generation
+        self.text = ""
+        self.final_event = None
+        self.finished = False
+        self.touched = time.monotonic()
+        self.task = None
+        # (start offset, end offset, event) of the latest token events
+        self._events = deque(maxlen=buffer_events)
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    # --- producer side ---
+    def token(self, text):
+        with self._lock:
+            start = len(self.text)
+            self.text += text
+            self._events.append((start, len(self.text), token_event(text, len(self.text))))
+        self._notify()
+
+    def end(self, event):
+        """Sends the final done or error event; later calls are ignored."""
+        with self._lock:
+            if self.final_event is None:
+                self.final_event = event
+        self._notify()
+
+    def close(self):
+        """Marks the job finished once its producer has returned (and saved the answer)."""
+        if self.final_event is None:
+            self.end(error_event(INTERRUPTED_MESSAGE))
+        with self._lock:
+            self.finished = True
+            self.touched = time.monotonic()
+        self._notify()
+
+    def run(self, produce):
+        """Runs produce(job) to completion; for a job thread."""
+        try:
+            produce(self)
+        except Exception as e:
+            log.exception("Answer job %s failed: %s", self.key[2], e)
+        finally:
+            self.close()
+
+    async def arun(self, produce):
+        """Async run(): awaits produce(job); for a job task."""
+        try:
+            await produce(self)
+        except Exception as e:
+            log.exception("Answer job %s failed: %s", self.key[2], e)
+        finally:
+            self.close()
+
+    def _notify(self):
+        with self._lock:
+            self._changed.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    # --- follower side ---
+    def events_after(self, offset):
+        """The events a client that has read `offset` characters is missing, and the new offset."""
+        with self._lock:
+            self.touched = time.monotonic()
+            offset = min(offset, len(self.text))
+            events = []
+            if offset < len(self.text):
+                missed = [entry for entry in self._events if entry[0] >= offset]
+                if missed and missed[0][0] == offset:
+                    events = [event for _, _, event in missed]
+                else:
+                    # Fell behind the ring buffer: send what it missed in one event
+                    events = [token_event(self.text[offset:], len(self.text))]
+                offset = len(self.text)
+            if self.final_event is not None:
+                events.append(self.final_event)
+            return events, offset, self.final_event is not None
+
+    def follow(self, offset=0):
+        """Yields the job's events from `offset` until its final event. Closing it leaves the job running."""
+        while True:
+            with self._lock:
+                if len(self.text) == offset and self.final_event is None:
+                    self._changed.wait(ANSWER_JOB_KEEPALIVE_SECONDS)
+            events, offset, ended = self.events_after(offset)
+            yield from events or [KEEPALIVE]
+            if ended:
+                return
+
+    async def afollow(self, offset=0):
+        """Async follow()."""
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def listener():
+            loop.call_soon_threadsafe(changed.set)
+
+        with self._lock:
+            self._listeners.append(listener)
+        try:
+            while True:
+                changed.clear()
+                events, offset, ended = self.events_after(offset)
+                for event in events:
+                    yield event
+                if ended:
+                    return
+                if not events:
+                    try:
+                        await asyncio.wait_for(changed.wait(), ANSWER_JOB_KEEPALIVE_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield KEEPALIVE
+        finally:
+            with self._lock:
+                self._listeners.remove(listener)
+
+
+class AnswerJobRegistry:
+    """The answer jobs of this process, by (user_id, chat_id, message_id)."""
+
+    def __init__(self, idle_seconds=ANSWER_JOB_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "attached": 0, "resumed": 0, "evicted": 0}
+
+    def start(self, key, generation):
+        """Registers a new job; the caller starts its producer (start_thread, or a task running arun)."""
+        job = AnswerJob(key, generation)
+        with self._lock:
+            self._evict_idle()
+            self._jobs[key] = job
+            self._stats["started"] += 1
+        return job
+
+    def get(self, key, resumed=False):
+        """The job for `key`, or None if there is none (or it was evicted)."""
+        with self._lock:
+            self._evict_idle()
+            job = self._jobs.get(key)
+            if job is not None:
+                self._stats["resumed" if resumed else "attached"] += 1
+        return job
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        idle = [key for key, job in self._jobs.items() if job.finished and now - job.touched > self.idle_seconds]
+        for key in idle:
+            del self._jobs[key]
+        self._stats["evicted"] += len(idle)
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if not job.finished)
+            buffered = sum(len(job.text) for job in self._jobs.values())
+            return dict(self._stats, running=running, finished=len(self._jobs) - running, buffered_chars=buffered)
+
+
+def start_thread(job, produce):
+    """Runs the job's producer on its own thread."""
+    threading.Thread(target=job.run, args=(produce,), name=f"answer-{job.key[2][:8]}", daemon=True).start()
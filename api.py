@@ -1,6 +1,6 @@
 import json
 import base64
-import requests
+import io
 import time
 import uuid
 import os
@@ -8,10 +8,33 @@ from flask import Flask, render_template, request, jsonify, redirect, session, u
 from flask_dance.contrib.google import make_google_blueprint, google
 from authlib.integrations.flask_client import OAuth
 from PIL import Image
-import pytesseract
 import tempfile
-from datetime import datetime, date, timedelta
+from datetime import datetime
 from flask_cors import CORS
+from chat_store import create_chat_store
+from prompts import SEE_PROMPT_VERSION, SEE_SYSTEM_PROMPT
+import provider_client
+from provider_router import route_stream, router_stats
+from rate_limiter import limiter_stats
+from answer_cache import ANSWER_CACHE_ENABLED, cache_key, create_answer_cache, is_cacheable
+from semantic_cache import SEMANTIC_CACHE_ENABLED, create_semantic_cache, semantic_scope
+from context_window import estimate_tokens, fit_context, token_budget
+from chat_summary import ChatSummarizer, uncovered_messages
+from quota_store import create_quota_store
+from image_cache import IMAGE_CACHE_ENABLED, create_image_cache
+from image_preprocess import (
+    IMAGE_MAX_UPLOAD_BYTES, UploadTooLarge, describe as describe_image, pipeline_stats, prepare_upload,
+    too_large_message,
+)
+from ocr_fastpath import ocr_stats, read_printed_problem
+from screen_frames import SCREEN_FRAME_MAX_INTERVAL, ScreenFrameTracker, frame_thumbnail
+from cancellation import GenerationRegistry
+from answer_jobs import AnswerJobRegistry, parse_event_id, start_thread
+from singleflight import SINGLEFLIGHT_ENABLED, FlightRegistry
+from web_search import format_context, format_results_markdown, search_stats, start_search
+from tts import TTS_MAX_CHARS, SpeechSynthesizer, split_sentences
+from telemetry import RequestTrace, log, render_metrics
+from sse import SSE_HEADERS, coalesce, done_event, error_event, token_event
 
 app_name = '__main__'
 if '__app_id__' in globals():
@@ -29,11 +52,13 @@ GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
 SERPER_API_KEY = os.environ.get("SERPER_API_KEY")
 
-# --- API Endpoints ---
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
+# --- API Endpoints (overridable, e.g. to point at local stub servers) ---
+GEMINI_API_URL = os.environ.get("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent")
+# Follows GEMINI_API_URL unless set on its own
+GEMINI_STREAM_API_URL = os.environ.get("GEMINI_STREAM_API_URL", GEMINI_API_URL.replace(":generateContent", ":streamGenerateContent"))
 AWAN_API_URL = "https://api.awanllm.com/v1/chat/completions"
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+GROQ_API_URL = os.environ.get("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+OPENROUTER_API_URL = os.environ.get("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
 
 # --- Models ---
 GEMINI_MODEL = "gemini-2.5-flash"
@@ -42,37 +67,42 @@ GROQ_MODEL = "mixtral-8x7b-32768"  # Stable, always available
 OPENROUTER_GENERAL_MODEL = "mistralai/mistral-small-3.2-24b-instruct:free"
 OPENROUTER_DEEPTHINK_MODEL = "deepseek/deepseek-chat-v3.1:free"
 
+# Use Gemini's SSE streamGenerateContent endpoint (falls back to generateContent if it fails)
+GEMINI_STREAMING = os.environ.get("GEMINI_STREAMING", "true").lower() == "true"
+
 # Directories
-CHAT_HISTORY_DIR = os.path.join(app.root_path, 'chat_history')
+CHAT_HISTORY_DIR = os.environ.get("CHAT_HISTORY_DIR", os.path.join(app.root_path, 'chat_history'))
 os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
+chat_store = create_chat_store(CHAT_HISTORY_DIR)
+# Number of most recent messages loaded as context for /ask
+CHAT_CONTEXT_TAIL = int(os.environ.get("CHAT_CONTEXT_TAIL", "40"))
+# Sidebar pagination for /get_chat_history_list
+CHAT_LIST_PAGE_SIZE = 50
+CHAT_LIST_MAX_PAGE_SIZE = 200
 UPLOAD_FOLDER = os.path.join(app.root_path, 'static', 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Rejects oversized request bodies (413) before the form is parsed; leaves room for the other form fields
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+app.config['MAX_CONTENT_LENGTH'] = IMAGE_MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD
 
 # --- Quota Tracking ---
-user_message_counts = {}
-DAILY_MESSAGE_LIMIT = 20
+# Shared by all workers (see quota_store.QUOTA_BACKEND)
+quota_store = create_quota_store(CHAT_HISTORY_DIR)
+DAILY_MESSAGE_LIMIT = int(os.environ.get("DAILY_MESSAGE_LIMIT", "20"))
+DAILY_LIMIT_MESSAGE = f"You have reached your daily message limit of {DAILY_MESSAGE_LIMIT}. Please try again tomorrow."
 
 def get_daily_message_count(user_id):
     """Retrieves the message count for the current user and day."""
-    today_str = date.today().isoformat()
-    if user_id not in user_message_counts:
-        user_message_counts[user_id] = {}
-    if today_str not in user_message_counts[user_id]:
-        user_message_counts[user_id][today_str] = 0
-    return user_message_counts[user_id][today_str]
-
-def increment_daily_message_count(user_id):
-    """Increments the message count for the current user and day."""
-    today_str = date.today().isoformat()
-    if user_id not in user_message_counts:
-        user_message_counts[user_id] = {}
-    if today_str not in user_message_counts[user_id]:
-        user_message_counts[user_id][today_str] = 0
-    user_message_counts[user_id][today_str] += 1
-    one_week_ago = (date.today() - timedelta(days=7)).isoformat()
-    for d_str in list(user_message_counts[user_id].keys()):
-        if d_str < one_week_ago:
-            del user_message_counts[user_id][d_str]
+    return quota_store.get(user_id)
+
+def consume_daily_message(user_id):
+    """Atomically counts one message against today's quota. Returns False if the limit is reached."""
+    allowed, _ = quota_store.try_consume(user_id, DAILY_MESSAGE_LIMIT)
+    return allowed
+
+def refund_daily_message(user_id):
+    """Gives back a message counted by consume_daily_message when the request produced nothing."""
+    quota_store.refund(user_id)
 
 # OAuth configuration
 google_bp = make_google_blueprint(
@@ -94,56 +124,13 @@ microsoft = oauth.register(
     client_kwargs={'scope': 'User.Read'}
 )
 
-# --- SEE SYSTEM PROMPT (CRITICAL FOR EXAM-FOCUSED ANSWERS) ---
-SEE_SYSTEM_PROMPT = """You are Vexara, a Math tutor for Class 10 SEE students in Nepal.
-
-**ANSWER APPROACH:**
-
-1. **For direct math problems:** Use arrow format (⇒), show work clearly
-2. **For follow-up questions (explain, clarify, why, what does x mean):** Explain in simple language
-3. **For word problems:** First define variables, THEN show solution with arrows
-
-**FORMAT - USE ARROWS (⇒) FOR CALCULATIONS:**
-
-### LEVEL 1 (Simple equations):
-3x + 5 = 17
-⇒ 3x = 17 - 5
-⇒ 3x = 12
-⇒ x = 4
+answer_cache = create_answer_cache()
+semantic_cache = create_semantic_cache()
+image_cache = create_image_cache(os.path.join(CHAT_HISTORY_DIR, '.image_cache'), UPLOAD_FOLDER)
+screen_tracker = ScreenFrameTracker()
+generation_registry = GenerationRegistry()
+answer_jobs = AnswerJobRegistry()
 
-### LEVEL 2 (Word problems - ALWAYS explain variables first):
-
-**Problem:** Ram has twice as many rupees as Shyam. Together they have Rs 450. How much does each have?
-
-**Setting up:**
-Let Shyam's money = x (unknown - what we want to find)
-Ram's money = 2x (twice of Shyam's)
-Together = x + 2x = 450 (given condition)
-
-**Solution:**
-⇒ x + 2x = 450
-⇒ 3x = 450
-⇒ x = 450 ÷ 3
-⇒ x = 150
-
-**Answer:**
-Shyam has Rs 150
-Ram has Rs 2 × 150 = Rs 300
-
-**FOLLOW-UP RULE:**
-If student asks "explain", "why", "what does x mean", "how did you solve" - answer directly:
-- Explain the concept
-- Use simple words
-- Show why each step works
-- Don't just repeat arrows
-
-**RULES:**
-- NEVER use [Step 1] or "Step 1:"
-- ALWAYS use ⇒ for calculations
-- For word problems: Define what x means first
-- Answer follow-ups - don't refuse legitimate clarification questions
-- Keep explanations clear and student-friendly
-- Only refuse if completely off-topic (like "what's the weather?")"""
 # --- CHAT HISTORY MANAGEMENT ---
 def get_user_id():
     """Gets a unique user ID. Prefers authenticated user ID."""
@@ -154,42 +141,62 @@ def get_user_id():
         session['user_id'] = session['temp_user_id']
     return session['temp_user_id']
 
-def get_chat_file_path(user_id, chat_id):
-    """Constructs the file path for a specific chat history."""
-    safe_user_id = "".join(c for c in user_id if c.isalnum() or c in ('-', '_')).strip()
-    return os.path.join(CHAT_HISTORY_DIR, f"{safe_user_id}_{chat_id}.json")
-
-def load_chat_history_from_file(user_id, chat_id):
-    """Loads chat history for a given user and chat ID from a JSON file."""
-    file_path = get_chat_file_path(user_id, chat_id)
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            print(f"Warning: Could not decode JSON from {file_path}. Starting with empty chat.")
-            return []
-        except Exception as e:
-            print(f"Error loading chat history from {file_path}: {e}")
-            return []
-    return []
+def load_chat_history_from_file(user_id, chat_id, tail=None):
+    """Loads chat history (or only its last `tail` messages) from the chat store."""
+    try:
+        return chat_store.load(user_id, chat_id, tail=tail)
+    except Exception as e:
+        log.error("Error loading chat history for %s: %s", chat_id, e)
+        return []
 
 def save_chat_history_to_file(user_id, chat_id, chat_data):
-    """Saves chat history for a given user and chat ID to a JSON file."""
-    file_path = get_chat_file_path(user_id, chat_id)
+    """Replaces the whole chat history in the chat store."""
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(chat_data, f, ensure_ascii=False, indent=2)
+        chat_store.save(user_id, chat_id, chat_data)
     except Exception as e:
-        print(f"Error saving chat history to {file_path}: {e}")
+        log.error("Error saving chat history for %s: %s", chat_id, e)
+
+def load_chat_context(user_id, chat_id):
+    """
+    Loads what /ask sends as context: the chat's rolling summary (or None) and the
+    recent messages it doesn't cover.
+    """
+    try:
+        summary = chat_store.load_summary(user_id, chat_id)
+        total = chat_store.count_messages(user_id, chat_id) if summary else 0
+    except Exception as e:
+        log.error("Error loading chat summary for %s: %s", chat_id, e)
+        summary, total = None, 0
+    tail = load_chat_history_from_file(user_id, chat_id, tail=CHAT_CONTEXT_TAIL)
+    return uncovered_messages(tail, total, summary), summary
+
+def append_chat_message(user_id, chat_id, message):
+    """Appends a single turn to the chat store without rewriting the chat."""
+    # Stored with the message so the context budget doesn't re-count old turns
+    message.setdefault('tokens', estimate_tokens(message.get('text', '')))
+    try:
+        chat_store.append(user_id, chat_id, message)
+    except Exception as e:
+        log.error("Error appending to chat history for %s: %s", chat_id, e)
 
 # --- HELPER: Build chat context for API ---
-def build_gemini_messages(chat_history, new_instruction):
+def summary_text(summary):
+    return f"Summary of our earlier conversation:\n{summary['text']}"
+
+def build_gemini_messages(chat_history, new_instruction, budget=None, summary=None):
     """
     Builds the message list for Gemini API from chat history.
-    Includes system prompt as first message context.
+    The system prompt is sent separately as systemInstruction.
+    With a token budget, only the most recent turns that fit are included.
+    A rolling summary of older turns goes first, as an acknowledged user turn.
     """
+    if budget is not None:
+        reserved = estimate_tokens(new_instruction) + (estimate_tokens(summary['text']) if summary else 0)
+        chat_history = fit_context(chat_history, budget, reserved)
     messages = []
+    if summary:
+        messages.append({"role": "user", "parts": [{"text": summary_text(summary)}]})
+        messages.append({"role": "model", "parts": [{"text": "Understood."}]})
     
     # Convert chat history to Gemini format
     for msg in chat_history:
@@ -212,13 +219,20 @@ def build_gemini_messages(chat_history, new_instruction):
     
     return messages
 
-def build_chat_completion_messages(chat_history, new_instruction):
+def build_chat_completion_messages(chat_history, new_instruction, budget=None, summary=None):
     """
     Builds message list for OpenAI-compatible APIs (Groq, OpenRouter, Awan).
+    With a token budget, only the most recent turns that fit are included.
+    A rolling summary of older turns follows the system prompt.
     """
+    if budget is not None:
+        reserved = estimate_tokens(new_instruction) + (estimate_tokens(summary['text']) if summary else 0)
+        chat_history = fit_context(chat_history, budget, reserved)
     messages = [
         {"role": "system", "content": SEE_SYSTEM_PROMPT}
     ]
+    if summary:
+        messages.append({"role": "system", "content": summary_text(summary)})
     
     # Add chat history
     for msg in chat_history:
@@ -232,10 +246,36 @@ def build_chat_completion_messages(chat_history, new_instruction):
     
     return messages
 
-# --- GEMINI API CALL ---
-def call_gemini_api(messages, stream=False):
-    """Calls Gemini API (Gemini does NOT support streaming via REST API)."""
-    payload = {
+def with_web_context(instruction, web_results):
+    """The question preceded by the web search results it should be answered from."""
+    if not web_results:
+        return instruction
+    return (
+        "Web search results (cite them as [n] where you use them):\n\n"
+        f"{format_context(web_results)}\n\n"
+        f"Question: {instruction}"
+    )
+
+def build_context_messages(chat_history, new_instruction, model_choice, summary=None, web_results=None):
+    """
+    Builds the (Gemini, chat completion) message lists within each model's token budget.
+    `web_results` (from web_search) are put in front of the new instruction.
+    """
+    new_instruction = with_web_context(new_instruction, web_results)
+    completion_model = OPENROUTER_DEEPTHINK_MODEL if model_choice == "deep_think" else GROQ_MODEL
+    gemini_messages = build_gemini_messages(chat_history, new_instruction, token_budget(GEMINI_MODEL), summary)
+    completion_messages = build_chat_completion_messages(
+        chat_history, new_instruction, token_budget(completion_model), summary
+    )
+    dropped = len(chat_history) + 1 + (2 if summary else 0) - len(gemini_messages)
+    if dropped > 0:
+        log.info("Context budget: dropped %d older messages", dropped)
+    return gemini_messages, completion_messages
+
+# --- REQUEST BUILDERS (shared by the sync and async provider clients) ---
+def build_gemini_payload(messages):
+    """Builds the Gemini generateContent/streamGenerateContent request body."""
+    return {
         "contents": messages,
         "systemInstruction": {
             "parts": [{"text": SEE_SYSTEM_PROMPT}]
@@ -253,81 +293,391 @@ def call_gemini_api(messages, stream=False):
             {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
         ]
     }
-    
-    url = f"{GEMINI_API_URL}?key={GOOGLE_GEMINI_API_KEY}"
+
+def gemini_url(stream=False):
+    """Returns the Gemini endpoint URL, using SSE streaming when `stream` is set."""
+    if stream:
+        return f"{GEMINI_STREAM_API_URL}?alt=sse&key={GOOGLE_GEMINI_API_KEY}"
+    return f"{GEMINI_API_URL}?key={GOOGLE_GEMINI_API_KEY}"
+
+def build_chat_completion_payload(model, messages, stream=True):
+    """Builds an OpenAI-compatible chat completion request body."""
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 2048,
+        "stream": stream
+    }
+
+def groq_headers():
+    return {
+        "Authorization": f"Bearer {GROQ_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+def openrouter_headers():
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://vexara.ai",
+        "X-Title": "Vexara SEE Tutor"
+    }
+
+# --- GEMINI API CALL ---
+def call_gemini_api(messages, stream=False, encoded=None):
+    """
+    Calls Gemini API. With stream=True uses streamGenerateContent (SSE) and returns the open response.
+    `encoded` is a prebuilt (payload, body) request from build_vision_request, sent instead of `messages`.
+    """
+    url = gemini_url(stream)
+    if encoded:
+        payload, body = encoded
+        request_kwargs = {"data": body, "headers": {"Content-Type": "application/json"}, "rate_limit_payload": payload}
+    else:
+        payload = build_gemini_payload(messages)
+        request_kwargs = {"json": payload}
     
     try:
-        print(f"[DEBUG] Calling Gemini API (non-streaming) with {len(messages)} messages")
-        response = requests.post(url, json=payload, timeout=60)
-        print(f"[DEBUG] Gemini response status: {response.status_code}")
+        log.debug("Calling Gemini API (%s) with %d messages", "streaming" if stream else "non-streaming", len(payload['contents']))
+        response = provider_client.post("gemini", url, stream=stream, **request_kwargs)
+        log.debug("Gemini response status: %s", response.status_code)
         
         if response.status_code != 200:
-            print(f"[DEBUG] Gemini error response: {response.text[:500]}")
+            log.warning("Gemini error response: %s", response.text[:500])
         
         response.raise_for_status()
         return response
     except Exception as e:
-        print(f"Gemini API error: {e}")
-        print(f"[DEBUG] API Key set: {bool(GOOGLE_GEMINI_API_KEY)}")
-        if GOOGLE_GEMINI_API_KEY:
-            print(f"[DEBUG] Key preview: {GOOGLE_GEMINI_API_KEY[:20]}...")
+        log.error("Gemini API error: %s (API key set: %s)", e, bool(GOOGLE_GEMINI_API_KEY))
         return None
 
 # --- GROQ API CALL ---
 def call_groq_api(messages, stream=True):
     """Calls Groq API (fast LLM)."""
-    payload = {
-        "model": GROQ_MODEL,
-        "messages": messages,
-        "temperature": 0.7,
-        "max_tokens": 2048,
-        "stream": stream
-    }
-    
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    payload = build_chat_completion_payload(GROQ_MODEL, messages, stream)
+    headers = groq_headers()
     
     try:
-        print(f"[DEBUG] Calling Groq with payload keys: {list(payload.keys())}")
-        response = requests.post(GROQ_API_URL, json=payload, headers=headers, stream=stream, timeout=60)
-        print(f"[DEBUG] Groq status: {response.status_code}")
+        log.debug("Calling Groq with %d messages", len(messages))
+        response = provider_client.post("groq", GROQ_API_URL, json=payload, headers=headers, stream=stream)
+        log.debug("Groq status: %s", response.status_code)
         if response.status_code != 200:
-            print(f"[DEBUG] Groq error response: {response.text[:500]}")
+            log.warning("Groq error response: %s", response.text[:500])
         response.raise_for_status()
         return response
     except Exception as e:
-        print(f"Groq API error: {e}")
+        log.error("Groq API error: %s", e)
         return None
 
 # --- OPENROUTER API CALL ---
 def call_openrouter_api(messages, model, stream=True):
     """Calls OpenRouter API."""
-    payload = {
-        "model": model,
-        "messages": messages,
-        "temperature": 0.7,
-        "max_tokens": 2048,
-        "stream": stream
-    }
-    
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://vexara.ai",
-        "X-Title": "Vexara SEE Tutor"
-    }
+    payload = build_chat_completion_payload(model, messages, stream)
+    headers = openrouter_headers()
     
     try:
-        response = requests.post(OPENROUTER_API_URL, json=payload, headers=headers, stream=stream, timeout=60)
+        response = provider_client.post("openrouter", OPENROUTER_API_URL, json=payload, headers=headers, stream=stream)
         response.raise_for_status()
         return response
     except Exception as e:
-        print(f"OpenRouter API error: {e}")
+        log.error("OpenRouter API error: %s", e)
+        return None
+
+# --- CHAT SUMMARIES ---
+def call_summary_model(messages):
+    """Runs a summary request on the cheapest provider that answers (Groq, then OpenRouter)."""
+    for name, call in (
+        ("groq", lambda: call_groq_api(messages, stream=False)),
+        ("openrouter", lambda: call_openrouter_api(messages, OPENROUTER_GENERAL_MODEL, stream=False)),
+    ):
+        response = call()
+        if response is None:
+            continue
+        try:
+            text = response.json()['choices'][0]['message']['content']
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            log.warning("%s summary parse error: %s", name, e)
+            continue
+        if text:
+            return text
+    return None
+
+chat_summarizer = ChatSummarizer(chat_store, call_summary_model)
+
+# --- STREAM HELPERS ---
+def extract_gemini_text(data):
+    """Returns the text of the first candidate in a Gemini response (or SSE event)."""
+    candidates = data.get('candidates') or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get('content', {}).get('parts', [])
+    return "".join(part.get('text', '') for part in parts)
+
+def parse_sse_line(line):
+    """Decodes the JSON payload of an SSE `data:` line, or returns None for anything else."""
+    if not line:
+        return None
+    line_str = line.decode('utf-8').strip() if isinstance(line, bytes) else line.strip()
+    if not line_str.startswith('data: '):
         return None
+    try:
+        return json.loads(line_str[6:])
+    except json.JSONDecodeError:
+        return None
+
+def extract_chat_completion_delta(data):
+    """Returns the content delta of an OpenAI-compatible stream event, or an empty string."""
+    try:
+        return data['choices'][0].get('delta', {}).get('content') or ""
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+def iter_sse_data(response):
+    """Yields the decoded JSON payload of every `data:` line of an SSE response."""
+    for line in response.iter_lines():
+        data = parse_sse_line(line)
+        if data is not None:
+            yield data
+
+def iter_gemini_stream(response):
+    """Yields text chunks from a Gemini streamGenerateContent (alt=sse) response."""
+    for data in iter_sse_data(response):
+        text = extract_gemini_text(data)
+        if text:
+            yield text
+
+def iter_chat_completion_stream(response):
+    """Yields content deltas from an OpenAI-compatible streaming response (Groq, OpenRouter)."""
+    for data in iter_sse_data(response):
+        chunk = extract_chat_completion_delta(data)
+        if chunk:
+            yield chunk
+
+def chunk_text(text, size=50):
+    """Splits a complete answer into ~`size` character pieces for the UI (joining them gives back `text`)."""
+    chunk = ""
+    words = text.split(' ')
+    for i, word in enumerate(words):
+        chunk += word if i == len(words) - 1 else word + " "
+        if len(chunk) > size:
+            yield chunk
+            chunk = ""
+    if chunk:
+        yield chunk
+
+def stream_gemini(messages, on_open=None, encoded=None, cancel=None):
+    """
+    Yields Gemini's answer as it is generated. If streaming fails before the first
+    chunk, falls back to a blocking generateContent call and re-chunks the answer.
+    `on_open(response)` is called with each upstream response so a router can close it.
+    `encoded` is a prebuilt request from build_vision_request (see call_gemini_api).
+    `cancel` is the request's cancellation.Generation, or the routing attempt's cancel event
+    (see provider_router); once it is set there is no fallback.
+    """
+    if GEMINI_STREAMING:
+        response = call_gemini_api(messages, stream=True, encoded=encoded)
+        if response is not None:
+            if on_open:
+                on_open(response)
+            received = False
+            try:
+                for chunk in iter_gemini_stream(response):
+                    if encoded and not received:
+                        # The answer is streaming, so no fallback request will be sent: drop the
+                        # (image-sized) request body instead of holding it for the whole answer
+                        encoded = response.request.body = None
+                    received = True
+                    yield chunk
+            except Exception as e:
+                if cancel is None or not cancel.is_set():
+                    log.error("Gemini streaming error: %s", e)
+            finally:
+                response.close()
+            if received:
+                return
+        if cancel is not None and cancel.is_set():
+            return  # stopped, or lost the race to another provider
+        log.warning("Gemini streaming produced nothing, falling back to generateContent...")
+    
+    response = call_gemini_api(messages, stream=False, encoded=encoded)
+    if response is None or response.status_code != 200:
+        return
+    if on_open:
+        on_open(response)
+    try:
+        text = extract_gemini_text(response.json())
+    except Exception as e:
+        log.error("Gemini JSON parse error: %s", e)
+        return
+    yield from chunk_text(text)
+
+def _stream_chat_completion(response, on_open):
+    if response is None or response.status_code != 200:
+        return
+    if on_open:
+        on_open(response)
+    try:
+        yield from iter_chat_completion_stream(response)
+    finally:
+        response.close()
+
+def stream_groq(messages, on_open=None):
+    """Yields Groq's answer as it is streamed."""
+    yield from _stream_chat_completion(call_groq_api(messages, stream=True), on_open)
+
+def stream_openrouter(messages, model, on_open=None):
+    """Yields an OpenRouter model's answer as it is streamed."""
+    yield from _stream_chat_completion(call_openrouter_api(messages, model, stream=True), on_open)
+
+def find_cached_answer(chat_history, instruction, model_choice):
+    """
+    Looks the question up in the exact answer cache, then the semantic cache.
+    Returns (answer or None, source) where source is 'exact', 'semantic' or None.
+    """
+    if not is_cacheable(chat_history, instruction):
+        return None, None
+    if ANSWER_CACHE_ENABLED:
+        answer = answer_cache.get(cache_key(instruction, model_choice, SEE_PROMPT_VERSION))
+        if answer:
+            return answer, 'exact'
+    if SEMANTIC_CACHE_ENABLED:
+        answer, similarity = semantic_cache.lookup(semantic_scope(model_choice, SEE_PROMPT_VERSION), instruction)
+        if answer:
+            log.info("Semantic cache match (similarity %.2f)", similarity)
+            return answer, 'semantic'
+    return None, None
+
+def remember_answer(chat_history, instruction, model_choice, answer):
+    """Stores a fresh upstream answer in the answer caches if the question is cacheable."""
+    if not is_cacheable(chat_history, instruction):
+        return
+    if ANSWER_CACHE_ENABLED:
+        answer_cache.put(cache_key(instruction, model_choice, SEE_PROMPT_VERSION), answer)
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache.add(semantic_scope(model_choice, SEE_PROMPT_VERSION), instruction, answer)
+
+def build_provider_candidates(model_choice, gemini_messages, completion_messages):
+    """Ordered (provider, stream factory) candidates for a model choice, primary first."""
+    if model_choice == "deep_think":
+        # If DeepThink fails, fall back to Gemini (not Groq)
+        return [
+            ("openrouter", lambda on_open, cancel: stream_openrouter(completion_messages, OPENROUTER_DEEPTHINK_MODEL, on_open)),
+            ("gemini", lambda on_open, cancel: stream_gemini(gemini_messages, on_open, cancel=cancel)),
+        ]
+    if model_choice == "general":
+        return [
+            ("gemini", lambda on_open, cancel: stream_gemini(gemini_messages, on_open, cancel=cancel)),
+            ("groq", lambda on_open, cancel: stream_groq(completion_messages, on_open)),
+        ]
+    return []
+
+flights = FlightRegistry()
+
+def flight_key(instruction, model_choice):
+    """Identical cacheable questions share a flight under their answer cache key."""
+    return cache_key(instruction, model_choice, SEE_PROMPT_VERSION)
+
+def follow_flight(chat_history, instruction, model_choice, gemini_messages, completion_messages, cancel, trace):
+    """
+    Streams a cacheable answer through singleflight: the first request for a question calls
+    the providers, identical ones arriving while that answer is still streaming follow it.
+    """
+    flight, leader = flights.join(flight_key(instruction, model_choice))
+    if leader:
+        candidates = build_provider_candidates(model_choice, gemini_messages, completion_messages)
+        flights.fly(
+            flight, route_stream(candidates, cancel=flight.cancel, trace=trace),
+            lambda text: remember_answer(chat_history, instruction, model_choice, text),
+        )
+    else:
+        log.info("Following the in-flight answer for: %s...", instruction[:50])
+        trace.provider = "singleflight"
+    yield from flight.follow(cancel)
+
+def stream_text_answer(chat_history, summary, instruction, model_choice, cancel=None, search=None, trace=None):
+    """
+    Yields the answer to a text question: from the answer caches if possible, otherwise
+    streamed from the providers (falling back or hedging per ROUTING_POLICY) and cached.
+    `cancel` is the chat's cancellation.Generation; a stopped answer is not cached.
+    `search` is a web_search.SearchJob started by the endpoint; answers grounded in web
+    results depend on the day's results, so they bypass the answer caches.
+    `trace` is the request's telemetry.RequestTrace.
+    """
+    trace = trace or RequestTrace("ask", trace_model_choice(model_choice))
+    if search is None:
+        with trace.stage("cache_lookup"):
+            cached_answer, cache_source = find_cached_answer(chat_history, instruction, model_choice)
+        if cached_answer:
+            log.info("Answer cache (%s) hit for: %s...", cache_source, instruction[:50])
+            trace.provider = "cache"
+            yield from chunk_text(cached_answer)
+            return
+    
+    web_results = None
+    if search is not None:
+        with trace.stage("web_search"):
+            web_results = search.results()
+    with trace.stage("message_build"):
+        gemini_messages, completion_messages = build_context_messages(
+            chat_history, instruction, model_choice, summary, web_results
+        )
+    log.info("Using %s model for: %s...", model_choice, instruction[:50])
+    if search is None and SINGLEFLIGHT_ENABLED and is_cacheable(chat_history, instruction):
+        yield from follow_flight(chat_history, instruction, model_choice, gemini_messages, completion_messages,
+                                 cancel, trace)
+        return
+    full_response = ""
+    candidates = build_provider_candidates(model_choice, gemini_messages, completion_messages)
+    for chunk in route_stream(candidates, cancel=cancel, trace=trace):
+        full_response += chunk
+        yield chunk
+    if full_response and search is None and not (cancel is not None and cancel.is_set()):
+        remember_answer(chat_history, instruction, model_choice, full_response)
 
 # --- MAIN /ask ENDPOINT (IMPROVED WITH SEE CONTEXT) ---
+MODEL_CHOICES = ("general", "deep_think")
+
+def trace_model_choice(model_choice):
+    """The model_choice metric label (client input, so limited to the known choices)."""
+    return model_choice if model_choice in MODEL_CHOICES else "other"
+
+def answer_outcome(generation, text, completed):
+    """The outcome label of a finished answer: completed, stopped, disconnected or failed."""
+    if completed:
+        return "completed"
+    if generation.is_set():
+        return "stopped"
+    return "disconnected" if text else "failed"
+
+def answer_done_event(trace, text, completed):
+    """The SSE `done` event closing an answer stream, with the answer's final metadata."""
+    return done_event(
+        stopped=not completed, provider=trace.provider, model_choice=trace.model_choice, chars=len(text),
+        elapsed_ms=round((time.perf_counter() - trace.started) * 1000),
+    )
+
+def save_generated_answer(user_id, chat_id, generation, text, completed):
+    """
+    Saves a streamed answer as the bot turn and unregisters its generation. An answer that
+    ended early (stopped, or the client went away) is saved as far as it got and marked `stopped`.
+    """
+    generation_registry.finish(generation, text, completed)
+    if not text:
+        return
+    message = {"type": "bot", "text": text, "timestamp": time.time()}
+    if not completed:
+        message["stopped"] = True
+    append_chat_message(user_id, chat_id, message)
+    # Runs in the background, so the response doesn't wait for it
+    chat_summarizer.schedule(user_id, chat_id)
+
+def answer_stream_response(job, offset=0):
+    """Streams an answer job's events to the client from `offset`; the job runs on if the client goes."""
+    response = app.response_class(job.follow(offset), mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.headers['X-Message-Id'] = job.key[2]
+    return response
+
 @app.route('/ask', methods=['POST'])
 def ask_endpoint():
     """Main Q&A endpoint with SEE-specific prompting."""
@@ -336,160 +686,79 @@ def ask_endpoint():
     instruction = request.form.get('instruction', '').strip()
     model_choice = request.form.get('model_choice', 'general')
     web_search_enabled = request.form.get('web_search', 'false').lower() == 'true'
+    message_id = request.form.get('message_id') or uuid.uuid4().hex
     
     if not chat_id:
         return jsonify({"error": "Chat ID not provided."}), 400
     if not instruction:
         return jsonify({"error": "No instruction provided."}), 400
     
-    # Check quota
-    current_message_count = get_daily_message_count(user_id)
-    if current_message_count >= DAILY_MESSAGE_LIMIT:
-        return jsonify({"response": f"You have reached your daily message limit of {DAILY_MESSAGE_LIMIT}. Please try again tomorrow."}), 429
+    # A retried request for the same message attaches to its answer instead of asking again
+    job = answer_jobs.get((user_id, chat_id, message_id))
+    if job is not None:
+        return answer_stream_response(job, parse_event_id(request.headers.get('Last-Event-ID')))
     
-    # Load chat history
-    current_chat_history = load_chat_history_from_file(user_id, chat_id)
+    trace = RequestTrace("ask", trace_model_choice(model_choice))
+    # Check and count quota in one step, so concurrent requests can't overshoot the limit
+    with trace.stage("quota_check"):
+        allowed = consume_daily_message(user_id)
+    if not allowed:
+        trace.finish("quota_exceeded")
+        return jsonify({"response": DAILY_LIMIT_MESSAGE}), 429
     
-    # Save user message to history
-    current_chat_history.append({"type": "user", "text": instruction, "timestamp": time.time()})
-    save_chat_history_to_file(user_id, chat_id, current_chat_history)
+    # Search in the background while the chat is loaded and the prompt is built
+    search = start_search(instruction) if web_search_enabled else None
     
-    # Increment quota
-    increment_daily_message_count(user_id)
+    # Load the rolling summary and the recent turns it doesn't cover
+    with trace.stage("history_load"):
+        current_chat_history, summary = load_chat_context(user_id, chat_id)
+    
+    # Save user message to history
+    with trace.stage("history_save"):
+        append_chat_message(user_id, chat_id, {"type": "user", "text": instruction, "timestamp": time.time()})
     
-    def generate_response():
-        """Generator function for streaming response."""
+    def generate_response(job):
+        """Generates the answer into the job, on the job's own thread."""
+        # /stop_generation cancels this; a client that goes away does not
+        generation = job.generation
+        full_response = ""
+        completed = False
         try:
-            # Build messages for API
-            gemini_messages = build_gemini_messages(current_chat_history, instruction)
-            completion_messages = build_chat_completion_messages(current_chat_history, instruction)
+            answer = stream_text_answer(
+                current_chat_history, summary, instruction, model_choice, generation, search, trace
+            )
+            for chunk in coalesce(answer):
+                if generation.is_set():
+                    break
+                full_response += chunk
+                job.token(chunk)
             
-            response = None
-            full_response = ""
-            
-            # Try primary model based on choice
-            if model_choice == "deep_think":
-                # Use DeepThink model for complex problems
-                print(f"Using DeepThink model for: {instruction[:50]}...")
-                response = call_openrouter_api(completion_messages, OPENROUTER_DEEPTHINK_MODEL, stream=True)
-                
-                # Handle streaming for DeepThink
-                if response and response.status_code == 200:
-                    try:
-                        for line in response.iter_lines():
-                            if line:
-                                line_str = line.decode('utf-8').strip() if isinstance(line, bytes) else line.strip()
-                                if line_str.startswith('data: '):
-                                    try:
-                                        data = json.loads(line_str[6:])
-                                        if 'choices' in data and len(data['choices']) > 0:
-                                            choice = data['choices'][0]
-                                            if 'delta' in choice and 'content' in choice['delta']:
-                                                chunk = choice['delta']['content']
-                                                full_response += chunk
-                                                yield chunk
-                                    except (json.JSONDecodeError, KeyError, TypeError):
-                                        continue
-                    except Exception as e:
-                        print(f"DeepThink streaming error: {e}")
-                
-                # If DeepThink fails, fall back to Gemini (not Groq)
-                if not full_response:
-                    print("DeepThink failed or rate limited, falling back to Gemini...")
-                    response = call_gemini_api(gemini_messages, stream=False)
-                    
-                    if response and response.status_code == 200:
-                        try:
-                            data = response.json()
-                            if 'candidates' in data and len(data['candidates']) > 0:
-                                candidate = data['candidates'][0]
-                                if 'content' in candidate and 'parts' in candidate['content']:
-                                    for part in candidate['content']['parts']:
-                                        if 'text' in part:
-                                            full_response = part['text']
-                                            # Stream chunks to UI
-                                            words = full_response.split(' ')
-                                            chunk = ""
-                                            for word in words:
-                                                chunk += word + " "
-                                                if len(chunk) > 50:
-                                                    yield chunk
-                                                    chunk = ""
-                                            if chunk:
-                                                yield chunk
-                        except Exception as e:
-                            print(f"Fallback Gemini error: {e}")
-                    
-            elif model_choice == "general":
-                # Use Gemini for general questions (NO STREAMING - GET FULL RESPONSE)
-                print(f"Using Gemini for: {instruction[:50]}...")
-                response = call_gemini_api(gemini_messages, stream=False)
-                
-                if response and response.status_code == 200:
-                    try:
-                        data = response.json()
-                        print(f"[DEBUG] Gemini response received")
-                        
-                        if 'candidates' in data and len(data['candidates']) > 0:
-                            candidate = data['candidates'][0]
-                            if 'content' in candidate and 'parts' in candidate['content']:
-                                for part in candidate['content']['parts']:
-                                    if 'text' in part:
-                                        full_response = part['text']
-                                        # Stream the response in chunks for UI
-                                        # Split by sentences and yield gradually
-                                        words = full_response.split(' ')
-                                        chunk = ""
-                                        for word in words:
-                                            chunk += word + " "
-                                            if len(chunk) > 50:  # Yield every ~50 chars
-                                                yield chunk
-                                                chunk = ""
-                                        if chunk:
-                                            yield chunk
-                    except Exception as e:
-                        print(f"Gemini JSON parse error: {e}")
-                        yield f"Error parsing Gemini response: {str(e)}"
-                else:
-                    print(f"Gemini API failed with status {response.status_code if response else 'None'}")
-                    # Fall back to Groq
-                    print("Gemini failed, trying Groq...")
-                    response = call_groq_api(completion_messages, stream=True)
-                    
-                    if response and response.status_code == 200:
-                        try:
-                            for line in response.iter_lines():
-                                if line:
-                                    line_str = line.decode('utf-8').strip() if isinstance(line, bytes) else line.strip()
-                                    if line_str.startswith('data: '):
-                                        try:
-                                            data = json.loads(line_str[6:])
-                                            if 'choices' in data and len(data['choices']) > 0:
-                                                choice = data['choices'][0]
-                                                if 'delta' in choice and 'content' in choice['delta']:
-                                                    chunk = choice['delta']['content']
-                                                    full_response += chunk
-                                                    yield chunk
-                                        except (json.JSONDecodeError, KeyError, TypeError):
-                                            continue
-                        except Exception as e:
-                            print(f"Groq streaming error: {e}")
-            
-            if not full_response:
-                yield "Error: Could not get a response from AI models. Please try again."
+            if not full_response and not generation.is_set():
+                job.end(error_event("Could not get a response from AI models. Please try again."))
                 return
-            
-            # Save bot response to history
-            current_chat_history.append({"type": "bot", "text": full_response, "timestamp": time.time()})
-            save_chat_history_to_file(user_id, chat_id, current_chat_history)
+            completed = not generation.is_set()
+            job.end(answer_done_event(trace, full_response, completed))
             
         except Exception as e:
-            print(f"Error in /ask: {e}")
-            import traceback
-            traceback.print_exc()
-            yield f"Error: {str(e)}"
+            log.exception("Error in /ask: %s", e)
+            job.end(error_event(str(e)))
+        finally:
+            # Save bot response to history (a stopped answer is kept as far as it got)
+            with trace.stage("history_save"):
+                save_generated_answer(user_id, chat_id, generation, full_response, completed)
+            trace.finish(answer_outcome(generation, full_response, completed))
     
-    return app.response_class(generate_response(), mimetype='text/event-stream')
+    job = answer_jobs.start((user_id, chat_id, message_id), generation_registry.start(user_id, chat_id))
+    start_thread(job, generate_response)
+    return answer_stream_response(job)
+
+@app.route('/answer_stream/<chat_id>/<message_id>', methods=['GET'])
+def answer_stream_endpoint(chat_id, message_id):
+    """Reattaches to an /ask answer after a dropped connection, from the Last-Event-ID header (or ?last_event_id=)."""
+    job = answer_jobs.get((get_user_id(), chat_id, message_id), resumed=True)
+    if job is None:
+        return jsonify({"error": "No answer for this message; it is in the chat history once finished."}), 404
+    return answer_stream_response(job, parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id')))
 
 # --- OTHER REQUIRED ENDPOINTS (STUB VERSIONS) ---
 @app.route('/start_new_chat', methods=['POST'])
@@ -499,11 +768,7 @@ def start_new_chat_endpoint():
     new_chat_id = str(uuid.uuid4())
     save_chat_history_to_file(user_id, new_chat_id, [])
     
-    has_previous_chats = False
-    for filename in os.listdir(CHAT_HISTORY_DIR):
-        if filename.startswith(f"{user_id}_") and filename.endswith(".json") and filename != f"{user_id}_{new_chat_id}.json":
-            has_previous_chats = True
-            break
+    has_previous_chats = chat_store.count_chats(user_id) > 1
     
     return jsonify({"status": "success", "chat_id": new_chat_id, "has_previous_chats": has_previous_chats})
 
@@ -512,42 +777,23 @@ def clear_all_chats_endpoint():
     """Deletes all chat history files for the current user."""
     user_id = get_user_id()
     try:
-        count = 0
-        for filename in os.listdir(CHAT_HISTORY_DIR):
-            if filename.startswith(f"{user_id}_") and filename.endswith(".json"):
-                os.remove(os.path.join(CHAT_HISTORY_DIR, filename))
-                count += 1
+        count = chat_store.delete_all(user_id)
         return jsonify({"status": "success", "message": f"Cleared {count} chats."})
     except Exception as e:
         return jsonify({"status": "error", "message": "Failed to clear all chats.", "error": str(e)}), 500
 
 @app.route('/get_chat_history_list', methods=['GET'])
 def get_chat_history_list():
-    """Returns a list of chat summaries for the current user."""
+    """Returns one page of chat summaries for the current user from the per-user chat index."""
     user_id = get_user_id()
-    chat_summaries = []
-    
-    user_chat_files = [f for f in os.listdir(CHAT_HISTORY_DIR) if f.startswith(f"{user_id}_") and f.endswith(".json")]
-    user_chat_files.sort(key=lambda f: os.path.getmtime(os.path.join(CHAT_HISTORY_DIR, f)), reverse=True)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', CHAT_LIST_PAGE_SIZE, type=int), 1), CHAT_LIST_MAX_PAGE_SIZE)
     
-    for filename in user_chat_files:
-        chat_id = filename.replace(f"{user_id}_", "").replace(".json", "")
-        chat_data = load_chat_history_from_file(user_id, chat_id)
-        
-        display_title = "New Chat"
-        if chat_data:
-            first_meaningful_message = next((
-                msg for msg in chat_data 
-                if msg['type'] == 'user' and msg['text'].strip()
-            ), None)
-            if first_meaningful_message:
-                display_title = first_meaningful_message['text'].split('\n')[0][:30]
-                if len(first_meaningful_message['text'].split('\n')[0]) > 30:
-                    display_title += "..."
-        
-        chat_summaries.append({'id': chat_id, 'title': display_title})
+    chat_summaries = chat_store.list_chats(user_id, offset=offset, limit=limit)
     
-    return jsonify(chat_summaries)
+    response = jsonify(chat_summaries)
+    response.headers['X-Total-Count'] = str(chat_store.count_chats(user_id))
+    return response
 
 @app.route('/get_chat_messages/<chat_id>', methods=['GET'])
 def get_chat_messages(chat_id):
@@ -599,7 +845,7 @@ def google_login_authorized():
         else:
             return redirect(url_for('login'))
     except Exception as e:
-        print(f"Error during Google login: {e}")
+        log.error("Error during Google login: %s", e)
         return redirect(url_for('login'))
 
 @app.route('/')
@@ -628,7 +874,7 @@ def debug_test_gemini():
     
     try:
         data = response.json()
-        print(f"[DEBUG] Full Gemini response: {json.dumps(data, indent=2)[:500]}")
+        log.debug("Full Gemini response: %s", json.dumps(data, indent=2)[:500])
         
         if 'candidates' in data and len(data['candidates']) > 0:
             candidate = data['candidates'][0]
@@ -651,7 +897,136 @@ def debug_test_gemini():
             "response_text": response.text[:500] if response else "No response"
         })
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics: per-stage latency histograms and request outcomes."""
+    body, content_type = render_metrics()
+    return app.response_class(body, content_type=content_type)
+
+@app.route('/debug/provider-pools', methods=['GET'])
+def debug_provider_pools():
+    """Shows how often upstream connections were reused versus newly opened."""
+    return jsonify(provider_client.pool_stats())
+
+@app.route('/debug/provider-stats', methods=['GET'])
+def debug_provider_stats():
+    """Per-provider latency, error and rate limiter stats, for tuning ROUTING_POLICY and HEDGE_DELAY_MS."""
+    return jsonify({**router_stats(), "rate_limits": limiter_stats()})
+
+@app.route('/debug/answer-cache', methods=['GET'])
+def debug_answer_cache():
+    """Exact and semantic answer cache hit/miss counters, and upstream calls saved by singleflight."""
+    return jsonify({"exact": answer_cache.stats(), "semantic": semantic_cache.stats(), "singleflight": flights.stats()})
+
+@app.route('/debug/web-search', methods=['GET'])
+def debug_web_search():
+    """Serper searches, query cache hits, page fetch outcomes and searches that missed their deadline."""
+    return jsonify(search_stats())
+
+@app.route('/debug/image-pipeline', methods=['GET'])
+def debug_image_pipeline():
+    """Upload bytes received and sent to Gemini after preprocessing, OCR fast path and image cache outcomes."""
+    return jsonify({**pipeline_stats(), "ocr": ocr_stats(), "cache": image_cache.stats()})
+
 # --- IMAGE UPLOAD & VISION ENDPOINT ---
+ALLOWED_IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'webp')
+
+def build_vision_messages(caption, image_data, mime_type="image/jpeg"):
+    """Builds the Gemini Vision request for an uploaded math problem image (base64 `image_data`)."""
+    vision_prompt = f"""You are a math tutor specializing in SEE exam preparation for Class 10 students in Nepal.
+
+A student has uploaded an image of a math problem. Your task is to:
+1. Analyze the image and identify the math problem
+2. Explain what the problem is asking (in simple terms)
+3. Solve it step-by-step
+4. Explain the concept behind it
+5. Provide the final answer clearly
+
+The student's caption/note about this problem: {caption if caption else 'None provided'}
+
+Follow the same format as you would for text-based questions - make it educational and SEE-exam focused."""
+    return [
+        {
+            "role": "user",
+            "parts": [
+                {"text": vision_prompt},
+                {
+                    "inline_data": {
+                        "mime_type": mime_type,
+                        "data": image_data
+                    }
+                }
+            ]
+        }
+    ]
+
+VISION_IMAGE_PLACEHOLDER = "__VEXARA_IMAGE__"
+# Multiple of 3 bytes, so slices base64-encode without padding and concatenate cleanly
+VISION_ENCODE_CHUNK = 3 * 64 * 1024
+
+def build_vision_request(caption, image_bytes, mime_type="image/jpeg", build_messages=build_vision_messages):
+    """
+    Encodes a Gemini Vision request once, as (payload, body). `body` is the JSON request as bytes
+    with the image base64-encoded into it slice by slice, so no separate base64 or JSON str copy
+    of the image is built; `payload` is the request with a placeholder in place of the image,
+    for logging and the rate limiter's token estimate.
+    """
+    payload = build_gemini_payload(build_messages(caption, VISION_IMAGE_PLACEHOLDER, mime_type))
+    head, tail = json.dumps(payload).encode('utf-8').split(VISION_IMAGE_PLACEHOLDER.encode('ascii'), 1)
+    view = memoryview(image_bytes)
+    parts = [head]
+    for start in range(0, len(view), VISION_ENCODE_CHUNK):
+        parts.append(base64.standard_b64encode(view[start:start + VISION_ENCODE_CHUNK]))
+    parts.append(tail)
+    return payload, b"".join(parts)
+
+def ocr_instruction(caption, ocr_text):
+    """Turns the OCR text of an uploaded image into a question for the text path."""
+    instruction = f"Solve this problem from my uploaded image:\n{ocr_text}"
+    if caption:
+        instruction += f"\n\nMy note: {caption}"
+    return instruction
+
+def image_upload_message(caption, ocr=None):
+    """The user turn stored for an image upload (with the OCR text, so follow-ups have it as context)."""
+    message = f"[Image Upload] {caption if caption else 'Math problem image'}"
+    if ocr:
+        message += f"\n{ocr.text}"
+    return message
+
+def find_cached_image_answer(prepared, caption, ocr=None):
+    """
+    Looks up a solved upload of the same image and caption: byte-identical, or (given what OCR
+    read from it) a near-duplicate with the same OCR text, see image_cache.
+    """
+    if not IMAGE_CACHE_ENABLED:
+        return None
+    if ocr is None:
+        answer, match = image_cache.lookup(prepared.sha256, caption, SEE_PROMPT_VERSION), "exact"
+    else:
+        answer, match = image_cache.lookup_near_duplicate(prepared.phash, ocr.text, caption, SEE_PROMPT_VERSION), "near-duplicate"
+    if answer:
+        log.info("Image cache (%s) hit for caption: %r", match, caption[:50])
+    return answer
+
+def remember_image_answer(prepared, caption, answer, ocr=None):
+    if IMAGE_CACHE_ENABLED:
+        image_cache.put(prepared.sha256, prepared.phash, caption, answer, SEE_PROMPT_VERSION,
+                        image_data=prepared.data, mime_type=prepared.mime_type,
+                        ocr_text=ocr.text if ocr else None)
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": too_large_message()}), 413
+
+def save_image_answer(user_id, chat_id, generation, caption, ocr, text, completed):
+    """Saves both turns of an image upload (see save_generated_answer); an upload with no answer is not counted."""
+    if text:
+        append_chat_message(user_id, chat_id, {"type": "user", "text": image_upload_message(caption, ocr), "timestamp": time.time()})
+    else:
+        refund_daily_message(user_id)
+    save_generated_answer(user_id, chat_id, generation, text, completed)
+
 @app.route('/upload_image', methods=['POST'])
 def upload_image_endpoint():
     """Handle image upload and vision-based math problem solving."""
@@ -670,109 +1045,250 @@ def upload_image_endpoint():
     if file.filename == '':
         return jsonify({"error": "No file selected."}), 400
     
-    if not file.filename.lower().endswith(('png', 'jpg', 'jpeg', 'gif', 'webp')):
+    if not file.filename.lower().endswith(ALLOWED_IMAGE_EXTENSIONS):
         return jsonify({"error": "File must be an image (PNG, JPG, GIF, WebP)."}), 400
     
-    # Check quota
-    current_message_count = get_daily_message_count(user_id)
-    if current_message_count >= DAILY_MESSAGE_LIMIT:
-        return jsonify({"response": f"You have reached your daily message limit of {DAILY_MESSAGE_LIMIT}. Please try again tomorrow."}), 429
+    trace = RequestTrace("upload_image", "vision")
+    # Check and count quota; refunded below if the image produces no answer
+    with trace.stage("quota_check"):
+        allowed = consume_daily_message(user_id)
+    if not allowed:
+        trace.finish("quota_exceeded")
+        return jsonify({"response": DAILY_LIMIT_MESSAGE}), 429
     
-    # READ FILE IMMEDIATELY (before generator starts)
+    # SHRINK THE IMAGE IMMEDIATELY (before generator starts), reading it from the upload's spool file
     try:
-        image_data = base64.standard_b64encode(file.read()).decode('utf-8')
+        with trace.stage("image_prepare"):
+            prepared = prepare_upload(file.stream)
+    except UploadTooLarge as e:
+        refund_daily_message(user_id)
+        trace.finish("rejected")
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
-        print(f"Error reading file: {e}")
+        log.error("Error reading file: %s", e)
+        refund_daily_message(user_id)
+        trace.finish("rejected")
         return jsonify({"error": f"Error reading image file: {str(e)}"}), 400
+    log.info("%s", describe_image(prepared))
+    # The same page uploaded before is answered from the image cache, skipping OCR and vision
+    cached_answer = find_cached_image_answer(prepared, caption)
+    # Cleanly printed problems are read locally and answered by the cheaper text path
+    with trace.stage("ocr"):
+        ocr = None if cached_answer else read_printed_problem(prepared.data)
+    if ocr:
+        cached_answer = find_cached_image_answer(prepared, caption, ocr)
+    trace.model_choice = 'cache' if cached_answer else 'ocr' if ocr else 'vision'
     
     def stream_image_response():
-        """Stream the vision processing response."""
+        """Streams the answer: cached, the OCR text path when it read the image confidently, otherwise vision."""
+        generation = generation_registry.start(user_id, chat_id)
+        full_response = ""
+        completed = False
         try:
-            # Build the message with image
-            current_chat_history = load_chat_history_from_file(user_id, chat_id)
+            if cached_answer:
+                trace.provider = "cache"
+                for chunk in coalesce(chunk_text(cached_answer)):
+                    full_response += chunk
+                    yield token_event(chunk)
+            elif ocr:
+                with trace.stage("history_load"):
+                    chat_history, summary = load_chat_context(user_id, chat_id)
+                instruction = ocr_instruction(caption, ocr.text)
+                answer = stream_text_answer(chat_history, summary, instruction, "general", generation, trace=trace)
+                for chunk in coalesce(answer):
+                    if generation.is_set():
+                        break
+                    full_response += chunk
+                    yield token_event(chunk)
+                if not full_response and not generation.is_set():
+                    log.warning("OCR text path produced no answer, using the vision model...")
             
-            # Create vision prompt
-            vision_prompt = f"""You are a math tutor specializing in SEE exam preparation for Class 10 students in Nepal.
-
-A student has uploaded an image of a math problem. Your task is to:
-1. Analyze the image and identify the math problem
-2. Explain what the problem is asking (in simple terms)
-3. Solve it step-by-step
-4. Explain the concept behind it
-5. Provide the final answer clearly
-
-The student's caption/note about this problem: {caption if caption else 'None provided'}
-
-Follow the same format as you would for text-based questions - make it educational and SEE-exam focused."""
-            
-            # Call Gemini Vision API
-            print(f"[DEBUG] Processing image for math problem solving...")
-            
-            vision_messages = [
-                {
-                    "role": "user",
-                    "parts": [
-                        {"text": vision_prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": image_data
-                            }
-                        }
-                    ]
-                }
-            ]
-            
-            # Call Gemini with vision
-            vision_response = call_gemini_api(vision_messages, stream=False)
+            if not full_response and not generation.is_set():
+                # Call Gemini Vision API
+                log.debug("Processing image for math problem solving...")
+                
+                # Call Gemini with vision, streaming the answer as it is generated. The request is
+                # passed inline so stream_gemini holds the only reference and can free it once sent
+                trace.provider = "gemini"
+                vision_started = time.perf_counter()
+                vision_stream = stream_gemini(
+                    None, on_open=generation.watch, cancel=generation,
+                    encoded=build_vision_request(caption, prepared.data, prepared.mime_type),
+                )
+                for chunk in coalesce(vision_stream):
+                    if generation.is_set():
+                        break
+                    if not full_response:
+                        trace.observe("first_token", time.perf_counter() - vision_started)
+                    full_response += chunk
+                    yield token_event(chunk)
             
-            if not vision_response or vision_response.status_code != 200:
-                yield f"Error: Could not process image. Status: {vision_response.status_code if vision_response else 'None'}"
+            if not full_response and not generation.is_set():
+                yield error_event("Could not process image. No text extracted from image analysis.")
                 return
+            completed = not generation.is_set()
             
-            try:
-                data = vision_response.json()
-                
-                if 'candidates' in data and len(data['candidates']) > 0:
-                    candidate = data['candidates'][0]
-                    if 'content' in candidate and 'parts' in candidate['content']:
-                        for part in candidate['content']['parts']:
-                            if 'text' in part:
-                                full_response = part['text']
-                                
-                                # Save to chat history
-                                user_message = f"[Image Upload] {caption if caption else 'Math problem image'}"
-                                current_chat_history.append({"type": "user", "text": user_message, "timestamp": time.time()})
-                                current_chat_history.append({"type": "bot", "text": full_response, "timestamp": time.time()})
-                                save_chat_history_to_file(user_id, chat_id, current_chat_history)
-                                
-                                # Increment quota
-                                increment_daily_message_count(user_id)
-                                
-                                # Stream the response
-                                words = full_response.split(' ')
-                                chunk = ""
-                                for word in words:
-                                    chunk += word + " "
-                                    if len(chunk) > 50:
-                                        yield chunk
-                                        chunk = ""
-                                if chunk:
-                                    yield chunk
-                                return
-                
-                yield "Error: No text extracted from image analysis."
-            except Exception as e:
-                print(f"Vision response parse error: {e}")
-                yield f"Error parsing vision response: {str(e)}"
+            if completed and not cached_answer:
+                remember_image_answer(prepared, caption, full_response, ocr)
+            yield answer_done_event(trace, full_response, completed)
         
         except Exception as e:
-            print(f"Image processing error: {e}")
-            import traceback
-            traceback.print_exc()
-            yield f"Error: {str(e)}"
+            log.exception("Image processing error: %s", e)
+            yield error_event(str(e))
+        finally:
+            with trace.stage("history_save"):
+                save_image_answer(user_id, chat_id, generation, caption, ocr, full_response, completed)
+            trace.finish(answer_outcome(generation, full_response, completed))
     
-    return app.response_class(stream_image_response(), mimetype='text/event-stream')
+    response = app.response_class(stream_image_response(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.headers['X-Image-Bytes-Saved'] = str(prepared.bytes_saved)
+    response.headers['X-Image-Route'] = 'cache' if cached_answer else 'ocr' if ocr else 'vision'
+    return response
+
+# --- WEB SEARCH ENDPOINT ---
+@app.route('/web_search', methods=['POST'])
+def web_search_endpoint():
+    """Searches the web and returns the top results as markdown (plus the raw results)."""
+    user_id = get_user_id()
+    data = request.get_json(silent=True) or request.form
+    query = (data.get('q') or '').strip()
+    if not query:
+        return jsonify({"error": "No search query provided."}), 400
+    if not consume_daily_message(user_id):
+        return jsonify({"response": DAILY_LIMIT_MESSAGE}), 429
+    results = start_search(query).results()
+    if not results:
+        refund_daily_message(user_id)
+        return jsonify({"error": "Web search is unavailable right now. Please try again."}), 503
+    links = [{key: r[key] for key in ("title", "link", "snippet")} for r in results]
+    return jsonify({"response": format_results_markdown(results), "results": links})
+
+# --- TEXT TO SPEECH ---
+speech = SpeechSynthesizer()
+
+@app.route('/stream_tts', methods=['POST'])
+def stream_tts_endpoint():
+    """Streams the text as one WAV file per sentence, so playback can start after the first one."""
+    data = request.get_json(silent=True) or request.form
+    text = (data.get('text') or '').strip()[:TTS_MAX_CHARS]
+    if not text:
+        return jsonify({"error": "No text provided."}), 400
+    if not speech.available():
+        return jsonify({"error": "Text to speech is not available."}), 503
+    sentences = split_sentences(text)
+    response = app.response_class(speech.stream_wav(sentences), mimetype='audio/wav')
+    response.headers['X-TTS-Sentences'] = str(len(sentences))
+    return response
+
+@app.route('/debug/tts', methods=['GET'])
+def debug_tts():
+    """Sentences synthesized, phrase cache hits and the average time to the first audio."""
+    return jsonify(speech.stats())
+
+# --- GENERATION CANCELLATION ---
+@app.route('/stop_generation', methods=['POST'])
+def stop_generation_endpoint():
+    """Stops the answer being streamed for a chat (sent by the page's stop button)."""
+    user_id = get_user_id()
+    data = request.get_json(silent=True) or request.form
+    chat_id = data.get('chat_id')
+    if not chat_id:
+        return jsonify({"error": "Chat ID not provided."}), 400
+    stopped = generation_registry.cancel(user_id, chat_id)
+    return jsonify({"status": "success", "stopped": stopped})
+
+@app.route('/debug/generation-stats', methods=['GET'])
+def debug_generation_stats():
+    """Completed and stopped answers, with the tokens and seconds an early stop saved (estimated)."""
+    return jsonify(generation_registry.stats())
+
+@app.route('/debug/answer-jobs', methods=['GET'])
+def debug_answer_jobs():
+    """Answer jobs started, attached to and resumed, and the ones still buffered."""
+    return jsonify(answer_jobs.stats())
+
+# --- SCREEN SHARE ENDPOINT ---
+SCREEN_INSTRUCTION_MAX_CHARS = 500
+DEFAULT_SCREEN_INSTRUCTION = "Look at my screen and help me with the math problem shown."
+
+def build_screen_messages(instruction, image_data, mime_type="image/jpeg"):
+    """Builds the Gemini Vision request for a shared-screen frame (base64 `image_data`)."""
+    screen_prompt = f"""The student is sharing their screen with you while they study.
+
+{instruction}
+
+Only describe what matters for that request. If the screen shows nothing relevant, reply with a single short sentence."""
+    return [
+        {
+            "role": "user",
+            "parts": [
+                {"text": screen_prompt},
+                {"inline_data": {"mime_type": mime_type, "data": image_data}}
+            ]
+        }
+    ]
+
+@app.route('/process_screen_frame', methods=['POST'])
+def process_screen_frame_endpoint():
+    """
+    Analyzes a shared-screen frame, skipping frames that show nothing new (see screen_frames).
+    Always returns `next_interval_ms`, the sampling interval the client should use next.
+    """
+    user_id = get_user_id()
+    chat_id = request.form.get('chat_id')
+    instruction = (request.form.get('instruction') or DEFAULT_SCREEN_INSTRUCTION).strip()[:SCREEN_INSTRUCTION_MAX_CHARS]
+    if not chat_id:
+        return jsonify({"error": "Chat ID not provided."}), 400
+    
+    # The page sends the frame as base64 JPEG in a form field; a file upload works too
+    try:
+        if 'image' in request.files:
+            frame = request.files['image'].stream
+        else:
+            frame = io.BytesIO(base64.b64decode(request.form.get('image', ''), validate=True))
+        # Only the thumbnail is needed to decide; most frames are never fully decoded
+        thumbnail = frame_thumbnail(Image.open(frame))
+    except Exception as e:
+        return jsonify({"error": f"Error reading screen frame: {str(e)}"}), 400
+    
+    session_key = (user_id, chat_id)
+    decision = screen_tracker.observe(session_key, thumbnail)
+    if not decision.analyze:
+        return jsonify({"response": None, "skipped": decision.reason, "next_interval_ms": decision.next_interval})
+    
+    ok = False
+    counted = False
+    try:
+        if not consume_daily_message(user_id):
+            return jsonify({"response": DAILY_LIMIT_MESSAGE, "next_interval_ms": SCREEN_FRAME_MAX_INTERVAL}), 429
+        counted = True
+        try:
+            prepared = prepare_upload(frame)
+        except UploadTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        except Exception as e:
+            log.error("Error reading screen frame: %s", e)
+            return jsonify({"error": f"Error reading screen frame: {str(e)}"}), 400
+        encoded = build_vision_request(instruction, prepared.data, prepared.mime_type, build_screen_messages)
+        try:
+            answer = "".join(stream_gemini(None, encoded=encoded))
+        except Exception as e:
+            log.error("Screen frame analysis failed: %s", e)
+            answer = ""
+        if not answer:
+            return jsonify({"error": "Could not analyze the screen.", "next_interval_ms": decision.next_interval}), 502
+        ok = True
+        return jsonify({"response": answer, "next_interval_ms": decision.next_interval})
+    finally:
+        # A frame that got no answer (rejected, unreadable, or the provider failed) is not counted
+        if counted and not ok:
+            refund_daily_message(user_id)
+        screen_tracker.finish(session_key, ok)
+
+@app.route('/debug/screen-frames', methods=['GET'])
+def debug_screen_frames():
+    """Screen share frames received, analyzed and skipped (by reason)."""
+    return jsonify(screen_tracker.stats())
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
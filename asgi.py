@@ -0,0 +1,404 @@
+"""
+ASGI serving mode for Vexara.
+
+/ask, /answer_stream and /upload_image run as async endpoints whose answers are generated by
+tasks and async generators fed by async upstream clients, so a worker waiting on
+Gemini/Groq/OpenRouter is not blocked and one process can hold hundreds of in-flight streams. Every other route is served by the Flask app
+from api.py, mounted as WSGI. Sessions use Flask's signed session cookie, so both halves see
+the same user.
+
+Run with:
+    gunicorn -k uvicorn_worker.UvicornWorker -b 0.0.0.0:10000 asgi:app
+"""
+import asyncio
+import contextlib
+import time
+import uuid
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import api
+from answer_jobs import parse_event_id
+from async_providers import astream_gemini, astream_groq, astream_openrouter, close_clients
+from image_preprocess import UploadTooLarge, describe as describe_image, prepare_upload_async, too_large_message
+from ocr_fastpath import read_printed_problem_async
+from provider_router import aroute_stream
+from sse import SSE_HEADERS, acoalesce, coalesce, error_event, token_event
+from telemetry import RequestTrace, log
+from web_search import start_search
+
+flask_app = api.app
+
+
+# --- SESSION (shared with Flask) ---
+def _session_serializer():
+    return flask_app.session_interface.get_signing_serializer(flask_app)
+
+
+def load_session(request):
+    """Reads the Flask session cookie; returns an empty session if it is missing or invalid."""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return {}
+    try:
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        return dict(_session_serializer().loads(cookie, max_age=max_age))
+    except BadSignature:
+        return {}
+
+
+def get_user_id(session):
+    """Async-mode counterpart of api.get_user_id. Returns (user_id, session_changed)."""
+    if 'user_id' in session:
+        return session['user_id'], False
+    if 'temp_user_id' not in session:
+        session['temp_user_id'] = str(uuid.uuid4())
+        session['user_id'] = session['temp_user_id']
+        return session['temp_user_id'], True
+    return session['temp_user_id'], False
+
+
+def with_session(response, session, changed):
+    """Writes the session cookie back when a new guest id was assigned."""
+    if changed:
+        response.set_cookie(
+            flask_app.config['SESSION_COOKIE_NAME'],
+            _session_serializer().dumps(session),
+            path=flask_app.config['SESSION_COOKIE_PATH'] or '/',
+            httponly=flask_app.config['SESSION_COOKIE_HTTPONLY'],
+            secure=flask_app.config['SESSION_COOKIE_SECURE'],
+            samesite=flask_app.config['SESSION_COOKIE_SAMESITE'] or 'lax',
+        )
+    return response
+
+
+def build_provider_candidates(model_choice, gemini_messages, completion_messages):
+    """Async counterpart of api.build_provider_candidates."""
+    if model_choice == "deep_think":
+        return [
+            ("openrouter", lambda on_open: astream_openrouter(completion_messages, api.OPENROUTER_DEEPTHINK_MODEL, on_open)),
+            ("gemini", lambda on_open: astream_gemini(gemini_messages, on_open=on_open)),
+        ]
+    if model_choice == "general":
+        return [
+            ("gemini", lambda on_open: astream_gemini(gemini_messages, on_open=on_open)),
+            ("groq", lambda on_open: astream_groq(completion_messages, on_open)),
+        ]
+    return []
+
+
+async def stop_on_cancel(chunks, generation):
+    """
+    Yields from an async stream until `generation` is cancelled, even while waiting for the next
+    chunk: the pending read is cancelled, which closes the upstream response right away.
+    """
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    generation.add_callback(lambda: loop.call_soon_threadsafe(stopped.set))
+    stop_wait = asyncio.ensure_future(stopped.wait())
+    iterator = chunks.__aiter__()
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({next_chunk, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                next_chunk.cancel()
+                with contextlib.suppress(asyncio.CancelledError, StopAsyncIteration):
+                    await next_chunk
+                return
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        stop_wait.cancel()
+        await iterator.aclose()
+
+
+async def stream_text_answer(chat_history, summary, instruction, model_choice, cancel=None, search=None, trace=None):
+    """Async counterpart of api.stream_text_answer."""
+    trace = trace or RequestTrace("ask", api.trace_model_choice(model_choice))
+    if search is None:
+        # Cache lookups may do file I/O and vector scoring, so keep them off the event loop
+        with trace.stage("cache_lookup"):
+            cached_answer, cache_source = await run_in_threadpool(
+                api.find_cached_answer, chat_history, instruction, model_choice
+            )
+        if cached_answer:
+            log.info("Answer cache (%s) hit for: %s...", cache_source, instruction[:50])
+            trace.provider = "cache"
+            for chunk in api.chunk_text(cached_answer):
+                yield chunk
+            return
+
+    web_results = None
+    if search is not None:
+        with trace.stage("web_search"):
+            web_results = await search.results_async()
+    with trace.stage("message_build"):
+        gemini_messages, completion_messages = api.build_context_messages(
+            chat_history, instruction, model_choice, summary, web_results
+        )
+    log.info("Using %s model for: %s...", model_choice, instruction[:50])
+    if search is None and api.SINGLEFLIGHT_ENABLED and api.is_cacheable(chat_history, instruction):
+        flight, leader = api.flights.join(api.flight_key(instruction, model_choice))
+        if leader:
+            candidates = build_provider_candidates(model_choice, gemini_messages, completion_messages)
+
+            async def on_landed(text):
+                await run_in_threadpool(api.remember_answer, chat_history, instruction, model_choice, text)
+
+            api.flights.afly(flight, stop_on_cancel(aroute_stream(candidates, trace=trace), flight.cancel), on_landed)
+        else:
+            log.info("Following the in-flight answer for: %s...", instruction[:50])
+            trace.provider = "singleflight"
+        # Closed with this stream, so a stopped request stops following at once
+        async with contextlib.aclosing(flight.afollow()) as chunks:
+            async for chunk in chunks:
+                yield chunk
+        return
+    full_response = ""
+    candidates = build_provider_candidates(model_choice, gemini_messages, completion_messages)
+    async for chunk in aroute_stream(candidates, trace=trace):
+        full_response += chunk
+        yield chunk
+    if full_response and search is None and not (cancel is not None and cancel.is_set()):
+        await run_in_threadpool(api.remember_answer, chat_history, instruction, model_choice, full_response)
+
+
+# --- MAIN /ask ENDPOINT (ASYNC) ---
+def answer_stream_response(job, offset, session, session_changed):
+    """Async api.answer_stream_response."""
+    response = StreamingResponse(job.afollow(offset), media_type='text/event-stream', headers=SSE_HEADERS)
+    response.headers['X-Message-Id'] = job.key[2]
+    return with_session(response, session, session_changed)
+
+
+async def ask_endpoint(request):
+    """Async /ask: same behaviour as api.ask_endpoint without pinning a worker on upstream waits."""
+    session = load_session(request)
+    user_id, session_changed = get_user_id(session)
+    form = await request.form()
+    chat_id = form.get('chat_id')
+    instruction = (form.get('instruction') or '').strip()
+    model_choice = form.get('model_choice', 'general')
+    web_search_enabled = (form.get('web_search') or 'false').lower() == 'true'
+    message_id = form.get('message_id') or uuid.uuid4().hex
+
+    if not chat_id:
+        return with_session(JSONResponse({"error": "Chat ID not provided."}, 400), session, session_changed)
+    if not instruction:
+        return with_session(JSONResponse({"error": "No instruction provided."}, 400), session, session_changed)
+
+    # A retried request for the same message attaches to its answer instead of asking again
+    job = api.answer_jobs.get((user_id, chat_id, message_id))
+    if job is not None:
+        offset = parse_event_id(request.headers.get('last-event-id'))
+        return answer_stream_response(job, offset, session, session_changed)
+
+    trace = RequestTrace("ask", api.trace_model_choice(model_choice))
+    # Check and count quota in one step, so concurrent requests can't overshoot the limit
+    with trace.stage("quota_check"):
+        allowed = await run_in_threadpool(api.consume_daily_message, user_id)
+    if not allowed:
+        trace.finish("quota_exceeded")
+        return with_session(JSONResponse({"response": api.DAILY_LIMIT_MESSAGE}, 429), session, session_changed)
+
+    # Search in the background while the chat is loaded and the prompt is built
+    search = start_search(instruction) if web_search_enabled else None
+
+    # Chat store I/O is blocking, so keep it off the event loop
+    with trace.stage("history_load"):
+        current_chat_history, summary = await run_in_threadpool(api.load_chat_context, user_id, chat_id)
+    with trace.stage("history_save"):
+        await run_in_threadpool(
+            api.append_chat_message, user_id, chat_id, {"type": "user", "text": instruction, "timestamp": time.time()}
+        )
+
+    async def generate_response(job):
+        """Generates the answer into the job, as a task of its own."""
+        generation = job.generation
+        full_response = ""
+        completed = False
+        try:
+            answer = stream_text_answer(
+                current_chat_history, summary, instruction, model_choice, generation, search, trace
+            )
+            async for chunk in acoalesce(stop_on_cancel(answer, generation)):
+                full_response += chunk
+                job.token(chunk)
+
+            if not full_response and not generation.is_set():
+                job.end(error_event("Could not get a response from AI models. Please try again."))
+                return
+            completed = not generation.is_set()
+            job.end(api.answer_done_event(trace, full_response, completed))
+
+        except Exception as e:
+            log.exception("Error in /ask: %s", e)
+            job.end(error_event(str(e)))
+        finally:
+            # Not awaited: this also runs when the task is cancelled at shutdown
+            with trace.stage("history_save"):
+                api.save_generated_answer(user_id, chat_id, generation, full_response, completed)
+            trace.finish(api.answer_outcome(generation, full_response, completed))
+
+    job = api.answer_jobs.start((user_id, chat_id, message_id), api.generation_registry.start(user_id, chat_id))
+    # Kept on the job: the loop only holds weak references to tasks
+    job.task = asyncio.ensure_future(job.arun(generate_response))
+    return answer_stream_response(job, 0, session, session_changed)
+
+
+async def answer_stream_endpoint(request):
+    """Async api.answer_stream_endpoint."""
+    session = load_session(request)
+    user_id, session_changed = get_user_id(session)
+    key = (user_id, request.path_params['chat_id'], request.path_params['message_id'])
+    job = api.answer_jobs.get(key, resumed=True)
+    if job is None:
+        error = "No answer for this message; it is in the chat history once finished."
+        return with_session(JSONResponse({"error": error}, 404), session, session_changed)
+    offset = parse_event_id(request.headers.get('last-event-id') or request.query_params.get('last_event_id'))
+    return answer_stream_response(job, offset, session, session_changed)
+
+
+# --- IMAGE UPLOAD & VISION ENDPOINT (ASYNC) ---
+async def upload_image_endpoint(request):
+    """Async /upload_image: same behaviour as api.upload_image_endpoint."""
+    session = load_session(request)
+    user_id, session_changed = get_user_id(session)
+
+    def error(message, status=400):
+        return with_session(JSONResponse({"error": message}, status), session, session_changed)
+
+    # Same limit as Flask's MAX_CONTENT_LENGTH: reject before the body is read and spooled
+    if int(request.headers.get('content-length') or 0) > flask_app.config['MAX_CONTENT_LENGTH']:
+        return error(too_large_message(), 413)
+    form = await request.form()
+    chat_id = form.get('chat_id')
+    caption = (form.get('caption') or '').strip()
+
+    if not chat_id:
+        return error("Chat ID not provided.")
+
+    file = form.get('image')
+    if file is None or isinstance(file, str):
+        return error("No image file provided.")
+    if not file.filename:
+        return error("No file selected.")
+    if not file.filename.lower().endswith(api.ALLOWED_IMAGE_EXTENSIONS):
+        return error("File must be an image (PNG, JPG, GIF, WebP).")
+
+    trace = RequestTrace("upload_image", "vision")
+    # Check and count quota; refunded below if the image produces no answer
+    with trace.stage("quota_check"):
+        allowed = await run_in_threadpool(api.consume_daily_message, user_id)
+    if not allowed:
+        trace.finish("quota_exceeded")
+        return with_session(JSONResponse({"response": api.DAILY_LIMIT_MESSAGE}, 429), session, session_changed)
+
+    try:
+        # Read from the spool file Starlette parsed the upload into, not as one bytes object
+        with trace.stage("image_prepare"):
+            prepared = await prepare_upload_async(file.file)
+    except UploadTooLarge as e:
+        await run_in_threadpool(api.refund_daily_message, user_id)
+        trace.finish("rejected")
+        return error(str(e), 413)
+    except Exception as e:
+        log.error("Error reading file: %s", e)
+        await run_in_threadpool(api.refund_daily_message, user_id)
+        trace.finish("rejected")
+        return error(f"Error reading image file: {str(e)}")
+    log.info("%s", describe_image(prepared))
+    # The same page uploaded before is answered from the image cache, skipping OCR and vision
+    cached_answer = await run_in_threadpool(api.find_cached_image_answer, prepared, caption)
+    # Cleanly printed problems are read locally and answered by the cheaper text path
+    with trace.stage("ocr"):
+        ocr = None if cached_answer else await read_printed_problem_async(prepared.data)
+    if ocr:
+        cached_answer = await run_in_threadpool(api.find_cached_image_answer, prepared, caption, ocr)
+    trace.model_choice = 'cache' if cached_answer else 'ocr' if ocr else 'vision'
+
+    async def stream_image_response():
+        """Async counterpart of api's stream_image_response (cached, OCR text path, else vision)."""
+        generation = api.generation_registry.start(user_id, chat_id)
+        full_response = ""
+        completed = False
+        try:
+            if cached_answer:
+                trace.provider = "cache"
+                for chunk in coalesce(api.chunk_text(cached_answer)):
+                    full_response += chunk
+                    yield token_event(chunk)
+            elif ocr:
+                with trace.stage("history_load"):
+                    chat_history, summary = await run_in_threadpool(api.load_chat_context, user_id, chat_id)
+                instruction = api.ocr_instruction(caption, ocr.text)
+                answer = stream_text_answer(chat_history, summary, instruction, "general", generation, trace=trace)
+                async for chunk in acoalesce(stop_on_cancel(answer, generation)):
+                    full_response += chunk
+                    yield token_event(chunk)
+                if not full_response and not generation.is_set():
+                    log.warning("OCR text path produced no answer, using the vision model...")
+
+            if not full_response and not generation.is_set():
+                log.debug("Processing image for math problem solving...")
+                trace.provider = "gemini"
+                vision_started = time.perf_counter()
+                # Passed inline so astream_gemini holds the only reference and can free it once sent
+                answer = astream_gemini(None, encoded=api.build_vision_request(caption, prepared.data, prepared.mime_type))
+                async for chunk in acoalesce(stop_on_cancel(answer, generation)):
+                    if not full_response:
+                        trace.observe("first_token", time.perf_counter() - vision_started)
+                    full_response += chunk
+                    yield token_event(chunk)
+
+            if not full_response and not generation.is_set():
+                yield error_event("Could not process image. No text extracted from image analysis.")
+                return
+            completed = not generation.is_set()
+
+            if completed and not cached_answer:
+                await run_in_threadpool(api.remember_image_answer, prepared, caption, full_response, ocr)
+            yield api.answer_done_event(trace, full_response, completed)
+
+        except Exception as e:
+            log.exception("Image processing error: %s", e)
+            yield error_event(str(e))
+        finally:
+            # Not awaited: this also runs when the client disconnects and the task is cancelled
+            with trace.stage("history_save"):
+                api.save_image_answer(user_id, chat_id, generation, caption, ocr, full_response, completed)
+            trace.finish(api.answer_outcome(generation, full_response, completed))
+
+    response = StreamingResponse(stream_image_response(), media_type='text/event-stream', headers=SSE_HEADERS)
+    response.headers['X-Image-Bytes-Saved'] = str(prepared.bytes_saved)
+    response.headers['X-Image-Route'] = 'cache' if cached_answer else 'ocr' if ocr else 'vision'
+    return with_session(response, session, session_changed)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await close_clients()
+
+
+app = Starlette(
+    routes=[
+        Route('/ask', ask_endpoint, methods=['POST']),
+        Route('/answer_stream/{chat_id}/{message_id}', answer_stream_endpoint, methods=['GET']),
+        Route('/upload_image', upload_image_endpoint, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
@@ -0,0 +1,171 @@
+"""
+Async upstream clients for Gemini, Groq and OpenRouter, used by the ASGI serving mode (asgi.py).
+
+Request bodies, headers and SSE parsing are shared with the sync clients in api.py, and
+pool sizes, timeouts and retry/backoff settings come from provider_client, so both serving
+modes talk to the providers the same way.
+"""
+import asyncio
+import contextlib
+
+import httpx
+
+import api
+import provider_client
+import rate_limiter
+from telemetry import log
+
+_clients = {}
+
+
+def get_client(provider):
+    """Returns the provider's keep-alive AsyncClient (created lazily inside the running event loop)."""
+    client = _clients.get(provider)
+    if client is None:
+        client = _clients[provider] = httpx.AsyncClient(
+            timeout=httpx.Timeout(provider_client.PROVIDER_READ_TIMEOUT, connect=provider_client.PROVIDER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=provider_client.PROVIDER_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=provider_client.PROVIDER_POOL_SIZE,
+            ),
+        )
+    return client
+
+
+async def close_clients():
+    for provider in list(_clients):
+        await _clients.pop(provider).aclose()
+
+
+def _connection_tracer(provider):
+    """httpcore trace hook that counts newly opened connections for the pool stats."""
+    async def trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            provider_client.record_async_event(provider, "new_connections")
+    return trace
+
+
+@contextlib.asynccontextmanager
+async def post_stream(provider, url, rate_limit_payload=None, **kwargs):
+    """
+    Opens a streaming POST through the provider's pool, retrying 5xx and connect errors with
+    backoff (a 429 is returned at once, see provider_client). Waits for the provider's rate limiter first (raising RateLimitExceeded if it has no capacity).
+    """
+    client = get_client(provider)
+    await rate_limiter.acquire_async(provider, rate_limit_payload or kwargs.get("json"))
+    attempt = 0
+    while True:
+        request = client.build_request("POST", url, extensions={"trace": _connection_tracer(provider)}, **kwargs)
+        provider_client.record_async_event(provider, "requests")
+        try:
+            response = await client.send(request, stream=True)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if attempt >= provider_client.PROVIDER_MAX_RETRIES:
+                raise
+            await asyncio.sleep(provider_client.retry_delay(attempt))
+            attempt += 1
+            continue
+        rate_limiter.observe(provider, response.status_code, response.headers)
+        if response.status_code in provider_client.RETRY_STATUS_CODES and attempt < provider_client.PROVIDER_MAX_RETRIES:
+            delay = provider_client.retry_delay(attempt, response.headers.get("Retry-After"))
+            await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        break
+    try:
+        yield response
+    finally:
+        await response.aclose()
+
+
+async def _aiter_sse_data(response):
+    async for line in response.aiter_lines():
+        data = api.parse_sse_line(line)
+        if data is not None:
+            yield data
+
+
+async def astream_chat_completion(provider, url, payload, headers, on_open=None):
+    """Yields content deltas from an OpenAI-compatible streaming endpoint."""
+    try:
+        async with post_stream(provider, url, json=payload, headers=headers) as response:
+            if on_open:
+                on_open(response)
+            if response.status_code != 200:
+                body = await response.aread()
+                log.warning("%s API error: status %s: %r", provider, response.status_code, body[:500])
+                return
+            async for data in _aiter_sse_data(response):
+                chunk = api.extract_chat_completion_delta(data)
+                if chunk:
+                    yield chunk
+    except httpx.HTTPError as e:
+        log.error("%s API error: %s", provider, e)
+
+
+def astream_groq(messages, on_open=None):
+    payload = api.build_chat_completion_payload(api.GROQ_MODEL, messages, stream=True)
+    return astream_chat_completion("groq", api.GROQ_API_URL, payload, api.groq_headers(), on_open)
+
+
+def astream_openrouter(messages, model, on_open=None):
+    payload = api.build_chat_completion_payload(model, messages, stream=True)
+    return astream_chat_completion("openrouter", api.OPENROUTER_API_URL, payload, api.openrouter_headers(), on_open)
+
+
+def _gemini_request_kwargs(messages, encoded):
+    if encoded:
+        payload, body = encoded
+        return {"content": body, "headers": {"Content-Type": "application/json"}, "rate_limit_payload": payload}
+    return {"json": api.build_gemini_payload(messages)}
+
+
+async def astream_gemini(messages, encoded=None, on_open=None):
+    """
+    Async counterpart of api.stream_gemini: streams via streamGenerateContent and falls
+    back to a blocking generateContent call if streaming fails before the first chunk.
+    `on_open(response)` is called with each upstream response (the router times the connect).
+    """
+    request_kwargs = _gemini_request_kwargs(messages, encoded)
+    if api.GEMINI_STREAMING:
+        received = False
+        try:
+            async with post_stream("gemini", api.gemini_url(stream=True), **request_kwargs) as response:
+                if on_open:
+                    on_open(response)
+                if response.status_code == 200:
+                    async for data in _aiter_sse_data(response):
+                        text = api.extract_gemini_text(data)
+                        if text:
+                            # No fallback request will be sent; drop our reference to the request body
+                            encoded = request_kwargs = None
+                            received = True
+                            yield text
+                else:
+                    body = await response.aread()
+                    log.warning("Gemini API error: status %s: %r", response.status_code, body[:500])
+        except httpx.HTTPError as e:
+            log.error("Gemini streaming error: %s", e)
+        if received:
+            return
+        log.warning("Gemini streaming produced nothing, falling back to generateContent...")
+
+    try:
+        async with post_stream("gemini", api.gemini_url(stream=False), **request_kwargs) as response:
+            if on_open:
+                on_open(response)
+            await response.aread()
+    except httpx.HTTPError as e:
+        log.error("Gemini API error: %s", e)
+        return
+    if response.status_code != 200:
+        log.warning("Gemini API error: status %s: %s", response.status_code, response.text[:500])
+        return
+    try:
+        text = api.extract_gemini_text(response.json())
+    except ValueError as e:
+        log.error("Gemini JSON parse error: %s", e)
+        return
+    for chunk in api.chunk_text(text):
+        yield chunk
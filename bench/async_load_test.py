@@ -0,0 +1,125 @@
+"""
+Compares how many concurrent /ask streams the sync (gunicorn api:app) and async
+(uvicorn asgi:app) serving modes can hold, using the local fake LLM server so no real
+API quota is spent.
+
+Usage (from the repository root):
+    python bench/async_load_test.py [--concurrency 100] [--sync-workers 1]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_PORT, SYNC_PORT, ASYNC_PORT = 18001, 18002, 18003
+
+
+def upstream_env():
+    """Points every provider URL at the fake LLM server."""
+    base = f"http://127.0.0.1:{FAKE_PORT}"
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_URL": f"{base}/v1beta/models/gemini-2.5-flash:generateContent",
+        "GEMINI_STREAM_API_URL": f"{base}/v1beta/models/gemini-2.5-flash:streamGenerateContent",
+        "GROQ_API_URL": f"{base}/openai/v1/chat/completions",
+        "OPENROUTER_API_URL": f"{base}/api/v1/chat/completions",
+        "GOOGLE_GEMINI_API_KEY": "fake",
+        "FLASK_SECRET_KEY": "load-test",
+        "CHAT_HISTORY_DIR": tempfile.mkdtemp(prefix="vexara-load-"),
+        # The fake server has no quota; measure the serving mode, not the free-tier rate limits
+        "RATE_LIMIT_ENABLED": "false",
+    })
+    return env
+
+
+def start(cmd, env):
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_until_up(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"http://127.0.0.1:{port}/", timeout=1)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+async def one_student(port):
+    """Sends a single /ask as a fresh guest and returns (time to first byte, total time)."""
+    start_time = time.perf_counter()
+    first_byte = None
+    async with httpx.AsyncClient(timeout=300) as client:
+        data = {"chat_id": str(uuid.uuid4()), "instruction": "Solve 3x + 5 = 17", "model_choice": "general"}
+        async with client.stream("POST", f"http://127.0.0.1:{port}/ask", data=data) as response:
+            async for _ in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start_time
+    return first_byte or 0.0, time.perf_counter() - start_time
+
+
+async def run_load(port, concurrency):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one_student(port) for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    ttfb = sorted(r[0] for r in results)
+    total = sorted(r[1] for r in results)
+    return {
+        "wall_s": wall,
+        "req_per_s": concurrency / wall,
+        "ttfb_p50": statistics.median(ttfb),
+        "ttfb_max": ttfb[-1],
+        "total_p50": statistics.median(total),
+        "total_max": total[-1],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--sync-workers", type=int, default=1, help="gunicorn sync workers (production default: 1)")
+    args = parser.parse_args()
+
+    env = upstream_env()
+    servers = [start([sys.executable, "-m", "uvicorn", "bench.fake_llm_server:app", "--port", str(FAKE_PORT),
+                      "--log-level", "warning"], env)]
+    try:
+        await wait_until_up(FAKE_PORT)
+        results = {}
+
+        sync_server = start([sys.executable, "-m", "gunicorn", "-w", str(args.sync_workers), "--timeout", "600",
+                             "-b", f"127.0.0.1:{SYNC_PORT}", "api:app"], env)
+        servers.append(sync_server)
+        await wait_until_up(SYNC_PORT)
+        results["sync"] = await run_load(SYNC_PORT, args.concurrency)
+        sync_server.terminate()
+
+        async_server = start([sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(ASYNC_PORT),
+                              "--log-level", "warning"], env)
+        servers.append(async_server)
+        await wait_until_up(ASYNC_PORT)
+        results["async"] = await run_load(ASYNC_PORT, args.concurrency)
+    finally:
+        for server in servers:
+            server.terminate()
+
+    print(f"{args.concurrency} concurrent /ask streams, sync workers={args.sync_workers}")
+    print(f"{'mode':<6} {'wall s':>8} {'req/s':>8} {'ttfb p50':>9} {'ttfb max':>9} {'total p50':>10} {'total max':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<6} {r['wall_s']:>8.2f} {r['req_per_s']:>8.1f} {r['ttfb_p50']:>9.2f} {r['ttfb_max']:>9.2f} "
+              f"{r['total_p50']:>10.2f} {r['total_max']:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+"""
+Local fake LLM server for load tests. It speaks just enough of the Gemini
+generateContent/streamGenerateContent API and the OpenAI-compatible chat completions
+API (Groq, OpenRouter) for api.py, and streams a canned answer with a fixed delay per token.
+Faults can be injected to exercise the retry, rate limit and fallback paths.
+
+Run with:
+    uvicorn bench.fake_llm_server:app --port 18001
+and point the app at it with GEMINI_API_URL=http://127.0.0.1:18001/v1beta/models/gemini-2.5-flash:generateContent,
+GROQ_API_URL=http://127.0.0.1:18001/openai/v1/chat/completions and
+OPENROUTER_API_URL=http://127.0.0.1:18001/api/v1/chat/completions.
+
+Settings (env):
+    FAKE_LLM_TOKENS       tokens per answer (default 20)
+    FAKE_LLM_TOKEN_DELAY  seconds between tokens (default 0.05)
+    FAKE_LLM_LATENCY      seconds before a response starts (default 0)
+    FAKE_LLM_ERROR_RATE   fraction of requests answered 500 (default 0)
+    FAKE_LLM_429_RATE     fraction of requests answered 429 with Retry-After (default 0)
+    FAKE_LLM_RETRY_AFTER  Retry-After seconds of injected 429s (default 1)
+    FAKE_LLM_DROP_RATE    fraction of streams cut off halfway through the answer (default 0)
+    FAKE_LLM_RPM          requests per minute per provider before answering 429, like a free
+                          tier; Groq and OpenRouter responses carry x-ratelimit-* headers (default 0, no limit)
+    FAKE_LLM_FAULTY       providers the faults and FAKE_LLM_RPM apply to (default gemini,groq,openrouter)
+    FAKE_LLM_SEED         random seed for the injected faults
+
+GET /stats returns per-provider request, fault and concurrency counts.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+TOKENS = int(os.environ.get("FAKE_LLM_TOKENS", "20"))
+TOKEN_DELAY = float(os.environ.get("FAKE_LLM_TOKEN_DELAY", "0.05"))
+LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", "0"))
+ERROR_RATE = float(os.environ.get("FAKE_LLM_ERROR_RATE", "0"))
+RATE_429 = float(os.environ.get("FAKE_LLM_429_RATE", "0"))
+RETRY_AFTER = float(os.environ.get("FAKE_LLM_RETRY_AFTER", "1"))
+DROP_RATE = float(os.environ.get("FAKE_LLM_DROP_RATE", "0"))
+RPM = int(os.environ.get("FAKE_LLM_RPM", "0"))
+FAULTY = set(os.environ.get("FAKE_LLM_FAULTY", "gemini,groq,openrouter").split(","))
+
+_random = random.Random(os.environ.get("FAKE_LLM_SEED") or None)
+_recent = {}  # provider -> start times of the last minute's requests, for FAKE_LLM_RPM
+stats = {}
+
+
+class DroppedStream(Exception):
+    """Raised inside a stream to cut the connection, like an upstream reset."""
+
+
+def _answer_tokens():
+    return [f"⇒ step{i} " for i in range(TOKENS)]
+
+
+def _gemini_event(text):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+
+def _chat_completion_event(model, text):
+    return {"model": model, "choices": [{"index": 0, "delta": {"content": text}}]}
+
+
+def _provider_stats(provider):
+    return stats.setdefault(provider, {"requests": 0, "ok": 0, "errors_500": 0, "throttled_429": 0,
+                                       "dropped": 0, "in_flight": 0, "peak_in_flight": 0})
+
+
+def _rate_limit_headers(provider, now):
+    """x-ratelimit-* headers like Groq's and OpenRouter's, when FAKE_LLM_RPM is set."""
+    if not RPM or provider == "gemini":
+        return {}
+    recent = _recent.get(provider, ())
+    reset = max(60 - (now - recent[0]), 0) if recent else 0
+    return {
+        "x-ratelimit-limit-requests": str(RPM),
+        "x-ratelimit-remaining-requests": str(max(RPM - len(recent), 0)),
+        "x-ratelimit-reset-requests": f"{reset:.2f}s",
+    }
+
+
+def _error(provider, status, message, headers=None):
+    if provider == "gemini":
+        code = "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"
+        body = {"error": {"code": status, "message": message, "status": code}}
+    else:
+        code = "rate_limit_exceeded" if status == 429 else "server_error"
+        body = {"error": {"message": message, "type": code, "code": code}}
+    return JSONResponse(body, status, headers=headers)
+
+
+async def _admit(provider):
+    """Counts a request and decides its fault: returns an error response, or None to answer it."""
+    counts = _provider_stats(provider)
+    counts["requests"] += 1
+    await asyncio.sleep(LATENCY)
+    if provider not in FAULTY:
+        return None
+    now = time.monotonic()
+    if RPM:
+        recent = _recent.setdefault(provider, deque())
+        while recent and now - recent[0] >= 60:
+            recent.popleft()
+        if len(recent) >= RPM:
+            counts["throttled_429"] += 1
+            retry_after = 60 - (now - recent[0])
+            headers = {"Retry-After": f"{retry_after:.0f}", **_rate_limit_headers(provider, now)}
+            return _error(provider, 429, "Rate limit reached for requests per minute.", headers)
+        recent.append(now)
+    roll = _random.random()
+    if roll < RATE_429:
+        counts["throttled_429"] += 1
+        return _error(provider, 429, "Too many requests.", {"Retry-After": f"{RETRY_AFTER:g}"})
+    if roll < RATE_429 + ERROR_RATE:
+        counts["errors_500"] += 1
+        return _error(provider, 500, "Internal error.")
+    return None
+
+
+def _stream(provider, events):
+    """Streams `events`, cutting it off halfway for FAKE_LLM_DROP_RATE of the requests."""
+    counts = _provider_stats(provider)
+    drop_at = len(events) // 2 if provider in FAULTY and _random.random() < DROP_RATE else None
+
+    async def body():
+        counts["in_flight"] += 1
+        counts["peak_in_flight"] = max(counts["peak_in_flight"], counts["in_flight"])
+        try:
+            for i, event in enumerate(events):
+                if i == drop_at:
+                    counts["dropped"] += 1
+                    raise DroppedStream(f"{provider} stream dropped after {i} events")
+                await asyncio.sleep(TOKEN_DELAY)
+                yield event
+            counts["ok"] += 1
+        finally:
+            counts["in_flight"] -= 1
+
+    headers = _rate_limit_headers(provider, time.monotonic())
+    return StreamingResponse(body(), media_type="text/event-stream", headers=headers)
+
+
+async def gemini(request):
+    target = request.path_params['target']
+    rejected = await _admit("gemini")
+    if rejected is not None:
+        return rejected
+    if target.endswith(":streamGenerateContent"):
+        events = [f"data: {json.dumps(_gemini_event(token))}\r\n\r\n" for token in _answer_tokens()]
+        return _stream("gemini", events)
+
+    await asyncio.sleep(TOKEN_DELAY * TOKENS)
+    _provider_stats("gemini")["ok"] += 1
+    return JSONResponse(_gemini_event("".join(_answer_tokens())))
+
+
+async def chat_completions(request):
+    provider = "groq" if request.url.path.startswith("/openai/") else "openrouter"
+    body = await request.json()
+    rejected = await _admit(provider)
+    if rejected is not None:
+        return rejected
+
+    if body.get("stream"):
+        events = [f"data: {json.dumps(_chat_completion_event(body.get('model'), token))}\n\n" for token in _answer_tokens()]
+        return _stream(provider, events + ["data: [DONE]\n\n"])
+    await asyncio.sleep(TOKEN_DELAY * TOKENS)
+    _provider_stats(provider)["ok"] += 1
+    headers = _rate_limit_headers(provider, time.monotonic())
+    return JSONResponse(
+        {"choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(_answer_tokens())}}]},
+        headers=headers,
+    )
+
+
+async def fake_stats(request):
+    return JSONResponse(stats)
+
+
+app = Starlette(routes=[
+    Route('/v1beta/models/{target}', gemini, methods=['POST']),
+    Route('/openai/v1/chat/completions', chat_completions, methods=['POST']),
+    Route('/api/v1/chat/completions', chat_completions, methods=['POST']),
+    Route('/stats', fake_stats),
+])
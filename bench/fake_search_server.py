@@ -0,0 +1,72 @@
+"""
+Local fake Serper server for web search tests and benchmarks. POST /search answers like
+Serper's search API, with organic results that link back to this server's /page/<n>, which
+serves an HTML article (with scripts and navigation the text extractor must drop).
+
+Run with:
+    uvicorn bench.fake_search_server:app --port 18006
+and point the app at it with SERPER_API_URL=http://127.0.0.1:18006/search SERPER_API_KEY=test.
+
+Settings (env):
+    FAKE_SEARCH_DELAY     seconds before /search answers (default 0.3)
+    FAKE_PAGE_DELAY       seconds before a page answers (default 0.2)
+    FAKE_SLOW_PAGE        number of a page that takes FAKE_SLOW_PAGE_DELAY instead (default 2, -1 for none)
+    FAKE_SLOW_PAGE_DELAY  seconds (default 10)
+"""
+import asyncio
+import os
+
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse
+from starlette.routing import Route
+
+SEARCH_DELAY = float(os.environ.get("FAKE_SEARCH_DELAY", "0.3"))
+PAGE_DELAY = float(os.environ.get("FAKE_PAGE_DELAY", "0.2"))
+SLOW_PAGE = int(os.environ.get("FAKE_SLOW_PAGE", "2"))
+SLOW_PAGE_DELAY = float(os.environ.get("FAKE_SLOW_PAGE_DELAY", "10"))
+
+stats = {"searches": 0, "pages": 0}
+
+
+async def search(request):
+    body = await request.json()
+    if not request.headers.get("X-API-KEY"):
+        return JSONResponse({"message": "Unauthorized."}, 403)
+    stats["searches"] += 1
+    await asyncio.sleep(SEARCH_DELAY)
+    base = str(request.base_url).rstrip("/")
+    query = body.get("q", "")
+    organic = [
+        {
+            "title": f"Result {n} for {query}",
+            "link": f"{base}/page/{n}",
+            "snippet": f"Snippet {n}: a short summary about {query}.",
+            "position": n + 1,
+        }
+        for n in range(int(body.get("num", 10)))
+    ]
+    return JSONResponse({"searchParameters": {"q": query}, "organic": organic})
+
+
+async def page(request):
+    n = request.path_params["n"]
+    stats["pages"] += 1
+    await asyncio.sleep(SLOW_PAGE_DELAY if n == SLOW_PAGE else PAGE_DELAY)
+    paragraphs = "".join(f"<p>Paragraph {i} of page {n}: the quadratic formula is x = (-b ± √(b²-4ac)) / 2a.</p>"
+                         for i in range(40))
+    return HTMLResponse(
+        f"<html><head><title>Page {n}</title><script>var tracking = 1;</script>"
+        f"<style>p {{ color: red }}</style></head><body><nav>Home | About</nav>"
+        f"<article><h1>Article {n}</h1>{paragraphs}</article><footer>© example</footer></body></html>"
+    )
+
+
+async def fake_stats(request):
+    return JSONResponse(stats)
+
+
+app = Starlette(routes=[
+    Route("/search", search, methods=["POST"]),
+    Route("/page/{n:int}", page),
+    Route("/stats", fake_stats),
+])
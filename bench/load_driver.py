@@ -0,0 +1,274 @@
+"""
+Load test of the app against the fake LLM server (bench/fake_llm_server.py), so no real API
+quota is spent.
+
+N concurrent students each keep a guest session and loop for --duration seconds: ask a question
+(/ask), upload a photo of a problem (/upload_image) or open the chat list
+(/get_chat_history_list), picked by --mix weights, with an exponential think time between
+requests. Every few questions a student starts a new chat. Reported per endpoint: requests,
+failures, requests/s, time to first token (answers) and p50/p99 latency; plus the serving
+worker's resident memory (idle and peak) and what the fake providers saw, including the
+faults they injected.
+
+Starts the fake LLM server and the app (sync: gunicorn with threads, async: uvicorn asgi:app)
+unless --url points at a running app; then point that app at a fake server started by hand and
+pass --pid to sample its memory. Questions are unique unless --repeat is set, so the answer
+caches only help when asked to. Memory sampling is Linux only (reads /proc).
+
+Usage (from the repository root):
+    python bench/load_driver.py [--mode sync|async] [--students 50] [--duration 30]
+        [--mix ask=6,upload=1,history=3] [--think-ms 1000] [--repeat 0.0]
+        [--tokens 40] [--token-delay 0.03] [--latency 0.3]
+        [--error-rate 0] [--rate-429 0] [--drop-rate 0] [--rpm 0] [--faulty gemini] [--app-rate-limit]
+e.g. the fallback under a Gemini outage:
+    python bench/load_driver.py --error-rate 1 --faulty gemini
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import sys
+import time
+import uuid
+
+import httpx
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from async_load_test import FAKE_PORT, start, upstream_env, wait_until_up  # noqa: E402
+from upload_memory_bench import RssSampler, rss_kb, serving_pid  # noqa: E402
+
+APP_PORT = 18007
+ENDPOINTS = ("ask", "upload", "history")
+REPEATED_QUESTIONS = [
+    "Solve 3x + 5 = 20",
+    "Find the area of a circle with radius 7 cm",
+    "Factorise x^2 - 5x + 6",
+    "What is the simple interest on Rs 5000 at 10% for 2 years?",
+]
+
+
+class Sample:
+    __slots__ = ("ok", "ttft", "latency")
+
+    def __init__(self, ok, ttft, latency):
+        self.ok, self.ttft, self.latency = ok, ttft, latency
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return float("nan")
+    return values[min(int(q / 100 * len(values)), len(values) - 1)]
+
+
+def problem_image():
+    """A small photo-like JPEG of a printed problem."""
+    image = Image.effect_noise((900, 1200), 30).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((60, 300, 840, 700), fill=(245, 245, 240))
+    draw.text((100, 450), "Solve: 2x + 7 = 19", fill=(20, 20, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+async def read_answer(response, started):
+    """Reads an SSE answer; returns (ok, seconds to the first token event)."""
+    ttft, ok = None, False
+    async for line in response.aiter_lines():
+        if line == "event: token" and ttft is None:
+            ttft = time.perf_counter() - started
+        elif line == "event: done":
+            ok = True
+    return ok and response.status_code == 200, ttft
+
+
+class Student:
+    """One guest session: its own cookie jar, chat and daily quota."""
+
+    def __init__(self, base_url, args, image):
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=300)
+        self.args = args
+        self.image = image
+        self.chat_id = str(uuid.uuid4())
+        self.questions = 0
+
+    def question(self):
+        if random.random() < self.args.repeat:
+            return random.choice(REPEATED_QUESTIONS)
+        a, b = random.randint(2, 99), random.randint(2, 999)
+        return f"Solve {a}x + {b} = {a * random.randint(2, 50) + b} and explain each step"
+
+    async def ask(self):
+        self.questions += 1
+        if self.questions % self.args.turns_per_chat == 0:
+            self.chat_id = str(uuid.uuid4())
+        data = {"chat_id": self.chat_id, "instruction": self.question(), "model_choice": "general"}
+        started = time.perf_counter()
+        async with self.client.stream("POST", "/ask", data=data) as response:
+            ok, ttft = await read_answer(response, started)
+        return Sample(ok, ttft, time.perf_counter() - started)
+
+    async def upload(self):
+        files = {"image": ("problem.jpg", self.image, "image/jpeg")}
+        data = {"chat_id": self.chat_id, "caption": "solve this"}
+        started = time.perf_counter()
+        async with self.client.stream("POST", "/upload_image", data=data, files=files) as response:
+            ok, ttft = await read_answer(response, started)
+        return Sample(ok, ttft, time.perf_counter() - started)
+
+    async def history(self):
+        started = time.perf_counter()
+        response = await self.client.get("/get_chat_history_list")
+        latency = time.perf_counter() - started
+        return Sample(response.status_code == 200, None, latency)
+
+    async def run(self, deadline, weights, results):
+        try:
+            await asyncio.sleep(random.uniform(0, self.args.think_ms / 1000))  # don't all start at once
+            while time.monotonic() < deadline:
+                endpoint = random.choices(ENDPOINTS, weights)[0]
+                try:
+                    sample = await getattr(self, endpoint)()
+                except httpx.HTTPError:
+                    sample = Sample(False, None, float("nan"))
+                results[endpoint].append(sample)
+                await asyncio.sleep(random.expovariate(1000 / self.args.think_ms) if self.args.think_ms else 0)
+        finally:
+            await self.client.aclose()
+
+
+async def run_load(base_url, args, image):
+    weights = [args.mix.get(endpoint, 0) for endpoint in ENDPOINTS]
+    results = {endpoint: [] for endpoint in ENDPOINTS}
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(Student(base_url, args, image).run(deadline, weights, results)
+                           for _ in range(args.students)))
+    return results, time.monotonic() - started
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        endpoint, _, weight = part.partition("=")
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {endpoint!r} (one of {', '.join(ENDPOINTS)})")
+        mix[endpoint] = float(weight or 1)
+    return mix
+
+
+def print_report(args, results, wall, memory, upstream):
+    print(f"{args.students} students for {wall:.0f} s, mode {args.mode if not args.url else args.url}, "
+          f"think {args.think_ms:g} ms, answers of {args.tokens} tokens {args.token_delay * 1000:g} ms apart")
+    print(f"{'endpoint':<9} {'requests':>8} {'failed':>7} {'req/s':>7} {'ttft p50':>9} {'ttft p99':>9} "
+          f"{'p50 s':>7} {'p99 s':>7}")
+    total = 0
+    for endpoint, samples in results.items():
+        if not samples:
+            continue
+        total += len(samples)
+        ttfts = sorted(s.ttft for s in samples if s.ttft is not None)
+        latencies = sorted(s.latency for s in samples if s.ok)
+        failed = sum(1 for s in samples if not s.ok)
+        ttft = f"{percentile(ttfts, 50):>9.2f} {percentile(ttfts, 99):>9.2f}" if ttfts else f"{'-':>9} {'-':>9}"
+        print(f"{endpoint:<9} {len(samples):>8} {failed:>7} {len(samples) / wall:>7.1f} {ttft} "
+              f"{percentile(latencies, 50):>7.2f} {percentile(latencies, 99):>7.2f}")
+    print(f"{'all':<9} {total:>8} {'':>7} {total / wall:>7.1f}")
+    if memory:
+        print(f"worker memory: {memory[0] / 1024:.0f} MB idle, {memory[1] / 1024:.0f} MB peak")
+    for provider, counts in sorted(upstream.items()):
+        print(f"upstream {provider}: " + ", ".join(f"{name} {count}" for name, count in counts.items()))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["sync", "async"], default="async")
+    parser.add_argument("--url", help="load an already running app instead of starting one")
+    parser.add_argument("--pid", type=int, help="with --url: the worker process whose memory to sample")
+    parser.add_argument("--students", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("ask=6,upload=1,history=3"))
+    parser.add_argument("--think-ms", type=float, default=1000)
+    parser.add_argument("--turns-per-chat", type=int, default=4)
+    parser.add_argument("--repeat", type=float, default=0.0, help="fraction of questions from a small common set")
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--token-delay", type=float, default=0.03)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake provider seconds before responding")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-429", type=float, default=0)
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--rpm", type=int, default=0, help="fake provider requests per minute before 429s")
+    parser.add_argument("--faulty", default="gemini,groq,openrouter", help="providers the faults apply to")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--app-rate-limit", action="store_true", help="keep the app's provider rate limiter on")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    env = upstream_env()
+    env.update({
+        "FAKE_LLM_TOKENS": str(args.tokens), "FAKE_LLM_TOKEN_DELAY": str(args.token_delay),
+        "FAKE_LLM_LATENCY": str(args.latency), "FAKE_LLM_ERROR_RATE": str(args.error_rate),
+        "FAKE_LLM_429_RATE": str(args.rate_429), "FAKE_LLM_DROP_RATE": str(args.drop_rate),
+        "FAKE_LLM_RPM": str(args.rpm), "FAKE_LLM_FAULTY": args.faulty,
+        "FAKE_LLM_SEED": str(args.seed) if args.seed is not None else "",
+        # Students are guests with the normal daily quota; a load test sends more than that
+        "DAILY_MESSAGE_LIMIT": "1000000",
+        # Every upload takes the vision path (tesseract may not be installed here)
+        "OCR_ENABLED": "false", "IMAGE_CACHE_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+    })
+    if args.app_rate_limit:
+        env["RATE_LIMIT_ENABLED"] = "true"
+    image = problem_image()
+    servers = []
+    try:
+        if args.url:
+            base_url, pid = args.url.rstrip("/"), args.pid
+        else:
+            servers.append(start([sys.executable, "-m", "uvicorn", "bench.fake_llm_server:app",
+                                  "--port", str(FAKE_PORT), "--log-level", "critical"], env))
+            await wait_until_up(FAKE_PORT)
+            if args.mode == "sync":
+                cmd = [sys.executable, "-m", "gunicorn", "-w", "1", "-k", "gthread", "--threads",
+                       str(args.students + 4), "--timeout", "600", "-b", f"127.0.0.1:{APP_PORT}", "api:app"]
+            else:
+                cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(APP_PORT), "--log-level", "warning"]
+            app_server = start(cmd, env)
+            servers.append(app_server)
+            await wait_until_up(APP_PORT)
+            base_url, pid = f"http://127.0.0.1:{APP_PORT}", serving_pid(app_server)
+
+        sampler = None
+        if pid:
+            # Warm up imports, pools and the upload path before taking the idle figure
+            warm = Student(base_url, args, image)
+            await warm.ask()
+            await warm.upload()
+            await warm.client.aclose()
+            idle = rss_kb(pid)
+            sampler = RssSampler(pid, interval=0.1)
+            sampler.start()
+        results, wall = await run_load(base_url, args, image)
+        memory = None
+        if sampler:
+            sampler.running = False
+            sampler.join()
+            memory = (idle, sampler.peak)
+
+        upstream = {}
+        if not args.url:
+            async with httpx.AsyncClient() as client:
+                upstream = (await client.get(f"http://127.0.0.1:{FAKE_PORT}/stats")).json()
+    finally:
+        for server in servers:
+            server.terminate()
+
+    print_report(args, results, wall, memory, upstream)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+"""
+Compares the OCR fast path with Gemini Vision for /upload_image.
+
+The bundled sample set renders printed SEE-style problems (clean, and with the blur/noise/tilt
+of a phone photo) so the benchmark runs anywhere Tesseract is installed; --samples-dir runs it
+on real photos instead. For every image it reports preprocessing and OCR time, the OCR
+confidence and whether the fast path would take it, and the input tokens (and cost) each path
+would send upstream. With --upstream, both paths are also timed end to end against the
+configured provider URLs (real keys, or bench/fake_llm_server.py).
+
+Usage (from the repository root):
+    python bench/ocr_vs_vision_bench.py [--samples-dir DIR] [--upstream] [--price-per-mtok 0.30]
+"""
+import argparse
+import io
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont  # noqa: E402
+
+from context_window import estimate_tokens  # noqa: E402
+from image_preprocess import preprocess_image  # noqa: E402
+from ocr_fastpath import classify, run_ocr  # noqa: E402
+
+SAMPLE_PROBLEMS = [
+    "3x + 5 = 17",
+    "2x - 7 = 11",
+    "x^2 - 5x + 6 = 0",
+    "5(x - 2) = 3x + 4",
+    "4x/3 + 2 = 10",
+    "x^2 + 7x + 12 = 0",
+    "3(2x + 1) - 4 = 2x + 9",
+    "Find x if 7x - 3 = 2x + 12",
+]
+# Gemini bills an image up to 384 px as 258 tokens, larger ones per 768 px tile
+GEMINI_IMAGE_TOKENS_PER_TILE = 258
+
+
+def _font(size):
+    for path in ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/Library/Fonts/Arial.ttf"):
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default()
+
+
+def render_sample(text, photo=False):
+    """Renders a printed problem; `photo` adds the tilt, blur and noise of a phone picture."""
+    image = Image.new("RGB", (1400, 300), (250, 250, 245))
+    ImageDraw.Draw(image).text((60, 100), text, font=_font(72), fill=(20, 20, 30))
+    if photo:
+        image = image.rotate(4, expand=True, fillcolor=(200, 195, 185)).filter(ImageFilter.GaussianBlur(2.5))
+        noise = Image.effect_noise(image.size, 60).convert("RGB")
+        image = Image.blend(image, noise, 0.25)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def load_samples(samples_dir):
+    if samples_dir:
+        for name in sorted(os.listdir(samples_dir)):
+            with open(os.path.join(samples_dir, name), "rb") as f:
+                yield name, f.read()
+        return
+    for i, text in enumerate(SAMPLE_PROBLEMS):
+        yield f"clean-{i}", render_sample(text)
+        yield f"photo-{i}", render_sample(text, photo=True)
+
+
+def gemini_image_tokens(width, height):
+    if width <= 384 and height <= 384:
+        return GEMINI_IMAGE_TOKENS_PER_TILE
+    return math.ceil(width / 768) * math.ceil(height / 768) * GEMINI_IMAGE_TOKENS_PER_TILE
+
+
+def time_stream(chunks):
+    started = time.perf_counter()
+    first = None
+    text = ""
+    for chunk in chunks:
+        if first is None:
+            first = time.perf_counter() - started
+        text += chunk
+    return first, time.perf_counter() - started, bool(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples-dir", default=None)
+    parser.add_argument("--upstream", action="store_true", help="also time both paths against the providers")
+    parser.add_argument("--price-per-mtok", type=float, default=0.30, help="input price per million tokens (USD)")
+    args = parser.parse_args()
+
+    if args.upstream:
+        # Measure the providers, not the answer caches
+        os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+        os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+        import api
+        system_prompt_tokens = estimate_tokens(api.SEE_SYSTEM_PROMPT)
+    else:
+        api = None
+        system_prompt_tokens = 1500  # roughly the SEE system prompt
+
+    rows = []
+    for name, raw in load_samples(args.samples_dir):
+        t0 = time.perf_counter()
+        prepared = preprocess_image(raw)
+        t1 = time.perf_counter()
+        try:
+            text, confidence = run_ocr(prepared.data)
+        except Exception as e:
+            print(f"OCR unavailable ({type(e).__name__}: {e}). Install tesseract-ocr to run this benchmark.")
+            return
+        t2 = time.perf_counter()
+        outcome = classify(text, confidence)
+        # Both paths send the SEE system prompt; vision adds the image and its own prompt
+        vision_tokens = system_prompt_tokens + gemini_image_tokens(prepared.width, prepared.height) + 250
+        text_tokens = system_prompt_tokens + estimate_tokens(text) + 20
+        row = {
+            "name": name, "preprocess": t1 - t0, "ocr": t2 - t1, "confidence": confidence,
+            "outcome": outcome, "vision_tokens": vision_tokens,
+            "path_tokens": text_tokens if outcome == "accepted" else vision_tokens,
+            "text": text.replace("\n", " ")[:40],
+        }
+        if args.upstream:
+            row["vision_ttft"], row["vision_total"], _ = time_stream(
+                api.stream_gemini(None, encoded=api.build_vision_request("", prepared.data, prepared.mime_type))
+            )
+            if outcome == "accepted":
+                row["text_ttft"], row["text_total"], _ = time_stream(
+                    api.stream_text_answer([], None, api.ocr_instruction("", text), "general")
+                )
+        rows.append(row)
+        print(f"{name:10} ocr {row['ocr'] * 1000:6.0f} ms  conf {confidence:5.1f}  {outcome:14} {row['text']!r}")
+
+    accepted = [r for r in rows if r["outcome"] == "accepted"]
+    price = args.price_per_mtok / 1e6
+    all_vision = sum(r["vision_tokens"] for r in rows)
+    with_fast_path = sum(r["path_tokens"] for r in rows)
+    print()
+    print(f"images: {len(rows)}, fast path taken: {len(accepted)} ({len(accepted) / max(len(rows), 1):.0%})")
+    print(f"preprocess p50: {statistics.median(r['preprocess'] for r in rows) * 1000:.0f} ms, "
+          f"OCR p50: {statistics.median(r['ocr'] for r in rows) * 1000:.0f} ms")
+    print(f"upstream input tokens: vision only {all_vision}, with OCR fast path {with_fast_path} "
+          f"(${all_vision * price:.5f} -> ${with_fast_path * price:.5f})")
+    if args.upstream:
+        print(f"vision path total p50: {statistics.median(r['vision_total'] for r in rows) * 1000:.0f} ms")
+        if accepted:
+            print(f"text path total p50 (OCR + answer): "
+                  f"{statistics.median(r['ocr'] + r['text_total'] for r in accepted) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
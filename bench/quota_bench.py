@@ -0,0 +1,96 @@
+"""
+Measures quota increments per second under contention and checks that no update is lost.
+
+Several processes (like gunicorn workers), each with several threads, call try_consume() for
+the same few users at once. The final counts must equal the number of allowed calls, and with
+--limit no user may go over the limit.
+
+Usage (from the repository root):
+    python bench/quota_bench.py [--backend sqlite|redis|memory] [--processes 4] [--threads 8]
+                                [--ops 2000] [--users 4] [--limit 0]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quota_store import create_quota_store  # noqa: E402
+
+BENCH_DAY = "2000-01-01"
+
+
+def consume_all(store, threads, ops, users, limit):
+    """Runs `threads` threads of `ops` try_consume calls each; returns how many were allowed."""
+    allowed = [0] * threads
+
+    def run(index):
+        for i in range(ops):
+            ok, _ = store.try_consume(f"bench-user-{i % users}", limit, day=BENCH_DAY)
+            allowed[index] += ok
+
+    pool = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return sum(allowed)
+
+
+def worker(backend, db_dir, threads, ops, users, limit, results):
+    results.put(consume_all(create_quota_store(db_dir, backend), threads, ops, users, limit))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "redis", "memory"])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=2000, help="try_consume calls per thread")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=0, help="per-user limit (0 = unlimited)")
+    args = parser.parse_args()
+    if args.backend == "memory" and args.processes > 1:
+        print("The memory backend is per process; running its threads in this process only.")
+        args.processes = 1
+
+    total_ops = args.processes * args.threads * args.ops
+    limit = args.limit or total_ops + 1
+    with tempfile.TemporaryDirectory() as db_dir:
+        store = create_quota_store(db_dir, args.backend)
+        if args.backend == "redis":
+            for u in range(args.users):
+                store.client.delete(store._key(f"bench-user-{u}", BENCH_DAY))
+        started = time.perf_counter()
+        if args.backend == "memory":
+            allowed = consume_all(store, args.threads, args.ops, args.users, limit)
+        else:
+            results = multiprocessing.Queue()
+            procs = [
+                multiprocessing.Process(
+                    target=worker, args=(args.backend, db_dir, args.threads, args.ops, args.users, limit, results)
+                )
+                for _ in range(args.processes)
+            ]
+            for p in procs:
+                p.start()
+            allowed = sum(results.get() for _ in procs)
+            for p in procs:
+                p.join()
+        elapsed = time.perf_counter() - started
+        counted = sum(store.get(f"bench-user-{u}", day=BENCH_DAY) for u in range(args.users))
+
+    print(f"backend={args.backend} processes={args.processes} threads={args.threads} users={args.users}")
+    print(f"{total_ops} try_consume calls in {elapsed:.2f}s -> {total_ops / elapsed:,.0f} ops/s")
+    print(f"allowed: {allowed}, stored count: {counted} ({'OK' if allowed == counted else 'LOST UPDATES'})")
+    if args.limit:
+        cap = args.limit * args.users
+        print(f"limit {args.limit}/user -> at most {cap} allowed: {'OK' if allowed <= cap else 'OVER LIMIT'}")
+
+
+if __name__ == "__main__":
+    main()
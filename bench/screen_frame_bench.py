@@ -0,0 +1,97 @@
+"""
+Simulates a screen-share session against the /process_screen_frame frame differencing.
+
+A scripted 10-minute session (reading a static page, typing bursts, scrolling, switching
+between a worksheet and a calculator) is rendered as 1280x720 JPEG frames, like the page's
+canvas capture, and fed to screen_frames.ScreenFrameTracker on a simulated clock that follows
+the sampling interval the server hands back. It reports the frames sent and vision calls made,
+against the naive baseline of one vision call per frame every 2 seconds.
+
+Usage (from the repository root):
+    python bench/screen_frame_bench.py [--minutes 10]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from screen_frames import SCREEN_FRAME_MIN_INTERVAL, ScreenFrameTracker, frame_thumbnail  # noqa: E402
+
+WORKSHEET = [f"{i + 1}. Solve for x: {3 + i}x + {5 + 2 * i} = {17 + 3 * i}" for i in range(40)]
+
+
+def _font(size):
+    for path in ("/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf", "/Library/Fonts/Courier New.ttf"):
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default()
+
+
+FONT = _font(22)
+
+
+def render(lines, scroll=0, typed=""):
+    image = Image.new("RGB", (1280, 720), (252, 252, 250))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 1280, 40), fill=(40, 60, 90))
+    for row, line in enumerate(lines[scroll:scroll + 22]):
+        draw.text((30, 60 + row * 28), line, font=FONT, fill=(20, 20, 20))
+    if typed:
+        draw.text((30, 680), "Answer: " + typed, font=FONT, fill=(10, 70, 10))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=70)
+    return buffer.getvalue()
+
+
+def screen_at(t):
+    """What is on screen `t` seconds into the session (a repeating 2.5-minute script)."""
+    t = t % 150
+    if t < 40:  # reading the first problems
+        return render(WORKSHEET)
+    if t < 60:  # typing an answer, one character per second
+        return render(WORKSHEET, typed="x = " + "4" * int(t - 40))
+    if t < 70:  # scrolling down the worksheet
+        return render(WORKSHEET, scroll=int(t - 60))
+    if t < 110:  # reading further down
+        return render(WORKSHEET, scroll=10)
+    if t < 130:  # calculator open
+        return render(["Calculator", "", "17 - 5 = 12", "12 / 3 = 4"])
+    return render(WORKSHEET, scroll=10, typed="x = 4")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=10)
+    args = parser.parse_args()
+
+    duration = args.minutes * 60
+    naive_calls = int(duration * 1000 // SCREEN_FRAME_MIN_INTERVAL)
+    tracker = ScreenFrameTracker()
+    now, frames, calls, decide_time = 0.0, 0, 0, 0.0
+    while now < duration:
+        frame = screen_at(now)
+        started = time.perf_counter()
+        decision = tracker.observe("session", frame_thumbnail(Image.open(io.BytesIO(frame))), now=now)
+        decide_time += time.perf_counter() - started
+        frames += 1
+        if decision.analyze:
+            calls += 1
+            tracker.finish("session")
+        now += decision.next_interval / 1000
+
+    stats = tracker.stats()
+    print(f"{args.minutes:g}-minute session")
+    print(f"naive: {naive_calls} frames, {naive_calls} vision calls")
+    print(f"differencing: {frames} frames, {calls} vision calls "
+          f"({naive_calls / max(calls, 1):.1f}x fewer), skipped: "
+          + ", ".join(f"{k} {stats[k]}" for k in ("unchanged", "settling", "cooldown", "busy")))
+    print(f"decision time: {decide_time / frames * 1000:.2f} ms per frame (thumbnail + diff)")
+
+
+if __name__ == "__main__":
+    main()
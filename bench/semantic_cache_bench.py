@@ -0,0 +1,133 @@
+"""
+Benchmarks the semantic answer cache on synthetic SEE-style questions.
+
+The index is seeded with N problems. Queries are a mix of paraphrases of indexed problems
+(which should hit) and near-misses of them, which must miss. The near-misses are the same problem
+with changed numbers, with two numbers swapped ("radius 3, height 7" vs "radius 7, height 3"),
+with the roles of two people swapped, or with one keyword changed (simple vs compound interest).
+The script reports the paraphrase hit rate, the false hits of each near-miss kind and p50/p99
+lookup latency.
+
+Usage (from the repository root):
+    python bench/semantic_cache_bench.py [--entries 5000] [--queries 2000] [--threshold 0.9]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semantic_cache import SemanticCache  # noqa: E402
+
+# (question, paraphrases, {near-miss kind: near-miss questions}) with the same placeholders
+TEMPLATES = [
+    ("solve {a}x+{b}={c}", ["{a}x + {b} = {c} find x", "Find x: {a}x+{b}={c}", "solve {a}x + {b} = {c} please"],
+     {"swapped-number": ["solve {b}x+{a}={c}"]}),
+    ("solve x^2-{a}x+{b}=0", ["x² - {a}x + {b} = 0 solve", "Solve: x^2 - {a}x + {b} = 0", "find x if x^2-{a}x+{b}=0"],
+     {"swapped-number": ["solve x^2-{b}x+{a}=0"]}),
+    ("find the area of a circle of radius {a} cm",
+     ["area of circle with radius {a}cm", "What is the area of a circle of radius {a} cm?", "calculate area of a circle radius {a} cm"],
+     {"changed-keyword": ["find the circumference of a circle of radius {a} cm"]}),
+    ("Ram has {a} times as many rupees as Shyam. Together they have Rs {c}. How much does each have?",
+     ["Ram has {a} times as much money as Shyam and together they have Rs {c}, how much does each have",
+      "Together Ram and Shyam have Rs {c}. Ram has {a} times as many rupees as Shyam. How much does each have?"],
+     {"swapped-role": ["Shyam has {a} times as many rupees as Ram. Together they have Rs {c}. How much does each have?"]}),
+    ("find the simple interest on Rs {c} at {a}% per annum for {b} years",
+     ["simple interest on Rs {c} at {a}% per annum for {b} years", "Calculate the simple interest on Rs {c} at {a} % p.a. for {b} years"],
+     {"swapped-number": ["find the simple interest on Rs {c} at {b}% per annum for {a} years"],
+      "changed-keyword": ["find the compound interest on Rs {c} at {a}% per annum for {b} years"]}),
+    ("find the volume of a cylinder of radius {a} cm and height {b} cm",
+     ["volume of a cylinder with radius {a} cm and height {b} cm", "What is the volume of a cylinder of radius {a} cm and height {b} cm?"],
+     {"swapped-number": ["find the volume of a cylinder of radius {b} cm and height {a} cm"],
+      "changed-keyword": ["find the curved surface area of a cylinder of radius {a} cm and height {b} cm"]}),
+    ("A car travels {c} km in {a} hours. Find its speed.",
+     ["a car travels {c} km in {a} hours, what is its speed?", "Find the speed of a car that travels {c} km in {a} hours"],
+     {"swapped-number": ["A car travels {a} km in {c} hours. Find its speed."]}),
+    ("A is {a} years older than B. In {b} years A will be twice as old as B. Find their ages.",
+     ["A is {a} years older than B; in {b} years A will be twice as old as B. Find their ages"],
+     {"swapped-role": ["B is {a} years older than A. In {b} years B will be twice as old as A. Find their ages."],
+      "swapped-number": ["A is {b} years older than B. In {a} years A will be twice as old as B. Find their ages."]}),
+]
+NEAR_MISS_KINDS = ("changed-number", "swapped-number", "swapped-role", "changed-keyword")
+
+
+def make_problem(rng, seen):
+    """Picks a template and numbers whose canonical question is not in `seen` yet."""
+    while True:
+        template, paraphrases, near_misses = rng.choice(TEMPLATES)
+        values = {"a": rng.randint(2, 999), "b": rng.randint(2, 999), "c": rng.randint(100, 99999)}
+        if values["a"] != values["b"] and template.format(**values) not in seen:
+            return template, paraphrases, near_misses, values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cache = SemanticCache() if args.threshold is None else SemanticCache(threshold=args.threshold)
+    problems = []
+    seen = set()
+    started = time.perf_counter()
+    for i in range(args.entries):
+        template, paraphrases, near_misses, values = make_problem(rng, seen)
+        seen.add(template.format(**values))
+        cache.add("bench", template.format(**values), f"answer-{i}")
+        problems.append((template, paraphrases, near_misses, values, f"answer-{i}"))
+    build_seconds = time.perf_counter() - started
+
+    latencies = []
+    paraphrase_total = paraphrase_hits = wrong_hits = 0
+    near_miss_total = dict.fromkeys(NEAR_MISS_KINDS, 0)
+    near_miss_hits = dict.fromkeys(NEAR_MISS_KINDS, 0)
+    for _ in range(args.queries):
+        template, paraphrases, near_misses, values, expected = rng.choice(problems)
+        kind = None
+        if rng.random() < 0.5:
+            query = rng.choice(paraphrases).format(**values)
+        else:
+            kind = rng.choice(("changed-number",) + tuple(near_misses))
+            if kind == "changed-number":
+                # A near-identical problem with different numbers that is not in the index
+                changed = dict(values)
+                while template.format(**changed) in seen:
+                    changed["a"] += rng.randint(1, 5)
+                query = rng.choice([template] + paraphrases).format(**changed)
+            else:
+                query = rng.choice(near_misses[kind]).format(**values)
+                if query in seen:
+                    continue  # happens to be another indexed problem
+        t0 = time.perf_counter()
+        answer, _ = cache.lookup("bench", query)
+        latencies.append(time.perf_counter() - t0)
+        if kind is None:
+            paraphrase_total += 1
+            if answer == expected:
+                paraphrase_hits += 1
+            elif answer is not None:
+                wrong_hits += 1
+        else:
+            near_miss_total[kind] += 1
+            if answer is not None:
+                near_miss_hits[kind] += 1
+
+    latencies.sort()
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    print(f"index: {args.entries} entries built in {build_seconds:.2f}s, threshold {cache.threshold}")
+    print(f"paraphrase hit rate:    {paraphrase_hits / max(paraphrase_total, 1):.1%} ({paraphrase_hits}/{paraphrase_total})")
+    print(f"wrong-answer hits:      {wrong_hits}")
+    for kind in NEAR_MISS_KINDS:
+        print(f"{kind + ' hits:':<24}{near_miss_hits[kind]}/{near_miss_total[kind]} (should be 0)")
+    print(f"lookup latency p50:     {statistics.median(latencies) * 1000:.3f} ms")
+    print(f"lookup latency p99:     {p99 * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Writes and bytes on the wire per /ask answer, before and after SSE framing with delta coalescing.
+
+Serves /ask in-process against the fake LLM server (bench/fake_llm_server.py), which streams
+--tokens small deltas --token-delay apart, and counts what each serving mode hands to its socket:
+- sync: items of the WSGI response iterable (gunicorn sends each with one sendall());
+- async: http.response.body messages of the ASGI app (uvicorn writes each to the transport).
+Each write is also one chunk of HTTP chunked encoding, whose framing is counted in the wire
+bytes; it is at least one TCP segment as well, which adds another 40+ bytes of headers not
+counted here.
+
+Rows:
+- raw: the unframed text deltas the endpoints yielded before (one write per upstream delta),
+  taken from the token events of the uncoalesced run;
+- sse: token/done events, one per delta (SSE_COALESCE_MS=0);
+- coalesced: token/done events joined per --window-ms.
+
+Usage (from the repository root):
+    python bench/sse_wire_bench.py [--answers 3] [--tokens 300] [--token-delay 0.005] [--window-ms 30]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.parse
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_load_test import FAKE_PORT, start, upstream_env, wait_until_up  # noqa: E402
+
+
+def wire_bytes(writes):
+    """Body bytes plus the chunked-encoding framing ("<hex size>\\r\\n" ... "\\r\\n") of each write."""
+    return sum(len(w) + len(f"{len(w):X}\r\n") + 2 for w in writes)
+
+
+def token_texts(writes):
+    """The text of each token event in an SSE body."""
+    texts = []
+    for block in b"".join(writes).decode("utf-8").split("\n\n"):
+        if block.startswith("event: token\n"):
+            texts.append(json.loads(block.split("data: ", 1)[1])["text"])
+    return texts
+
+
+def form(question):
+    return {"instruction": question, "chat_id": str(uuid.uuid4()), "model_choice": "general"}
+
+
+def sync_answer(api, question):
+    """One /ask through the Flask app; returns (writes, seconds to the first one)."""
+    started = time.perf_counter()
+    # A fresh client is a fresh guest, so the daily quota doesn't interfere
+    response = api.app.test_client().post("/ask", data=form(question), buffered=False)
+    writes, first = [], None
+    for chunk in response.response:
+        first = first or time.perf_counter() - started
+        writes.append(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+    response.close()
+    return writes, first
+
+
+async def async_answer(app, question):
+    """One /ask through the ASGI app; returns (writes, seconds to the first one)."""
+    body = urllib.parse.urlencode(form(question)).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/ask", "raw_path": b"/ask", "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/x-www-form-urlencoded"),
+                    (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 80),
+    }
+    requested = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    started = time.perf_counter()
+    writes, first = [], None
+
+    async def send(message):
+        nonlocal first
+        if message["type"] == "http.response.body" and message.get("body"):
+            first = first or time.perf_counter() - started
+            writes.append(message["body"])
+
+    await app(scope, receive, send)
+    disconnected.set()
+    return writes, first
+
+
+def questions(answers):
+    # Distinct questions, so none is answered from the answer cache
+    return [f"Bench question {uuid.uuid4().hex[:8]}: solve {i}x + 5 = 20" for i in range(answers)]
+
+
+async def async_runs(app, answers, window_ms, sse):
+    """Both windows in one event loop (the upstream clients are bound to it)."""
+    await async_answer(app, questions(1)[0])  # warm up the upstream connection pool
+    runs = []
+    for window in (0, window_ms):
+        sse.SSE_COALESCE_MS = window
+        runs.append([await async_answer(app, q) for q in questions(answers)])
+    return runs
+
+
+def row(name, results):
+    n = len(results)
+    writes = sum(len(w) for w, _ in results) / n
+    body = sum(sum(len(c) for c in w) for w, _ in results) / n
+    wire = sum(wire_bytes(w) for w, _ in results) / n
+    first = sum(f for _, f in results) / n * 1000
+    print(f"  {name:<10} {writes:>8.0f} {body:>11.0f} {wire:>11.0f} {first:>14.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--answers", type=int, default=3)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--window-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    env = upstream_env()
+    env.update({"FAKE_LLM_TOKENS": str(args.tokens), "FAKE_LLM_TOKEN_DELAY": str(args.token_delay),
+                "LOG_LEVEL": "WARNING"})
+    os.environ.update(env)
+    import api
+    import asgi
+    import sse
+
+    server = start([sys.executable, "-m", "uvicorn", "bench.fake_llm_server:app", "--port", str(FAKE_PORT),
+                    "--log-level", "warning"], env)
+    try:
+        asyncio.run(wait_until_up(FAKE_PORT))
+        measured = {}
+        sync_answer(api, questions(1)[0])  # warm up imports and the upstream connection pool
+        runs = {"sync": []}
+        for window in (0, args.window_ms):
+            sse.SSE_COALESCE_MS = window
+            runs["sync"].append([sync_answer(api, q) for q in questions(args.answers)])
+        runs["async"] = asyncio.run(async_runs(asgi.app, args.answers, args.window_ms, sse))
+        for mode, (framed, coalesced) in runs.items():
+            raw = [([t.encode("utf-8") for t in token_texts(w)], f) for w, f in framed]
+            measured[mode] = {"raw": raw, "sse": framed, "coalesced": coalesced}
+    finally:
+        server.terminate()
+
+    print(f"/ask answers of {args.tokens} deltas {args.token_delay * 1000:g} ms apart, "
+          f"coalescing window {args.window_ms:g} ms; per answer:")
+    print(f"  {'':<10} {'writes':>8} {'body bytes':>11} {'wire bytes':>11} {'first write ms':>14}")
+    for mode, rows in measured.items():
+        print(f" {mode}")
+        for name, results in rows.items():
+            row(name, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Time to first audio for /stream_tts: whole-answer synthesis versus sentence pipelining.
+
+Synthesizes a typical step-by-step answer three ways with tts.SpeechSynthesizer:
+- whole: the full text as one synthesis call (what a non-streaming endpoint does);
+- pipelined: split into sentences, synthesized ahead on the worker pool, first WAV sent at once;
+- cached: the same answer again, served from the phrase cache.
+
+By default it uses a stand-in engine that costs FAKE_SECONDS_PER_CHAR of CPU time per character
+(about Piper's medium voices on one core) and returns silence of matching length. With --piper
+it uses the real Piper voice at PIPER_VOICE.
+
+Usage (from the repository root):
+    python bench/tts_bench.py [--piper] [--workers 2]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts import PIPER_VOICE, SpeechSynthesizer, run_piper, split_sentences  # noqa: E402
+
+FAKE_SECONDS_PER_CHAR = 0.004
+FAKE_AUDIO_SECONDS_PER_CHAR = 0.065
+SAMPLE_RATE = 22050
+
+ANSWER = """**Step 1: Understand the problem.** We need to find x in the equation 3x + 5 = 20.
+**Step 2: Move the constant.** Subtract 5 from both sides, so 3x = 15.
+**Step 3: Divide.** Divide both sides by 3, which gives x = 5.
+**Check:** 3 × 5 + 5 = 20, so the answer is correct.
+The concept here is that an equation stays balanced when you do the same operation on both sides. \
+In the SEE exam, always show each step and check your answer by substituting it back.
+**Final answer:** x = 5."""
+
+
+def fake_synthesize(text, voice):
+    """Burns CPU in proportion to the text, like a real engine, and returns silence."""
+    deadline = time.process_time() + len(text) * FAKE_SECONDS_PER_CHAR
+    while time.process_time() < deadline:
+        pass
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(b"\0\0" * int(len(text) * FAKE_AUDIO_SECONDS_PER_CHAR * SAMPLE_RATE))
+    return buffer.getvalue()
+
+
+def audio_seconds(wavs):
+    total = 0.0
+    for wav in wavs:
+        with wave.open(io.BytesIO(wav)) as wav_file:
+            total += wav_file.getnframes() / wav_file.getframerate()
+    return total
+
+
+def run(speech, sentences):
+    started = time.perf_counter()
+    first, wavs = None, []
+    for wav in speech.stream_wav(sentences):
+        if first is None:
+            first = time.perf_counter() - started
+        wavs.append(wav)
+    return first, time.perf_counter() - started, audio_seconds(wavs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--piper", action="store_true", help="use the real Piper voice at PIPER_VOICE")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    engine = run_piper if args.piper else fake_synthesize
+
+    def warmed(workers, cache_mb=0):
+        """A synthesizer whose worker processes are started (and voice loaded) before timing."""
+        speech = SpeechSynthesizer(synthesize=engine, voice=PIPER_VOICE, workers=workers, cache_mb=cache_mb)
+        list(speech.stream_wav([f"Warming up worker {i}." for i in range(workers)]))
+        return speech
+
+    sentences = split_sentences(ANSWER)
+    speech = warmed(args.workers, cache_mb=16)
+    results = {
+        "whole": run(warmed(1), [" ".join(sentences)]),
+        "pipelined": run(speech, sentences),
+        "cached": run(speech, sentences),
+    }
+    print(f"{len(ANSWER)} chars, {len(sentences)} sentences, {args.workers} workers, "
+          f"engine: {'piper' if args.piper else 'stand-in'}")
+    print(f"{'mode':<10} {'first audio s':>14} {'total s':>8} {'audio s':>8}")
+    for mode, (first, total, audio) in results.items():
+        print(f"{mode:<10} {first:>14.2f} {total:>8.2f} {audio:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Measures server memory under concurrent /upload_image requests.
+
+Starts the fake LLM server and the app (sync: gunicorn with threads, async: uvicorn asgi:app),
+sends N concurrent uploads of one large photo-like JPEG, and samples the serving process's
+resident memory while they run. Reports the idle RSS, the peak RSS and the peak growth per
+in-flight upload. OCR and the image cache are turned off so every upload takes the vision
+path. Linux only (reads /proc).
+
+Usage (from the repository root):
+    python bench/upload_memory_bench.py [--concurrency 50] [--size-mb 8] [--mode sync|async|both]
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+import uuid
+
+import httpx
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from async_load_test import FAKE_PORT, start, upstream_env, wait_until_up  # noqa: E402
+
+SYNC_PORT, ASYNC_PORT = 18004, 18005
+
+
+def make_upload(size_mb):
+    """A noisy JPEG of roughly `size_mb` MB (noise defeats compression, like a high-res phone photo)."""
+    target = size_mb * 1024 * 1024
+    side = 1000
+    for _ in range(3):
+        image = Image.effect_noise((side, side), 90).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=95)
+        side = int(side * (target / buffer.tell()) ** 0.5)
+    return buffer.getvalue()
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def serving_pid(process):
+    """The process that handles requests: gunicorn's worker, or the uvicorn process itself."""
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            with open(f"/proc/{process.pid}/task/{process.pid}/children") as f:
+                children = f.read().split()
+        except OSError:
+            children = []
+        if children:
+            return int(children[0])
+        if "uvicorn" in " ".join(process.args):
+            return process.pid
+        time.sleep(0.2)
+    return process.pid
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.02):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                self.peak = max(self.peak, rss_kb(self.pid))
+            except OSError:
+                return
+            time.sleep(self.interval)
+
+
+async def one_upload(port, image):
+    """One upload as a fresh guest (own cookie jar, so the daily quota doesn't interfere)."""
+    files = {"image": ("photo.jpg", image, "image/jpeg")}
+    data = {"chat_id": str(uuid.uuid4()), "caption": "solve"}
+    async with httpx.AsyncClient(timeout=300) as client:
+        async with client.stream("POST", f"http://127.0.0.1:{port}/upload_image", data=data, files=files) as response:
+            body = b"".join([chunk async for chunk in response.aiter_bytes()])
+    return response.status_code, len(body)
+
+
+async def run_mode(mode, env, image, concurrency):
+    port = SYNC_PORT if mode == "sync" else ASYNC_PORT
+    if mode == "sync":
+        cmd = [sys.executable, "-m", "gunicorn", "-w", "1", "-k", "gthread", "--threads", str(concurrency),
+               "--timeout", "600", "-b", f"127.0.0.1:{port}", "api:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"]
+    server = start(cmd, env)
+    try:
+        await wait_until_up(port)
+        pid = serving_pid(server)
+        await one_upload(port, image)  # warm up imports, pools and the model path
+        idle = rss_kb(pid)
+        sampler = RssSampler(pid)
+        sampler.start()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one_upload(port, image) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+        sampler.running = False
+        sampler.join()
+    finally:
+        server.terminate()
+    ok = sum(1 for status, size in results if status == 200 and size)
+    return {"idle_mb": idle / 1024, "peak_mb": sampler.peak / 1024, "ok": ok, "wall_s": wall}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+    args = parser.parse_args()
+
+    image = make_upload(args.size_mb)
+    env = upstream_env()
+    env.update({"OCR_ENABLED": "false", "IMAGE_CACHE_ENABLED": "false", "FAKE_LLM_TOKENS": "20"})
+    fake = start([sys.executable, "-m", "uvicorn", "bench.fake_llm_server:app", "--port", str(FAKE_PORT),
+                  "--log-level", "warning"], env)
+    results = {}
+    try:
+        await wait_until_up(FAKE_PORT)
+        for mode in (["sync", "async"] if args.mode == "both" else [args.mode]):
+            results[mode] = await run_mode(mode, env, image, args.concurrency)
+    finally:
+        fake.terminate()
+
+    print(f"{args.concurrency} concurrent uploads of {len(image) / (1024 * 1024):.1f} MB")
+    print(f"{'mode':<6} {'ok':>4} {'idle MB':>8} {'peak MB':>8} {'growth MB':>10} {'MB/upload':>10} {'wall s':>7}")
+    for mode, r in results.items():
+        growth = r["peak_mb"] - r["idle_mb"]
+        print(f"{mode:<6} {r['ok']:>4} {r['idle_mb']:>8.0f} {r['peak_mb']:>8.0f} {growth:>10.0f} "
+              f"{growth / args.concurrency:>10.2f} {r['wall_s']:>7.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Web search latency against the fake Serper server (bench/fake_search_server.py).
+
+Compares, for one query whose third result page hangs:
+- sequential: search, then fetch the top pages one after another (the page timeout still applies);
+- concurrent: web_search.run_search, fetching the pages in parallel under one deadline;
+- cached: the same query again, answered from the query cache;
+- overlapped: start_search() followed by --prep-ms of other request work (loading the chat,
+  building the prompt), as /ask does; reports how much the search added on top of that work.
+
+Usage (from the repository root):
+    python bench/web_search_bench.py [--pages 3] [--prep-ms 300]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_load_test import start, wait_until_up  # noqa: E402
+
+SEARCH_PORT = 18006
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--prep-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    os.environ.update({
+        "SERPER_API_URL": f"http://127.0.0.1:{SEARCH_PORT}/search",
+        "SERPER_API_KEY": "bench",
+        "WEB_SEARCH_PAGES": str(args.pages),
+        "RATE_LIMIT_ENABLED": "false",
+    })
+    import web_search
+
+    server = start([sys.executable, "-m", "uvicorn", "bench.fake_search_server:app", "--port", str(SEARCH_PORT),
+                    "--log-level", "warning"], dict(os.environ))
+    try:
+        asyncio.run(wait_until_up(SEARCH_PORT))
+
+        def sequential(query):
+            results = web_search.search_serper(query)
+            for r in results[:args.pages]:
+                try:
+                    r["text"] = web_search.fetch_page_text(r["link"])
+                except Exception:
+                    r["text"] = ""
+            return results
+
+        _, sequential_s = timed(sequential, "sequential quadratic formula")
+        cold, concurrent_s = timed(web_search.run_search, "quadratic formula")
+        _, cached_s = timed(web_search.run_search, "Quadratic formula?")
+
+        started = time.perf_counter()
+        job = web_search.start_search("pythagoras theorem")
+        time.sleep(args.prep_ms / 1000)
+        job.results()
+        overlapped_s = time.perf_counter() - started
+    finally:
+        server.terminate()
+
+    read = sum(1 for r in cold[:args.pages] if r["text"])
+    context = web_search.format_context(cold)
+    print(f"top {args.pages} pages, one of them hangs; page timeout {web_search.WEB_FETCH_TIMEOUT:g} s")
+    print(f"sequential:  {sequential_s * 1000:7.0f} ms")
+    print(f"concurrent:  {concurrent_s * 1000:7.0f} ms  ({read}/{args.pages} pages read, "
+          f"{len(context)} context chars)")
+    print(f"cached:      {cached_s * 1000:7.1f} ms")
+    print(f"overlapped:  {overlapped_s * 1000:7.0f} ms with {args.prep_ms:g} ms of prompt work "
+          f"(+{max(overlapped_s * 1000 - args.prep_ms, 0):.0f} ms for the search)")
+
+
+if __name__ == "__main__":
+    main()
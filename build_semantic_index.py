@@ -0,0 +1,61 @@
+"""
+Seeds the semantic answer cache from existing chat history.
+
+Every chat's first question and the answer that followed it become one Q&A pair in the
+SEMANTIC_CACHE_PATH index file, which the app loads at startup.
+
+Usage:
+    SEMANTIC_CACHE_PATH=semantic_index.jsonl python build_semantic_index.py [--dir chat_history] [--backend jsonl|sqlite]
+"""
+import argparse
+import os
+
+from chat_store import CHAT_STORE_BACKEND, create_chat_store
+from prompts import SEE_PROMPT_VERSION
+from semantic_cache import SEMANTIC_CACHE_PATH, SemanticCache, semantic_scope
+
+
+def first_turn_pair(messages):
+    """Returns (question, answer) for the first user message directly followed by a bot answer."""
+    for message, reply in zip(messages, messages[1:]):
+        if message.get('type') == 'user' and reply.get('type') == 'bot':
+            question, answer = message.get('text', '').strip(), reply.get('text', '').strip()
+            if question and answer and not question.startswith("[Image Upload]") and not answer.startswith("Error"):
+                return question, answer
+            return None
+    return None
+
+
+def build(chat_dir, backend, output_path, model_choice):
+    store = create_chat_store(chat_dir, backend)
+    index = SemanticCache(path=output_path)
+    scope = semantic_scope(model_choice, SEE_PROMPT_VERSION)
+    existing = index.stats()["entries"]
+    added = 0
+    for user_id, chat_id in store.iter_chats():
+        pair = first_turn_pair(store.load(user_id, chat_id))
+        if pair is None:
+            continue
+        question, answer = pair
+        found, _ = index.lookup(scope, question)
+        if found is not None:
+            continue  # a near-duplicate is already indexed
+        index.add(scope, question, answer)
+        added += 1
+    print(f"Indexed {added} new Q&A pairs ({existing} already in {output_path}).")
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the semantic answer cache from chat history.")
+    parser.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_history"))
+    parser.add_argument("--backend", default=CHAT_STORE_BACKEND, choices=["jsonl", "sqlite"])
+    parser.add_argument("--output", default=SEMANTIC_CACHE_PATH or "semantic_index.jsonl")
+    # Chat history doesn't record which model answered, so seeded answers go to one model choice
+    parser.add_argument("--model-choice", default="general")
+    args = parser.parse_args()
+    build(args.dir, args.backend, args.output, args.model_choice)
+
+
+if __name__ == "__main__":
+    main()
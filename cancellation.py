@@ -0,0 +1,121 @@
+"""
+Per-chat cancellation of answer generation.
+
+Every streamed answer registers a Generation under (user_id, chat_id). /stop_generation
+cancels it: the flag is set, and every upstream response the generation opened is closed
+right away, so a stream blocked waiting for the provider's next chunk ends at once and the
+provider stops generating. The streaming loops check the flag between chunks, the routers
+don't fall back to another provider, and the partial answer is saved as the bot turn.
+
+The registry is per worker process. On other workers an /ask answer, which runs as a
+background job (answer_jobs), is finished and saved anyway; an upload stream still ends when
+the page's fetch abort makes the next chunk fail to write. Stats estimate what a stop saved against the
+average length and duration of answers that ran to completion.
+"""
+import threading
+import time
+
+from context_window import estimate_tokens
+from telemetry import log
+
+
+class Generation:
+    """One in-flight answer; cancel() stops it and closes its upstream connections."""
+
+    def __init__(self, key):
+        self.key = key
+        self.started = time.monotonic()
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def is_set(self):
+        return self._cancelled.is_set()
+
+    def add_callback(self, callback):
+        """Runs `callback()` on cancellation (right away if already cancelled)."""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run(callback)
+
+    def watch(self, response):
+        """on_open hook for the provider streams: the response is closed if the generation is cancelled."""
+        self.add_callback(response.close)
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run(callback)
+
+    @staticmethod
+    def _run(callback):
+        try:
+            callback()
+        except Exception as e:
+            log.error("Cancellation callback failed: %s", e)
+
+
+class GenerationRegistry:
+    """The in-flight generation of each chat, and stop/completion stats."""
+
+    def __init__(self):
+        self._active = {}
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "completed": 0, "stopped": 0, "disconnected": 0,
+                       "tokens_before_stop": 0, "tokens_saved": 0, "seconds_saved": 0.0}
+        self._completed_tokens = 0
+        self._completed_seconds = 0.0
+
+    def start(self, user_id, chat_id):
+        generation = Generation((user_id, chat_id))
+        with self._lock:
+            self._active[generation.key] = generation
+            self._stats["started"] += 1
+        return generation
+
+    def cancel(self, user_id, chat_id):
+        """Cancels the chat's in-flight generation. Returns False if there is none."""
+        with self._lock:
+            generation = self._active.get((user_id, chat_id))
+        if generation is None:
+            return False
+        generation.cancel()
+        return True
+
+    def finish(self, generation, text, completed):
+        """
+        Unregisters a generation. `completed` is False when it ended early: stopped via
+        cancel(), or the client went away.
+        """
+        elapsed = time.monotonic() - generation.started
+        tokens = estimate_tokens(text) if text else 0
+        with self._lock:
+            if self._active.get(generation.key) is generation:
+                del self._active[generation.key]
+            if completed:
+                self._stats["completed"] += 1
+                self._completed_tokens += tokens
+                self._completed_seconds += elapsed
+                return
+            self._stats["stopped" if generation.is_set() else "disconnected"] += 1
+            self._stats["tokens_before_stop"] += tokens
+            if self._stats["completed"]:
+                average_tokens = self._completed_tokens / self._stats["completed"]
+                average_seconds = self._completed_seconds / self._stats["completed"]
+                self._stats["tokens_saved"] += max(round(average_tokens - tokens), 0)
+                self._stats["seconds_saved"] += max(average_seconds - elapsed, 0.0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, active=len(self._active))
+            completed = stats["completed"]
+            stats["avg_answer_tokens"] = round(self._completed_tokens / completed) if completed else None
+            stats["avg_answer_seconds"] = round(self._completed_seconds / completed, 2) if completed else None
+        stats["seconds_saved"] = round(stats["seconds_saved"], 2)
+        return stats
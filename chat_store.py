@@ -0,0 +1,568 @@
+import contextlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are only serialized within one process
+    fcntl = None
+
+from telemetry import log
+
+# --- CHAT STORE CONFIG ---
+# "jsonl" keeps one append-only log per chat, "sqlite" keeps every chat in a single WAL database.
+CHAT_STORE_BACKEND = os.environ.get("CHAT_STORE_BACKEND", "jsonl").lower()
+SQLITE_DB_NAME = "chats.db"
+LOCK_FILE_NAME = "_index.lock"
+INDEX_FILE_NAME = "_index.jsonl"
+# An index log is compacted once it is over this size and twice its size after the last compaction
+INDEX_COMPACT_BYTES = 64 * 1024
+META_FILE_SUFFIX = ".meta.json"
+SUMMARY_FILE_SUFFIX = ".summary.json"
+DEFAULT_CHAT_TITLE = "New Chat"
+CHAT_TITLE_LENGTH = 30
+
+
+def safe_id(value):
+    """Strips everything except letters, digits, '-' and '_' so ids are safe to use in paths and keys."""
+    return "".join(c for c in str(value) if c.isalnum() or c in ('-', '_')).strip()
+
+
+def chat_title(message):
+    """Derives the sidebar title from a user message, or None if the message can't provide one."""
+    if message.get('type') != 'user' or not message.get('text', '').strip():
+        return None
+    first_line = message['text'].split('\n')[0]
+    title = first_line[:CHAT_TITLE_LENGTH]
+    if len(first_line) > CHAT_TITLE_LENGTH:
+        title += "..."
+    return title
+
+
+def _index_entry(chat_id, entry):
+    """Shapes an index entry the way /get_chat_history_list returns it."""
+    return {
+        'id': chat_id,
+        'title': entry.get('title') or DEFAULT_CHAT_TITLE,
+        'updated_at': entry.get('updated_at', 0),
+        'message_count': entry.get('message_count', 0),
+    }
+
+
+def _read_tail_lines(file_path, count, block_size=8192):
+    """Reads the last `count` lines of a file by seeking backwards from the end."""
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= count:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            data = f.read(read_size) + data
+    lines = data.splitlines()
+    if pos > 0:
+        # The first line is probably cut in half by the block boundary
+        lines = lines[1:]
+    return lines[-count:]
+
+
+def _iter_lines_backwards(file_path, block_size=8192):
+    """Yields the non-empty lines of a file, last first, reading it backwards in blocks."""
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        rest = b""
+        while pos > 0:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            lines = (f.read(read_size) + rest).split(b"\n")
+            # The first line may continue in the block before this one
+            rest = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if rest.strip():
+            yield rest
+
+
+def _decode_lines(lines, source):
+    """Decodes JSONL lines into messages, skipping lines that are damaged (e.g. a crash mid-write)."""
+    messages = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            messages.append(json.loads(line))
+        except json.JSONDecodeError:
+            log.warning("Skipping malformed chat line in %s", source)
+    return messages
+
+
+class JsonlChatStore:
+    """
+    Stores each chat as an append-only JSONL log under chat_history/<user_id>/<chat_id>.jsonl.
+
+    The chat list is a per-user append-only index log, _index.jsonl: every write appends the
+    chat's entry (title, updated_at, message_count, plus the user's chat count so far), which
+    supersedes the chat's earlier lines. Newest entries are at the end, so a page of the list is
+    read backwards from there, skipping superseded lines, and the chat count is the last line.
+    The log is compacted (sorted, one line per chat) once superseded lines make up half of it.
+    Each chat also has a small <chat_id>.meta.json (title and message count), which appends
+    update in place and the index is rebuilt from if it is missing.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self._lock = threading.Lock()
+        # user dir -> index size after this process last compacted it
+        self._compacted_size = {}
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.root_dir, safe_id(user_id))
+
+    def _chat_path(self, user_id, chat_id):
+        return os.path.join(self._user_dir(user_id), f"{safe_id(chat_id)}.jsonl")
+
+    def _meta_path(self, user_id, chat_id):
+        return os.path.join(self._user_dir(user_id), f"{safe_id(chat_id)}{META_FILE_SUFFIX}")
+
+    def _summary_path(self, user_id, chat_id):
+        return os.path.join(self._user_dir(user_id), f"{safe_id(chat_id)}{SUMMARY_FILE_SUFFIX}")
+
+    def _index_path(self, user_id):
+        return os.path.join(self._user_dir(user_id), INDEX_FILE_NAME)
+
+    @contextlib.contextmanager
+    def _user_lock(self, user_id):
+        """
+        Serializes writes to a user's chats across threads and worker processes: an flock on the
+        user's lock file (each holder opens it, so threads exclude each other too).
+        """
+        os.makedirs(self._user_dir(user_id), exist_ok=True)
+        if fcntl is None:
+            with self._lock:
+                yield
+            return
+        with open(os.path.join(self._user_dir(user_id), LOCK_FILE_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _chat_files(self, user_id):
+        """(modified time, chat_id) of every chat log of the user."""
+        user_dir = self._user_dir(user_id)
+        if not os.path.isdir(user_dir):
+            return []
+        chats = []
+        for entry in os.scandir(user_dir):
+            if entry.name.endswith(".jsonl"):
+                try:
+                    chats.append((entry.stat().st_mtime, entry.name[:-len(".jsonl")]))
+                except FileNotFoundError:
+                    pass
+        return chats
+
+    def _read_meta(self, user_id, chat_id):
+        """The chat's index entry, rebuilt from its log if missing or damaged (call with the user lock held)."""
+        meta_path = self._meta_path(user_id, chat_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            log.warning("Rebuilding damaged chat index entry %s", meta_path)
+        messages = self.load(user_id, chat_id)
+        return {'title': next((t for t in map(chat_title, messages) if t), None), 'message_count': len(messages)}
+
+    def _write_meta(self, user_id, chat_id, meta):
+        meta_path = self._meta_path(user_id, chat_id)
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def _meta(self, user_id, chat_id):
+        """The chat's index entry for readers; entries missing since an upgrade are rebuilt once."""
+        try:
+            with open(self._meta_path(user_id, chat_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        if not os.path.exists(self._chat_path(user_id, chat_id)):
+            return {'title': None, 'message_count': 0}
+        with self._user_lock(user_id):
+            meta = self._read_meta(user_id, chat_id)
+            self._write_meta(user_id, chat_id, meta)
+        return meta
+
+    def _write_index(self, user_id, entries):
+        """Replaces the index log with one line per chat, oldest first (call with the user lock held)."""
+        index_path = self._index_path(user_id)
+        tmp_path = f"{index_path}.tmp"
+        entries = sorted(entries, key=lambda entry: entry['updated_at'])
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for count, entry in enumerate(entries, 1):
+                f.write(json.dumps(dict(entry, chats=count), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, index_path)
+        self._compacted_size[self._user_dir(user_id)] = os.path.getsize(index_path)
+
+    def _rebuild_index(self, user_id):
+        """Rebuilds a missing index log from the chat logs and their meta files (user lock held)."""
+        entries = []
+        for updated_at, chat_id in self._chat_files(user_id):
+            meta = self._read_meta(user_id, chat_id)
+            entries.append({'id': chat_id, 'title': meta.get('title'), 'updated_at': updated_at,
+                            'message_count': meta.get('message_count', 0)})
+        if entries:
+            log.info("Rebuilt the chat index of %s (%d chats)", safe_id(user_id), len(entries))
+        self._write_index(user_id, entries)
+
+    def _compact_index(self, user_id):
+        """Rewrites the index log without superseded or damaged lines (user lock held)."""
+        index_path = self._index_path(user_id)
+        with open(index_path, 'rb') as f:
+            lines = f.readlines()
+        latest = {entry['id']: entry for entry in _decode_lines(lines, index_path)}
+        self._write_index(user_id, latest.values())
+
+    def _ensure_index(self, user_id):
+        """Makes sure the user's index log exists, rebuilding it if needed (user lock held)."""
+        if not os.path.exists(self._index_path(user_id)):
+            self._rebuild_index(user_id)
+
+    def _last_index_entry(self, user_id):
+        """The index log's last entry (user lock held); a damaged last line gets the log compacted."""
+        index_path = self._index_path(user_id)
+        for line in _iter_lines_backwards(index_path):
+            try:
+                return json.loads(line)
+            except json.JSONDecodeError:
+                log.warning("Compacting chat index %s after a damaged line", index_path)
+                self._compact_index(user_id)
+                return next(map(json.loads, _iter_lines_backwards(index_path)), None)
+        return None
+
+    def _update_index(self, user_id, chat_id, meta, updated_at, new_chat):
+        """Appends the chat's entry to the index log, compacting it when needed (user lock held)."""
+        last = self._last_index_entry(user_id) or {}
+        entry = {
+            'id': safe_id(chat_id), 'title': meta.get('title'), 'updated_at': updated_at,
+            'message_count': meta.get('message_count', 0), 'chats': last.get('chats', 0) + bool(new_chat),
+        }
+        index_path = self._index_path(user_id)
+        with open(index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # Entries must stay in updated_at order (save() may be given an older time)
+        size = os.path.getsize(index_path)
+        compact_at = max(INDEX_COMPACT_BYTES, 2 * self._compacted_size.get(self._user_dir(user_id), 0))
+        if updated_at < last.get('updated_at', 0) or size > compact_at:
+            self._compact_index(user_id)
+
+    def _index_entries(self, user_id):
+        """Yields the user's current index entries, most recently updated first."""
+        if not os.path.isdir(self._user_dir(user_id)):
+            return
+        if not os.path.exists(self._index_path(user_id)):
+            with self._user_lock(user_id):
+                self._ensure_index(user_id)
+        seen = set()
+        index_path = self._index_path(user_id)
+        try:
+            for line in _iter_lines_backwards(index_path):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    log.warning("Skipping malformed chat index line in %s", index_path)
+                    continue
+                if entry['id'] not in seen:
+                    seen.add(entry['id'])
+                    yield entry
+        except FileNotFoundError:
+            return  # deleted by delete_all meanwhile
+
+    def load(self, user_id, chat_id, tail=None):
+        """Returns the chat's messages, or only the last `tail` of them."""
+        file_path = self._chat_path(user_id, chat_id)
+        if not os.path.exists(file_path):
+            return []
+        if tail:
+            lines = _read_tail_lines(file_path, tail)
+        else:
+            with open(file_path, 'rb') as f:
+                lines = f.readlines()
+        return _decode_lines(lines, file_path)
+
+    def append(self, user_id, chat_id, message):
+        """Appends a single message without touching the rest of the chat."""
+        line = json.dumps(message, ensure_ascii=False) + "\n"
+        with self._user_lock(user_id):
+            # Read the entries first so a rebuild from the log can't count this message twice
+            self._ensure_index(user_id)
+            meta = self._read_meta(user_id, chat_id)
+            new_chat = not os.path.exists(self._chat_path(user_id, chat_id))
+            with open(self._chat_path(user_id, chat_id), 'a', encoding='utf-8') as f:
+                f.write(line)
+            meta['title'] = meta.get('title') or chat_title(message)
+            meta['message_count'] = meta.get('message_count', 0) + 1
+            self._write_meta(user_id, chat_id, meta)
+            self._update_index(user_id, chat_id, meta, time.time(), new_chat)
+
+    def save(self, user_id, chat_id, messages, updated_at=None):
+        """Replaces the whole chat (used for new chats and migrations)."""
+        file_path = self._chat_path(user_id, chat_id)
+        tmp_path = f"{file_path}.tmp"
+        with self._user_lock(user_id):
+            self._ensure_index(user_id)
+            new_chat = not os.path.exists(file_path)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for message in messages:
+                    f.write(json.dumps(message, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, file_path)
+            if updated_at is not None:
+                os.utime(file_path, (updated_at, updated_at))
+            # A replaced chat invalidates its summary
+            try:
+                os.remove(self._summary_path(user_id, chat_id))
+            except FileNotFoundError:
+                pass
+            meta = {
+                'title': next((t for t in map(chat_title, messages) if t), None),
+                'message_count': len(messages),
+            }
+            self._write_meta(user_id, chat_id, meta)
+            self._update_index(user_id, chat_id, meta, time.time() if updated_at is None else updated_at, new_chat)
+
+    def list_chats(self, user_id, offset=0, limit=None):
+        """Returns one page of the user's chat index entries, most recently modified first."""
+        entries = self._index_entries(user_id)
+        end = None if limit is None else offset + limit
+        try:
+            return [_index_entry(entry['id'], entry) for entry in itertools.islice(entries, offset, end)]
+        finally:
+            entries.close()
+
+    def count_chats(self, user_id):
+        """Returns how many chats the user has, from the index log's last entry."""
+        entries = self._index_entries(user_id)
+        try:
+            entry = next(entries, None)
+        finally:
+            entries.close()
+        return entry.get('chats', 0) if entry else 0
+
+    def count_messages(self, user_id, chat_id):
+        """Returns how many messages the chat has, from its index entry."""
+        return self._meta(user_id, chat_id).get('message_count', 0)
+
+    def load_summary(self, user_id, chat_id):
+        """Returns the chat's rolling summary, or None."""
+        try:
+            with open(self._summary_path(user_id, chat_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save_summary(self, user_id, chat_id, summary):
+        """Stores the chat's rolling summary next to its log."""
+        summary_path = self._summary_path(user_id, chat_id)
+        tmp_path = f"{summary_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False)
+        os.replace(tmp_path, summary_path)
+
+    def iter_chats(self):
+        """Yields (user_id, chat_id) for every stored chat (for offline tools, not request paths)."""
+        for user_entry in os.scandir(self.root_dir):
+            if not user_entry.is_dir():
+                continue
+            for entry in os.scandir(user_entry.path):
+                if entry.name.endswith(".jsonl"):
+                    yield user_entry.name, entry.name[:-len(".jsonl")]
+
+    def delete_all(self, user_id):
+        """Deletes every chat of the user and returns how many were removed."""
+        count = 0
+        with self._user_lock(user_id):
+            try:
+                os.remove(self._index_path(user_id))
+            except FileNotFoundError:
+                pass
+            self._compacted_size.pop(self._user_dir(user_id), None)
+            for _, chat_id in self._chat_files(user_id):
+                try:
+                    os.remove(self._chat_path(user_id, chat_id))
+                    count += 1
+                except FileNotFoundError:
+                    pass
+                for path in (self._meta_path(user_id, chat_id), self._summary_path(user_id, chat_id)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+        return count
+
+
+class SqliteChatStore:
+    """Stores all chats in one SQLite database in WAL mode, keyed by (user_id, chat_id)."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chats ("
+                " user_id TEXT NOT NULL, chat_id TEXT NOT NULL, updated_at REAL NOT NULL,"
+                " title TEXT, message_count INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (user_id, chat_id))"
+            )
+            # Databases created before the index columns existed
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(chats)")}
+            if 'title' not in columns:
+                conn.execute("ALTER TABLE chats ADD COLUMN title TEXT")
+            if 'message_count' not in columns:
+                conn.execute("ALTER TABLE chats ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " user_id TEXT NOT NULL, chat_id TEXT NOT NULL, data TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_chat ON messages (user_id, chat_id, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chats_user ON chats (user_id, updated_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                " user_id TEXT NOT NULL, chat_id TEXT NOT NULL, data TEXT NOT NULL,"
+                " PRIMARY KEY (user_id, chat_id))"
+            )
+
+    def _conn(self):
+        """One connection per thread; sqlite3 connections must not be shared across threads."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, user_id, chat_id, tail=None):
+        """Returns the chat's messages, or only the last `tail` of them."""
+        key = (safe_id(user_id), safe_id(chat_id))
+        if tail:
+            rows = self._conn().execute(
+                "SELECT data FROM (SELECT seq, data FROM messages WHERE user_id = ? AND chat_id = ?"
+                " ORDER BY seq DESC LIMIT ?) ORDER BY seq",
+                (*key, tail),
+            ).fetchall()
+        else:
+            rows = self._conn().execute(
+                "SELECT data FROM messages WHERE user_id = ? AND chat_id = ? ORDER BY seq", key
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _touch(self, conn, key, title, added, updated_at=None, replace=False):
+        """Updates the chat's index row in the same transaction as the message write."""
+        conn.execute(
+            "INSERT INTO chats (user_id, chat_id, updated_at, title, message_count) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (user_id, chat_id) DO UPDATE SET"
+            " updated_at = excluded.updated_at,"
+            + (" title = excluded.title, message_count = excluded.message_count" if replace else
+               " title = COALESCE(chats.title, excluded.title), message_count = chats.message_count + excluded.message_count"),
+            (*key, updated_at or time.time(), title, added),
+        )
+
+    def append(self, user_id, chat_id, message):
+        """Appends a single message as one row."""
+        key = (safe_id(user_id), safe_id(chat_id))
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO messages (user_id, chat_id, data) VALUES (?, ?, ?)",
+                (*key, json.dumps(message, ensure_ascii=False)),
+            )
+            self._touch(conn, key, chat_title(message), 1)
+
+    def save(self, user_id, chat_id, messages, updated_at=None):
+        """Replaces the whole chat (used for new chats and migrations)."""
+        key = (safe_id(user_id), safe_id(chat_id))
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE user_id = ? AND chat_id = ?", key)
+            conn.execute("DELETE FROM summaries WHERE user_id = ? AND chat_id = ?", key)
+            conn.executemany(
+                "INSERT INTO messages (user_id, chat_id, data) VALUES (?, ?, ?)",
+                [(*key, json.dumps(m, ensure_ascii=False)) for m in messages],
+            )
+            title = next((t for t in map(chat_title, messages) if t), None)
+            self._touch(conn, key, title, len(messages), updated_at, replace=True)
+
+    def list_chats(self, user_id, offset=0, limit=None):
+        """Returns one page of the user's chat index rows, most recently modified first."""
+        rows = self._conn().execute(
+            "SELECT chat_id, title, updated_at, message_count FROM chats WHERE user_id = ?"
+            " ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            (safe_id(user_id), -1 if limit is None else limit, offset),
+        ).fetchall()
+        return [
+            _index_entry(chat_id, {'title': title, 'updated_at': updated_at, 'message_count': count})
+            for chat_id, title, updated_at, count in rows
+        ]
+
+    def count_chats(self, user_id):
+        """Returns how many chats the user has."""
+        return self._conn().execute("SELECT COUNT(*) FROM chats WHERE user_id = ?", (safe_id(user_id),)).fetchone()[0]
+
+    def count_messages(self, user_id, chat_id):
+        """Returns how many messages the chat has, from the index row."""
+        row = self._conn().execute(
+            "SELECT message_count FROM chats WHERE user_id = ? AND chat_id = ?", (safe_id(user_id), safe_id(chat_id))
+        ).fetchone()
+        return row[0] if row else 0
+
+    def load_summary(self, user_id, chat_id):
+        """Returns the chat's rolling summary, or None."""
+        row = self._conn().execute(
+            "SELECT data FROM summaries WHERE user_id = ? AND chat_id = ?", (safe_id(user_id), safe_id(chat_id))
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_summary(self, user_id, chat_id, summary):
+        """Stores the chat's rolling summary."""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (user_id, chat_id, data) VALUES (?, ?, ?)",
+                (safe_id(user_id), safe_id(chat_id), json.dumps(summary, ensure_ascii=False)),
+            )
+
+    def iter_chats(self):
+        """Yields (user_id, chat_id) for every stored chat (for offline tools, not request paths)."""
+        yield from self._conn().execute("SELECT user_id, chat_id FROM chats").fetchall()
+
+    def delete_all(self, user_id):
+        """Deletes every chat of the user and returns how many were removed."""
+        uid = safe_id(user_id)
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE user_id = ?", (uid,))
+            conn.execute("DELETE FROM summaries WHERE user_id = ?", (uid,))
+            return conn.execute("DELETE FROM chats WHERE user_id = ?", (uid,)).rowcount
+
+
+def create_chat_store(root_dir, backend=None):
+    """Builds the chat store selected by CHAT_STORE_BACKEND."""
+    backend = (backend or CHAT_STORE_BACKEND).lower()
+    if backend == "sqlite":
+        os.makedirs(root_dir, exist_ok=True)
+        return SqliteChatStore(os.path.join(root_dir, SQLITE_DB_NAME))
+    if backend == "jsonl":
+        return JsonlChatStore(root_dir)
+    raise ValueError(f"Unknown CHAT_STORE_BACKEND: {backend}")
@@ -0,0 +1,120 @@
+"""
+Rolling conversation summaries.
+
+Every SUMMARY_EVERY_TURNS turns, a background worker folds the chat's older messages into a
+short summary stored next to the chat (see the chat stores' load_summary/save_summary). The
+update is incremental: the previous summary plus only the messages added since it was written
+are sent to the cheapest provider. /ask then sends the summary plus the turns it doesn't cover,
+and never waits for a summary to be written.
+
+A summary is stored as {"text": ..., "covered": n, "updated_at": ...}, where `covered` is the
+number of messages from the start of the chat that the summary stands in for.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import log
+
+# --- SUMMARY CONFIG ---
+SUMMARY_ENABLED = os.environ.get("SUMMARY_ENABLED", "true").lower() == "true"
+# Summarize once this many new turns (user + bot message pairs) are outside the recent window
+SUMMARY_EVERY_TURNS = int(os.environ.get("SUMMARY_EVERY_TURNS", "6"))
+# The most recent messages are always sent verbatim and never folded into the summary
+SUMMARY_KEEP_RECENT_MESSAGES = int(os.environ.get("SUMMARY_KEEP_RECENT_MESSAGES", "8"))
+SUMMARY_WORKERS = int(os.environ.get("SUMMARY_WORKERS", "1"))
+SUMMARY_MAX_WORDS = 200
+
+SUMMARY_INSTRUCTIONS = f"""You maintain a running summary of a tutoring chat between a Nepali SEE student and an AI tutor.
+Update the existing summary with the new messages. Keep the problems the student worked on, their final answers,
+the methods used, and anything the student found difficult. Keep formulas exact. At most {SUMMARY_MAX_WORDS} words.
+Reply with the updated summary only."""
+
+
+def summary_prompt(previous_summary, messages):
+    """Builds the OpenAI-compatible request that folds `messages` into `previous_summary`."""
+    lines = []
+    for message in messages:
+        if message.get('type') in ('user', 'bot'):
+            role = "Student" if message['type'] == 'user' else "Tutor"
+            lines.append(f"{role}: {message.get('text', '')}")
+    content = (
+        f"Existing summary:\n{previous_summary or '(none yet)'}\n\n"
+        f"New messages:\n" + "\n\n".join(lines)
+    )
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": content},
+    ]
+
+
+def uncovered_messages(tail, total, summary):
+    """
+    Drops the messages of `tail` (the last len(tail) of `total` messages) that the summary
+    already covers.
+    """
+    if not summary:
+        return tail
+    first_index = total - len(tail)
+    skip = summary.get('covered', 0) - first_index
+    return tail[skip:] if skip > 0 else tail
+
+
+def needs_summary(total, summary):
+    """True when enough turns have fallen out of the recent window since the last summary."""
+    covered = summary.get('covered', 0) if summary else 0
+    return total - SUMMARY_KEEP_RECENT_MESSAGES - covered >= 2 * SUMMARY_EVERY_TURNS
+
+
+class ChatSummarizer:
+    """Updates chat summaries on a background thread pool, at most one job per chat at a time."""
+
+    def __init__(self, store, complete, workers=SUMMARY_WORKERS):
+        self.store = store
+        # complete(messages) -> text or None; calls a provider without streaming
+        self.complete = complete
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-summary")
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, user_id, chat_id):
+        """Queues a summary update for the chat if one is due. Returns immediately."""
+        if not SUMMARY_ENABLED:
+            return
+        key = (user_id, chat_id)
+        with self._lock:
+            if key in self._in_flight:
+                return
+            self._in_flight.add(key)
+        self._executor.submit(self._run, user_id, chat_id)
+
+    def _run(self, user_id, chat_id):
+        try:
+            self.update(user_id, chat_id)
+        except Exception as e:
+            log.error("Summary update failed for %s: %s", chat_id, e)
+        finally:
+            with self._lock:
+                self._in_flight.discard((user_id, chat_id))
+
+    def update(self, user_id, chat_id):
+        """Folds the messages added since the last summary into it. Returns True if it was updated."""
+        total = self.store.count_messages(user_id, chat_id)
+        summary = self.store.load_summary(user_id, chat_id)
+        if not needs_summary(total, summary):
+            return False
+        covered = summary.get('covered', 0) if summary else 0
+        messages = self.store.load(user_id, chat_id)
+        cutoff = len(messages) - SUMMARY_KEEP_RECENT_MESSAGES
+        started = time.monotonic()
+        text = self.complete(summary_prompt(summary and summary.get('text'), messages[covered:cutoff]))
+        if not text:
+            return False
+        self.store.save_summary(user_id, chat_id, {
+            'text': text.strip(),
+            'covered': cutoff,
+            'updated_at': time.time(),
+        })
+        log.info("Summarized %s: messages %d-%d in %.1fs", chat_id, covered, cutoff, time.monotonic() - started)
+        return True
@@ -0,0 +1,64 @@
+"""
+Token-budgeted context window for /ask.
+
+Long tutoring chats would otherwise send their whole history on every turn. The context builder
+keeps the most recent turns verbatim, newest first, until the model's token budget is used up,
+and drops everything older. Each stored message carries a precomputed "tokens" count (written by
+api.append_chat_message) so the budget is not recomputed from the text on every turn; messages
+stored before that field existed are estimated on the fly.
+"""
+import os
+
+# --- CONTEXT BUDGET CONFIG ---
+# Default budget (in tokens) for the chat history sent with a question
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "6000"))
+# Per-model overrides; the budget is a latency/cost cap, well below each model's context limit
+MODEL_TOKEN_BUDGETS = {
+    "gemini-2.5-flash": int(os.environ.get("GEMINI_CONTEXT_TOKEN_BUDGET", "8000")),
+    "mixtral-8x7b-32768": int(os.environ.get("GROQ_CONTEXT_TOKEN_BUDGET", "6000")),
+}
+# The latest exchange is always sent, even if it alone exceeds the budget
+MIN_CONTEXT_MESSAGES = 2
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate without a tokenizer: about 4 ASCII characters per token, and one
+    token per non-ASCII character (Devanagari and math symbols tokenize poorly).
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii + 3) // 4 + non_ascii
+
+
+def message_tokens(message):
+    """Returns the stored token count of a chat message, estimating it for older messages."""
+    tokens = message.get('tokens')
+    if isinstance(tokens, int):
+        return tokens
+    return estimate_tokens(message.get('text', ''))
+
+
+def token_budget(model):
+    """The history token budget for a model."""
+    return MODEL_TOKEN_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET)
+
+
+def fit_context(chat_history, budget, reserved=0):
+    """
+    Returns the most recent messages of chat_history that fit in `budget` tokens after
+    `reserved` tokens (the new question) are set aside. The window always starts at a user
+    turn so the providers see complete exchanges.
+    """
+    remaining = budget - reserved
+    start = len(chat_history)
+    for i in range(len(chat_history) - 1, -1, -1):
+        cost = message_tokens(chat_history[i])
+        if cost > remaining and len(chat_history) - i > MIN_CONTEXT_MESSAGES:
+            break
+        remaining -= cost
+        start = i
+    while start < len(chat_history) and chat_history[start].get('type') != 'user':
+        start += 1
+    return chat_history[start:]
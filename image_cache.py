@@ -0,0 +1,250 @@
+"""
+Content-addressed cache of /upload_image solutions.
+
+Students re-upload the same worksheet photo and classmates upload the same textbook page, so
+each solved upload is stored under the hash of the image (plus the normalized caption and the
+prompt version). Only a byte-identical upload (same SHA-256) is answered from the cache.
+
+A perceptual hash (pHash) cannot tell math problems apart: a 32x32 thumbnail loses the digits
+and signs, so different one-line equations hash to the same value and different worksheet pages
+land a few bits apart. With IMAGE_CACHE_NEAR_DUPLICATES (off by default), a re-photographed or
+re-compressed copy can still hit, but only when its pHash is within IMAGE_CACHE_PHASH_DISTANCE
+bits of a cached page *and* OCR read exactly the same text from both; the pHash just narrows
+down the candidates. Uploads OCR could not read confidently never match this way.
+
+Entries are JSON files in IMAGE_CACHE_DIR, shared by all workers, bounded by
+IMAGE_CACHE_MAX_ENTRIES with least-recently-used eviction (file mtimes are touched on every
+hit). With IMAGE_CACHE_STORE_UPLOADS, the normalized image is kept in static/uploads as well.
+Exact hits are read straight from disk, so they work across workers; near-duplicate matches use
+the in-memory index each worker loads at startup and updates on its own writes.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+from PIL import Image
+
+from answer_cache import normalize_instruction
+from telemetry import log
+
+# --- IMAGE CACHE CONFIG ---
+IMAGE_CACHE_ENABLED = os.environ.get("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "")
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+# Serve near-duplicate uploads (pHash candidate confirmed by identical OCR text); see above
+IMAGE_CACHE_NEAR_DUPLICATES = os.environ.get("IMAGE_CACHE_NEAR_DUPLICATES", "false").lower() == "true"
+# Max differing pHash bits (out of 64) for a cached page to be a near-duplicate candidate. Rescaled
+# or recompressed copies land at 0-2, but so do different problems, hence the OCR check.
+IMAGE_CACHE_PHASH_DISTANCE = int(os.environ.get("IMAGE_CACHE_PHASH_DISTANCE", "3"))
+IMAGE_CACHE_STORE_UPLOADS = os.environ.get("IMAGE_CACHE_STORE_UPLOADS", "false").lower() == "true"
+
+PHASH_SIZE = 32
+PHASH_BITS = 8
+# DCT-II basis rows for the low frequencies pHash keeps
+_DCT = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)]
+    for u in range(PHASH_BITS)
+]
+
+
+def perceptual_hash(image):
+    """
+    64-bit DCT perceptual hash of a PIL image: the low 8x8 DCT frequencies of a 32x32 grayscale
+    thumbnail, one bit per coefficient above their median. Survives rescaling, recompression
+    and small lighting changes, but is too coarse to tell two printed problems apart.
+    """
+    pixels = list(image.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR).getdata())
+    rows = [pixels[i * PHASH_SIZE:(i + 1) * PHASH_SIZE] for i in range(PHASH_SIZE)]
+    # Separable 2D DCT, keeping only the first PHASH_BITS frequencies in each direction
+    partial = [[sum(b * p for b, p in zip(basis, row)) for basis in _DCT] for row in rows]
+    coefficients = [
+        sum(_DCT[u][y] * partial[y][v] for y in range(PHASH_SIZE))
+        for u in range(PHASH_BITS) for v in range(PHASH_BITS)
+    ]
+    # The DC term only reflects overall brightness
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+    value = 0
+    for c in coefficients:
+        value = (value << 1) | (c > median)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def normalize_ocr_text(text):
+    """OCR text with whitespace runs collapsed; everything else (digits, signs, case) must match."""
+    return " ".join(text.split())
+
+
+def _entry_key(digest, caption, scope):
+    return hashlib.sha256(f"{scope}|{digest}|{normalize_instruction(caption)}".encode("utf-8")).hexdigest()
+
+
+class ImageSolutionCache:
+    """Disk-backed, size-bounded cache of upload solutions keyed by image hash and caption."""
+
+    def __init__(self, cache_dir, max_entries=IMAGE_CACHE_MAX_ENTRIES, phash_distance=IMAGE_CACHE_PHASH_DISTANCE,
+                 uploads_dir=None, near_duplicates=IMAGE_CACHE_NEAR_DUPLICATES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.phash_distance = phash_distance
+        self.near_duplicates = near_duplicates
+        self.uploads_dir = uploads_dir
+        self._lock = threading.Lock()
+        # (scope, caption) -> {key: phash}, for near-duplicate lookups
+        self._phashes = {}
+        self._writes = 0
+        self.exact_hits = 0
+        self.near_duplicate_hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        if near_duplicates:
+            self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                self._index(record)
+            except (OSError, json.JSONDecodeError, KeyError):
+                continue
+
+    def _index(self, record):
+        bucket = self._phashes.setdefault((record['scope'], record['caption']), {})
+        bucket[record['key']] = int(record['phash'], 16)
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            os.utime(self._path(key))  # LRU: recently hit entries are evicted last
+            return record
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def lookup(self, sha256, caption, scope=""):
+        """Returns the cached solution for a byte-identical upload with the same caption, else None."""
+        record = self._read(_entry_key(sha256, caption, scope))
+        with self._lock:
+            if record is None:
+                self.misses += 1
+                return None
+            self.exact_hits += 1
+        return record['answer']
+
+    def lookup_near_duplicate(self, phash, ocr_text, caption, scope=""):
+        """
+        Returns the solution of a cached page within phash_distance bits whose OCR text is the same
+        as `ocr_text`, else None. Always None unless near_duplicates is on.
+        """
+        if not self.near_duplicates or not ocr_text:
+            return None
+        text = normalize_ocr_text(ocr_text)
+        caption_key = normalize_instruction(caption)
+        with self._lock:
+            bucket = dict(self._phashes.get((scope, caption_key), {}))
+        candidates = sorted((hamming(phash, other), key) for key, other in bucket.items())
+        for distance, key in candidates:
+            if distance > self.phash_distance:
+                break
+            record = self._read(key)
+            if record is None:
+                with self._lock:
+                    self._phashes.get((scope, caption_key), {}).pop(key, None)  # evicted by another worker
+                continue
+            if record.get('ocr_text') and normalize_ocr_text(record['ocr_text']) == text:
+                with self._lock:
+                    self.near_duplicate_hits += 1
+                log.info("Image cache: near-duplicate match (%d bits apart, same OCR text)", distance)
+                return record['answer']
+        return None
+
+    def put(self, sha256, phash, caption, answer, scope="", image_data=None, mime_type=None, ocr_text=None):
+        """
+        Stores a solution (and optionally the normalized image in the uploads folder). `ocr_text`,
+        what OCR read from the upload, is what a near-duplicate has to match.
+        """
+        key = _entry_key(sha256, caption, scope)
+        image_file = None
+        if self.uploads_dir and image_data:
+            extension = {"image/png": "png", "image/webp": "webp"}.get(mime_type, "jpg")
+            image_file = f"{sha256}.{extension}"
+            try:
+                with open(os.path.join(self.uploads_dir, image_file), 'wb') as f:
+                    f.write(image_data)
+            except OSError as e:
+                log.warning("Image cache: could not store upload: %s", e)
+                image_file = None
+        record = {
+            'key': key, 'scope': scope, 'caption': normalize_instruction(caption),
+            'sha256': sha256, 'phash': f"{phash:016x}", 'ocr_text': ocr_text, 'answer': answer,
+            'image_file': image_file, 'created_at': time.time(),
+        }
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            log.warning("Image cache write failed: %s", e)
+            return
+        with self._lock:
+            if self.near_duplicates:
+                self._index(record)
+            self._writes += 1
+            check_bound = self._writes % 20 == 0
+        if check_bound:
+            self._evict()
+
+    def _evict(self):
+        """Deletes the least recently used entries (and their stored images) beyond max_entries."""
+        entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith(".json")]
+        overflow = len(entries) - self.max_entries
+        if overflow <= 0:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:overflow]:
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                os.remove(entry.path)
+            except (OSError, json.JSONDecodeError):
+                continue
+            with self._lock:
+                self._phashes.get((record.get('scope'), record.get('caption')), {}).pop(record.get('key'), None)
+            if record.get('image_file') and self.uploads_dir:
+                try:
+                    os.remove(os.path.join(self.uploads_dir, record['image_file']))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": IMAGE_CACHE_ENABLED,
+                "indexed": sum(len(bucket) for bucket in self._phashes.values()),
+                "exact_hits": self.exact_hits,
+                "near_duplicates": self.near_duplicates,
+                "near_duplicate_hits": self.near_duplicate_hits,
+                "misses": self.misses,
+                "stores_uploads": bool(self.uploads_dir),
+            }
+
+
+def create_image_cache(default_dir, uploads_dir):
+    """Builds the image solution cache from the IMAGE_CACHE_* settings."""
+    return ImageSolutionCache(
+        IMAGE_CACHE_DIR or default_dir,
+        uploads_dir=uploads_dir if IMAGE_CACHE_STORE_UPLOADS else None,
+    )
@@ -0,0 +1,179 @@
+"""
+Image preprocessing for /upload_image.
+
+Phone photos of exercise books are several MB at full resolution, which slows the upload to
+Gemini and costs vision tokens without helping it read the problem. Before an image is sent,
+it is EXIF-oriented, converted to grayscale if it has no meaningful colour (text on paper),
+downscaled to IMAGE_MAX_EDGE and recompressed as JPEG or WebP, with the matching MIME type.
+The work runs on a small worker pool so a burst of uploads can't occupy every request thread
+with image decoding.
+
+Uploads are read from the file the web framework spooled them to, never as one bytes object:
+the size limit and hash are checked in chunks, and Pillow decodes straight from the file.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, ImageStat, UnidentifiedImageError
+
+from image_cache import perceptual_hash
+
+# --- IMAGE PIPELINE CONFIG ---
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1600"))
+IMAGE_OUTPUT_FORMAT = os.environ.get("IMAGE_OUTPUT_FORMAT", "JPEG").upper()  # JPEG or WEBP
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "80"))
+IMAGE_AUTO_GRAYSCALE = os.environ.get("IMAGE_AUTO_GRAYSCALE", "true").lower() == "true"
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get("IMAGE_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+READ_CHUNK_SIZE = 1024 * 1024
+EXIF_ORIENTATION = 0x0112
+# Mean HSV saturation (0-255) below which an image is treated as text-only
+GRAYSCALE_SATURATION_THRESHOLD = 24
+
+OUTPUT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-preprocess")
+_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+_stats_lock = threading.Lock()
+
+
+class UploadTooLarge(ValueError):
+    """The upload is over IMAGE_MAX_UPLOAD_BYTES."""
+
+
+def too_large_message(max_bytes=IMAGE_MAX_UPLOAD_BYTES):
+    return f"Image is larger than {max_bytes / (1024 * 1024):.3g} MB"
+
+
+class PreparedImage:
+    """A preprocessed upload, ready to be base64-encoded for Gemini."""
+
+    def __init__(self, data, mime_type, original_size, width, height, grayscale, sha256=None, phash=None):
+        self.data = data
+        self.mime_type = mime_type
+        self.original_size = original_size
+        self.width = width
+        self.height = height
+        self.grayscale = grayscale
+        # Content hashes of the upload, for the image solution cache
+        self.sha256 = sha256
+        self.phash = phash
+
+    @property
+    def bytes_saved(self):
+        return self.original_size - len(self.data)
+
+
+def is_text_only(image):
+    """True if the image has almost no colour, like a photo of handwriting or a printed page."""
+    sample = image.convert("RGB")
+    sample.thumbnail((128, 128))
+    saturation = ImageStat.Stat(sample.convert("HSV").getchannel("S")).mean[0]
+    return saturation < GRAYSCALE_SATURATION_THRESHOLD
+
+
+def _flatten(image):
+    """Drops alpha onto a white background; JPEG has no transparency."""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _scan_upload(stream, max_bytes):
+    """Hashes a file in chunks, enforcing the size limit. Returns (size, sha256) and rewinds."""
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    for block in iter(lambda: stream.read(READ_CHUNK_SIZE), b""):
+        size += len(block)
+        if size > max_bytes:
+            raise UploadTooLarge(too_large_message(max_bytes))
+        digest.update(block)
+    stream.seek(0)
+    return size, digest.hexdigest()
+
+
+def preprocess_image(source, max_edge=IMAGE_MAX_EDGE, output_format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_QUALITY,
+                     max_bytes=IMAGE_MAX_UPLOAD_BYTES):
+    """
+    Orients, optionally grayscales, downscales and recompresses an uploaded image. `source` is
+    the raw bytes or a binary file (such as the spooled upload), read in place.
+    """
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    original_size, sha256 = _scan_upload(stream, max_bytes)
+    try:
+        image = Image.open(stream)
+        source_format = image.format
+        # Let the JPEG decoder scale down while decoding; much cheaper than a full-size decode
+        image.draft("RGB", (max_edge, max_edge))
+        image.seek(0)  # first frame of animated GIF/WebP
+        # The original bytes can only stand in for the result if these steps changed nothing
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        transparent = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = _flatten(ImageOps.exif_transpose(image))
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as e:
+        raise ValueError(f"Not a readable image: {e}")
+
+    phash = perceptual_hash(image)
+    grayscale = IMAGE_AUTO_GRAYSCALE and is_text_only(image)
+    if grayscale:
+        image = image.convert("L")
+    resized = max(image.size) > max_edge
+    if resized:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    output_format = output_format if output_format in OUTPUT_MIME_TYPES else "JPEG"
+    buffer = io.BytesIO()
+    if output_format == "WEBP":
+        image.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    data = buffer.getvalue()
+    mime_type = OUTPUT_MIME_TYPES[output_format]
+
+    # A small, already-compressed original can beat the re-encode; send it as-is with its own type,
+    # unless it would reach Gemini differently from what OCR and the image cache see (sideways,
+    # in colour, or with transparency)
+    original_mime = Image.MIME.get(source_format)
+    unchanged = not resized and not grayscale and not transparent and orientation == 1
+    if len(data) >= original_size and unchanged and original_mime in ("image/jpeg", "image/png", "image/webp"):
+        stream.seek(0)
+        data, mime_type = stream.read(), original_mime
+
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytes_in"] += original_size
+        _stats["bytes_out"] += len(data)
+    return PreparedImage(data, mime_type, original_size, image.width, image.height, grayscale,
+                         sha256=sha256, phash=phash)
+
+
+def prepare_upload(source):
+    """Runs preprocess_image on the worker pool and waits for it (sync callers)."""
+    return _executor.submit(preprocess_image, source).result()
+
+
+async def prepare_upload_async(source):
+    """Runs preprocess_image on the worker pool without blocking the event loop."""
+    return await asyncio.wrap_future(_executor.submit(preprocess_image, source))
+
+
+def describe(prepared):
+    """One log line with the size change of a prepared image."""
+    return (f"Image {prepared.original_size // 1024} KB -> {len(prepared.data) // 1024} KB "
+            f"({prepared.bytes_saved} bytes saved, {prepared.width}x{prepared.height}, "
+            f"{prepared.mime_type}{', grayscale' if prepared.grayscale else ''})")
+
+
+def pipeline_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    return stats
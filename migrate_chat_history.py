@@ -0,0 +1,68 @@
+"""
+Imports legacy chat_history/<user_id>_<chat_id>.json files into the chat store.
+
+Usage:
+    python migrate_chat_history.py [--dir chat_history] [--backend jsonl|sqlite] [--delete] [--dry-run]
+"""
+import argparse
+import glob
+import json
+import os
+
+from chat_store import CHAT_STORE_BACKEND, create_chat_store
+
+
+def parse_legacy_filename(filename):
+    """Splits '<user_id>_<chat_id>.json' into (user_id, chat_id). Chat ids are UUIDs, so the last '_' separates them."""
+    stem = os.path.basename(filename)[:-len(".json")]
+    if "_" not in stem:
+        return None, None
+    user_id, chat_id = stem.rsplit("_", 1)
+    return user_id, chat_id
+
+
+def migrate(chat_dir, backend, delete=False, dry_run=False):
+    store = None if dry_run else create_chat_store(chat_dir, backend)
+    migrated, skipped = 0, 0
+    for file_path in sorted(glob.glob(os.path.join(chat_dir, "*.json"))):
+        user_id, chat_id = parse_legacy_filename(file_path)
+        if not user_id or not chat_id:
+            print(f"Skipping {file_path}: unrecognised file name.")
+            skipped += 1
+            continue
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                messages = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Skipping {file_path}: {e}")
+            skipped += 1
+            continue
+        if not isinstance(messages, list):
+            print(f"Skipping {file_path}: expected a list of messages.")
+            skipped += 1
+            continue
+
+        print(f"{'Would import' if dry_run else 'Importing'} {len(messages)} messages for {user_id}/{chat_id}")
+        if not dry_run:
+            # Keep the original modification time so the sidebar order is preserved
+            store.save(user_id, chat_id, messages, updated_at=os.path.getmtime(file_path))
+            if delete:
+                os.remove(file_path)
+        migrated += 1
+
+    print(f"Done: {migrated} chats migrated, {skipped} skipped.")
+    return migrated, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import legacy per-chat JSON files into the chat store.")
+    parser.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_history"))
+    parser.add_argument("--backend", default=CHAT_STORE_BACKEND, choices=["jsonl", "sqlite"])
+    parser.add_argument("--delete", action="store_true", help="Remove each legacy file after importing it")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be imported")
+    args = parser.parse_args()
+    migrate(args.dir, args.backend, delete=args.delete, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Local OCR fast path for /upload_image.
+
+Many uploads are a single cleanly printed equation. Tesseract reads those in a fraction of a
+second, and the text can then take the normal /ask path (answer caches, cheaper text models)
+instead of Gemini Vision. Only results that are confident, short and look like a math problem
+are used; everything else still goes to the vision model. OCR runs in a process pool because
+Tesseract is CPU-bound and pytesseract holds the calling thread while it runs.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from telemetry import log
+
+# --- OCR CONFIG ---
+OCR_ENABLED = os.environ.get("OCR_ENABLED", "true").lower() == "true"
+# Mean Tesseract word confidence (0-100) needed to skip the vision model
+OCR_MIN_CONFIDENCE = float(os.environ.get("OCR_MIN_CONFIDENCE", "80"))
+# Longer text is a page or a word problem with a figure, which vision handles better
+OCR_MAX_CHARS = int(os.environ.get("OCR_MAX_CHARS", "300"))
+OCR_MIN_CHARS = 3
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "2"))
+OCR_TIMEOUT = float(os.environ.get("OCR_TIMEOUT", "5"))
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+# Treat the image as one uniform block of text
+OCR_CONFIG = "--psm 6"
+
+_MATH_PATTERN = re.compile(r"\d.*[=+\-×÷*/^<>]|[=+\-×÷*/^<>].*\d")
+
+_executor = None
+_executor_lock = threading.Lock()
+_stats = {"images": 0, "accepted": 0, "low_confidence": 0, "not_math": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+class OcrResult:
+    """Text read from an image with its mean word confidence."""
+
+    def __init__(self, text, confidence):
+        self.text = text
+        self.confidence = confidence
+
+
+def run_ocr(image_bytes, lang=OCR_LANG):
+    """Runs Tesseract on an encoded image (in a worker process). Returns (text, mean confidence)."""
+    import pytesseract
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes)).convert("L")
+    data = pytesseract.image_to_data(image, lang=lang, config=OCR_CONFIG, output_type=pytesseract.Output.DICT)
+    lines = {}
+    weighted, total_chars = 0.0, 0
+    for i, word in enumerate(data["text"]):
+        word = word.strip()
+        confidence = float(data["conf"][i])
+        if not word or confidence < 0:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        weighted += confidence * len(word)
+        total_chars += len(word)
+    text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+    return text, (weighted / total_chars if total_chars else 0.0)
+
+
+def classify(text, confidence):
+    """Returns 'accepted', 'low_confidence' or 'not_math' for an OCR result."""
+    if confidence < OCR_MIN_CONFIDENCE:
+        return "low_confidence"
+    if not OCR_MIN_CHARS <= len(text) <= OCR_MAX_CHARS or not _MATH_PATTERN.search(text):
+        return "not_math"
+    return "accepted"
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn: forking a threaded web worker can copy held locks into the child
+                _executor = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats[outcome] += 1
+
+
+def _accept(text, confidence):
+    outcome = classify(text, confidence)
+    _record(outcome)
+    log.info("OCR %s (confidence %.0f, %d chars)", outcome, confidence, len(text))
+    return OcrResult(text, confidence) if outcome == "accepted" else None
+
+
+def read_printed_problem(image_bytes):
+    """Returns an OcrResult if the image is a confidently read math problem, else None."""
+    if not OCR_ENABLED:
+        return None
+    try:
+        text, confidence = _get_executor().submit(run_ocr, image_bytes).result(timeout=OCR_TIMEOUT)
+    except FutureTimeout:
+        log.warning("OCR timed out, using the vision model")
+        _record("errors")
+        return None
+    except Exception as e:
+        log.warning("OCR failed (%s), using the vision model", e)
+        _record("errors")
+        return None
+    return _accept(text, confidence)
+
+
+async def read_printed_problem_async(image_bytes):
+    """Async counterpart of read_printed_problem."""
+    if not OCR_ENABLED:
+        return None
+    try:
+        future = asyncio.wrap_future(_get_executor().submit(run_ocr, image_bytes))
+        text, confidence = await asyncio.wait_for(future, OCR_TIMEOUT)
+    except asyncio.TimeoutError:
+        log.warning("OCR timed out, using the vision model")
+        _record("errors")
+        return None
+    except Exception as e:
+        log.warning("OCR failed (%s), using the vision model", e)
+        _record("errors")
+        return None
+    return _accept(text, confidence)
+
+
+def ocr_stats():
+    with _stats_lock:
+        return {"enabled": OCR_ENABLED, "min_confidence": OCR_MIN_CONFIDENCE, **_stats}
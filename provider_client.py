@@ -0,0 +1,134 @@
+"""
+Shared HTTP client layer for the upstream model providers (Gemini, Groq, OpenRouter).
+
+Each provider gets its own requests.Session with a keep-alive connection pool, so repeated
+calls reuse TCP/TLS connections instead of paying a new DNS lookup and handshake every time.
+Status 5xx responses are retried with exponential backoff (honouring a short Retry-After).
+A 429 is not retried here: it goes straight back to the caller, so the rate limiter sees it
+and pauses the provider, and the router fails over instead of a request thread sleeping
+through a free tier's minute-long Retry-After.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import rate_limiter
+
+# --- POOL CONFIG ---
+PROVIDER_POOL_SIZE = int(os.environ.get("PROVIDER_POOL_SIZE", "20"))
+PROVIDER_CONNECT_TIMEOUT = float(os.environ.get("PROVIDER_CONNECT_TIMEOUT", "5"))
+PROVIDER_READ_TIMEOUT = float(os.environ.get("PROVIDER_READ_TIMEOUT", "60"))
+PROVIDER_MAX_RETRIES = int(os.environ.get("PROVIDER_MAX_RETRIES", "2"))
+PROVIDER_RETRY_BACKOFF = float(os.environ.get("PROVIDER_RETRY_BACKOFF", "0.5"))
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+# Longest Retry-After (seconds) a retry waits for; longer ones are cut to this
+PROVIDER_RETRY_AFTER_MAX = float(os.environ.get("PROVIDER_RETRY_AFTER_MAX", "5"))
+
+# Upper bound on open connections per provider for the async clients (asgi.py)
+PROVIDER_ASYNC_MAX_CONNECTIONS = int(os.environ.get("PROVIDER_ASYNC_MAX_CONNECTIONS", "500"))
+
+PROVIDER_TIMEOUT = (PROVIDER_CONNECT_TIMEOUT, PROVIDER_READ_TIMEOUT)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+# Connection counters reported by the async clients, which have no pool counters of their own
+_async_counts = {}
+_async_counts_lock = threading.Lock()
+
+
+class _ProviderRetry(Retry):
+    """urllib3 Retry that never retries a 429 and waits at most PROVIDER_RETRY_AFTER_MAX for a Retry-After."""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        # urllib3 retries any 429 carrying Retry-After, whatever status_forcelist says
+        return status_code != 429 and super().is_retry(method, status_code, has_retry_after)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, PROVIDER_RETRY_AFTER_MAX)
+
+
+def _build_session():
+    retry = _ProviderRetry(
+        total=PROVIDER_MAX_RETRIES,
+        connect=PROVIDER_MAX_RETRIES,
+        read=0,  # a read failure may happen mid-stream, after part of the answer was sent
+        status=PROVIDER_MAX_RETRIES,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET", "POST"]),
+        backoff_factor=PROVIDER_RETRY_BACKOFF,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=PROVIDER_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(provider):
+    """Returns the pooled session for a provider ('gemini', 'groq', 'openrouter'), creating it on first use."""
+    session = _sessions.get(provider)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(provider)
+            if session is None:
+                session = _sessions[provider] = _build_session()
+    return session
+
+
+def post(provider, url, rate_limit_payload=None, **kwargs):
+    """
+    POSTs through the provider's pooled session with the configured connect/read timeouts.
+    Waits for the provider's rate limiter first (raising RateLimitExceeded if it has no capacity);
+    `rate_limit_payload` stands in for the `json` body in its token estimate when sending raw `data`.
+    """
+    kwargs.setdefault("timeout", PROVIDER_TIMEOUT)
+    rate_limiter.acquire(provider, rate_limit_payload or kwargs.get("json"))
+    response = get_session(provider).post(url, **kwargs)
+    rate_limiter.observe(provider, response.status_code, response.headers)
+    return response
+
+
+def retry_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number `attempt` (0-based), preferring the server's (capped) Retry-After."""
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), PROVIDER_RETRY_AFTER_MAX)
+        except ValueError:
+            pass
+    return PROVIDER_RETRY_BACKOFF * (2 ** attempt)
+
+
+def record_async_event(provider, event):
+    """Counts a 'requests' or 'new_connections' event reported by an async client."""
+    with _async_counts_lock:
+        counts = _async_counts.setdefault(provider, {"requests": 0, "new_connections": 0})
+        counts[event] += 1
+
+
+def _with_reuse(counts):
+    return {**counts, "reused_connections": max(counts["requests"] - counts["new_connections"], 0)}
+
+
+def pool_stats():
+    """Returns per-provider counts of requests sent, connections opened and connections reused."""
+    stats = {}
+    for provider, session in list(_sessions.items()):
+        requests_sent, new_connections = 0, 0
+        for adapter in set(session.adapters.values()):
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                new_connections += pool.num_connections
+        stats[provider] = _with_reuse({"requests": requests_sent, "new_connections": new_connections})
+    with _async_counts_lock:
+        if _async_counts:
+            stats["async"] = {provider: _with_reuse(dict(counts)) for provider, counts in _async_counts.items()}
+    return stats
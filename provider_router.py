@@ -0,0 +1,401 @@
+"""
+Routing policies for streaming an answer from a list of provider candidates.
+
+A candidate is a (provider_name, factory) pair. factory(on_open, cancel) returns an iterator
+of text chunks and calls on_open(response) with the upstream response once it is opened, so a
+losing request can be closed from another thread and the connect time can be measured. `cancel`
+is set (is_set()) once this attempt is stopped, because it lost or the request was cancelled: the
+factory must then end without any further upstream call, such as a fallback request. For the
+async router, factory(on_open) returns an async iterator; async losers are cancelled as tasks.
+
+Policies (ROUTING_POLICY):
+    sequential  try candidates one after another; the next one starts only when the previous
+                one ended without producing any text (the original behaviour)
+    hedged      start the primary; if it has not produced a first token within HEDGE_DELAY_MS
+                (or fails sooner), also start the next candidate
+    race        start every candidate at once
+
+With hedged/race, the first candidate to produce a token wins and all others are cancelled.
+Candidates whose rate limiter has no spare capacity right now are moved to the end of the list.
+A cancelled generation (see cancellation.py) closes every response it opened and stops the
+sync router without trying further candidates; the async router is stopped by cancelling the
+task iterating it.
+
+An optional telemetry.RequestTrace receives each attempt's upstream_connect and first_token
+times and the winner's stream duration, and learns the winning provider.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import rate_limiter
+import telemetry
+from telemetry import log
+
+ROUTING_POLICY = os.environ.get("ROUTING_POLICY", "sequential").lower()
+HEDGE_DELAY_MS = int(os.environ.get("HEDGE_DELAY_MS", "1500"))
+ROUTING_POLICIES = ("sequential", "hedged", "race")
+
+# Number of recent samples kept per provider for latency percentiles
+STATS_WINDOW = 500
+
+
+# --- PER-PROVIDER STATS ---
+class ProviderStats:
+    """Latency and outcome counters for one provider."""
+
+    def __init__(self):
+        self.calls = 0
+        self.wins = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.ttft = deque(maxlen=STATS_WINDOW)
+        self.duration = deque(maxlen=STATS_WINDOW)
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(provider, outcome, ttft=None, duration=None):
+    with _stats_lock:
+        stats = _stats.setdefault(provider, ProviderStats())
+        stats.calls += 1
+        if outcome == "win":
+            stats.wins += 1
+        elif outcome == "error":
+            stats.errors += 1
+        elif outcome == "cancelled":
+            stats.cancelled += 1
+        if ttft is not None:
+            stats.ttft.append(ttft)
+        if duration is not None:
+            stats.duration.append(duration)
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def router_stats():
+    """Returns per-provider call outcomes and time-to-first-token / duration percentiles (ms)."""
+    with _stats_lock:
+        snapshot = {name: (s.calls, s.wins, s.errors, s.cancelled, list(s.ttft), list(s.duration))
+                    for name, s in _stats.items()}
+    result = {"policy": ROUTING_POLICY, "hedge_delay_ms": HEDGE_DELAY_MS, "providers": {}}
+    for name, (calls, wins, errors, cancelled, ttft, duration) in snapshot.items():
+        result["providers"][name] = {
+            "calls": calls,
+            "wins": wins,
+            "errors": errors,
+            "cancelled": cancelled,
+            "error_rate": round(errors / calls, 3) if calls else 0.0,
+            "ttft_p50_ms": _ms(_percentile(ttft, 50)),
+            "ttft_p95_ms": _ms(_percentile(ttft, 95)),
+            "duration_p50_ms": _ms(_percentile(duration, 50)),
+        }
+    return result
+
+
+def _on_open_hook(name, started, cancel=None, trace=None):
+    """on_open for one attempt: records the upstream connect time and lets `cancel` close the response."""
+    if trace is None:
+        return cancel.watch if cancel else None
+
+    def on_open(response):
+        trace.observe("upstream_connect", time.monotonic() - started, name)
+        if cancel is not None:
+            cancel.watch(response)
+    return on_open
+
+
+def _trace_win(trace, name, first_token, duration):
+    if trace is not None:
+        trace.provider = name
+        trace.observe("stream", duration - first_token, name)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000)
+
+
+def _resolve(policy, hedge_delay_ms):
+    policy = (policy or ROUTING_POLICY).lower()
+    if policy not in ROUTING_POLICIES:
+        log.warning("Unknown ROUTING_POLICY '%s', using sequential.", policy)
+        policy = "sequential"
+    delay = (HEDGE_DELAY_MS if hedge_delay_ms is None else hedge_delay_ms) / 1000
+    return policy, delay
+
+
+def prefer_available(candidates):
+    """Reorders candidates so providers with rate limit capacity come first (otherwise keeping the order)."""
+    available = [c for c in candidates if rate_limiter.has_capacity(c[0])]
+    if len(available) in (0, len(candidates)):
+        return list(candidates)
+    limited = [c for c in candidates if c not in available]
+    log.info("Rate limited: %s; trying %s first", ", ".join(c[0] for c in limited), available[0][0])
+    return available + limited
+
+
+# --- SYNC ROUTER (Flask) ---
+class _Attempt:
+    """One provider request pumped on its own thread into the router's queue."""
+
+    def __init__(self, name, factory, events, watch=None):
+        self.name = name
+        self.factory = factory
+        self.events = events
+        self.watch = watch
+        self.started = time.monotonic()
+        self.first_token = None
+        self.finished = False
+        self.response = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._pump, daemon=True).start()
+        return self
+
+    def _on_open(self, response):
+        with self._lock:
+            self.response = response
+        if self.watch:
+            self.watch(response)
+        if self._cancelled.is_set():
+            response.close()
+
+    def _pump(self):
+        try:
+            for chunk in self.factory(self._on_open, self._cancelled):
+                if self._cancelled.is_set():
+                    break
+                self.events.put((self, chunk))
+        except Exception as e:
+            if not self._cancelled.is_set():
+                log.error("%s streaming error: %s", self.name, e)
+        finally:
+            self.events.put((self, None))
+
+    def cancel(self):
+        """Stops the attempt and closes its upstream connection right away."""
+        self._cancelled.set()
+        with self._lock:
+            response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+
+def _stream_sequential(candidates, cancel=None, trace=None):
+    for name, factory in candidates:
+        started = time.monotonic()
+        first_token = None
+        try:
+            for chunk in factory(_on_open_hook(name, started, cancel, trace), cancel):
+                if cancel is not None and cancel.is_set():
+                    break
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                    telemetry.observe(trace, "first_token", first_token, name)
+                yield chunk
+        except Exception as e:
+            if cancel is None or not cancel.is_set():
+                log.error("%s streaming error: %s", name, e)
+        if cancel is not None and cancel.is_set():
+            _record(name, "cancelled", duration=time.monotonic() - started)
+            return
+        if first_token is not None:
+            _record(name, "win", first_token, time.monotonic() - started)
+            _trace_win(trace, name, first_token, time.monotonic() - started)
+            return
+        _record(name, "error", duration=time.monotonic() - started)
+        log.warning("%s produced no answer, trying next provider...", name)
+
+
+def route_stream(candidates, policy=None, hedge_delay_ms=None, cancel=None, trace=None):
+    """
+    Yields the answer from the winning candidate according to the routing policy.
+    `cancel` is an optional cancellation.Generation that stops the stream early;
+    `trace` an optional telemetry.RequestTrace.
+    """
+    policy, hedge_delay = _resolve(policy, hedge_delay_ms)
+    candidates = prefer_available(candidates)
+    if policy == "sequential" or len(candidates) < 2:
+        yield from _stream_sequential(candidates, cancel, trace)
+        return
+
+    events = queue.Queue()
+    pending = list(candidates)
+    running = []
+    winner = None
+
+    def launch():
+        name, factory = pending.pop(0)
+        on_open = _on_open_hook(name, time.monotonic(), cancel, trace)
+        running.append(_Attempt(name, factory, events, on_open).start())
+
+    launch()
+    if policy == "race":
+        while pending:
+            launch()
+    hedge_at = time.monotonic() + hedge_delay
+
+    try:
+        while running:
+            timeout = None
+            if winner is None and policy == "hedged" and pending:
+                timeout = max(hedge_at - time.monotonic(), 0)
+            try:
+                attempt, chunk = events.get(timeout=timeout)
+            except queue.Empty:
+                log.info("No first token within %.0f ms, hedging with %s...", hedge_delay * 1000, pending[0][0])
+                launch()
+                hedge_at = time.monotonic() + hedge_delay
+                continue
+
+            if cancel is not None and cancel.is_set():
+                return  # the finally below closes whatever is still running
+            if attempt not in running:
+                continue  # late event from a cancelled attempt
+            if chunk is None:
+                attempt.finished = True
+                running.remove(attempt)
+                if attempt is winner:
+                    _record(attempt.name, "win", attempt.first_token, time.monotonic() - attempt.started)
+                    _trace_win(trace, attempt.name, attempt.first_token, time.monotonic() - attempt.started)
+                    return
+                if winner is None:
+                    _record(attempt.name, "error", duration=time.monotonic() - attempt.started)
+                    if not running and pending:
+                        # Failed before the hedge fired: don't wait for it
+                        launch()
+                        hedge_at = time.monotonic() + hedge_delay
+                continue
+
+            if winner is None:
+                winner = attempt
+                attempt.first_token = time.monotonic() - attempt.started
+                telemetry.observe(trace, "first_token", attempt.first_token, attempt.name)
+                for other in running:
+                    if other is not winner:
+                        other.cancel()
+                        _record(other.name, "cancelled", duration=time.monotonic() - other.started)
+                running[:] = [winner]
+            if attempt is winner:
+                yield chunk
+    finally:
+        # Client went away or the winner is done: make sure nothing keeps streaming upstream
+        for attempt in running:
+            if not attempt.finished:
+                attempt.cancel()
+
+
+# --- ASYNC ROUTER (asgi.py) ---
+async def _astream_sequential(candidates, trace=None):
+    for name, factory in candidates:
+        started = time.monotonic()
+        first_token = None
+        try:
+            async for chunk in factory(_on_open_hook(name, started, trace=trace)):
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                    telemetry.observe(trace, "first_token", first_token, name)
+                yield chunk
+        except Exception as e:
+            log.error("%s streaming error: %s", name, e)
+        if first_token is not None:
+            _record(name, "win", first_token, time.monotonic() - started)
+            _trace_win(trace, name, first_token, time.monotonic() - started)
+            return
+        _record(name, "error", duration=time.monotonic() - started)
+        log.warning("%s produced no answer, trying next provider...", name)
+
+
+async def aroute_stream(candidates, policy=None, hedge_delay_ms=None, trace=None):
+    """Async counterpart of route_stream; losing attempts are cancelled as asyncio tasks."""
+    policy, hedge_delay = _resolve(policy, hedge_delay_ms)
+    candidates = prefer_available(candidates)
+    if policy == "sequential" or len(candidates) < 2:
+        async for chunk in _astream_sequential(candidates, trace):
+            yield chunk
+        return
+
+    events = asyncio.Queue()
+    pending = list(candidates)
+    running = {}
+    winner = None
+
+    async def pump(name, factory, on_open):
+        try:
+            async for chunk in factory(on_open):
+                await events.put((name, chunk))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("%s streaming error: %s", name, e)
+        await events.put((name, None))
+
+    def launch():
+        name, factory = pending.pop(0)
+        started = time.monotonic()
+        task = asyncio.create_task(pump(name, factory, _on_open_hook(name, started, trace=trace)))
+        running[name] = {"task": task, "started": started, "first_token": None}
+
+    launch()
+    if policy == "race":
+        while pending:
+            launch()
+    hedge_at = time.monotonic() + hedge_delay
+
+    try:
+        while running:
+            timeout = None
+            if winner is None and policy == "hedged" and pending:
+                timeout = max(hedge_at - time.monotonic(), 0)
+            try:
+                name, chunk = await asyncio.wait_for(events.get(), timeout)
+            except asyncio.TimeoutError:
+                log.info("No first token within %.0f ms, hedging with %s...", hedge_delay * 1000, pending[0][0])
+                launch()
+                hedge_at = time.monotonic() + hedge_delay
+                continue
+
+            attempt = running.get(name)
+            if attempt is None:
+                continue  # late event from a cancelled attempt
+            if chunk is None:
+                del running[name]
+                if name == winner:
+                    _record(name, "win", attempt["first_token"], time.monotonic() - attempt["started"])
+                    _trace_win(trace, name, attempt["first_token"], time.monotonic() - attempt["started"])
+                    return
+                if winner is None:
+                    _record(name, "error", duration=time.monotonic() - attempt["started"])
+                    if not running and pending:
+                        launch()
+                        hedge_at = time.monotonic() + hedge_delay
+                continue
+
+            if winner is None:
+                winner = name
+                attempt["first_token"] = time.monotonic() - attempt["started"]
+                telemetry.observe(trace, "first_token", attempt["first_token"], name)
+                for other_name in [n for n in running if n != name]:
+                    other = running.pop(other_name)
+                    other["task"].cancel()
+                    _record(other_name, "cancelled", duration=time.monotonic() - other["started"])
+            if name == winner:
+                yield chunk
+    finally:
+        for attempt in running.values():
+            attempt["task"].cancel()
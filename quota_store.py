@@ -0,0 +1,178 @@
+"""
+Daily message quota shared by every worker.
+
+try_consume() is an atomic check-and-increment: it counts the message only if the user is still
+under the limit, so concurrent requests (in any worker, or on any node with Redis) can't go over
+it. Counts are bucketed by day and old buckets expire on their own.
+
+Backends (QUOTA_BACKEND):
+    sqlite  one WAL database shared by all workers on a node (default)
+    redis   any Redis-compatible server, for several nodes (QUOTA_REDIS_URL)
+    memory  per-process dict, for development only
+"""
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+# --- QUOTA CONFIG ---
+QUOTA_BACKEND = os.environ.get("QUOTA_BACKEND", "sqlite").lower()
+QUOTA_DB_PATH = os.environ.get("QUOTA_DB_PATH", "")
+QUOTA_REDIS_URL = os.environ.get("QUOTA_REDIS_URL", "redis://localhost:6379/0")
+# Day buckets older than this are deleted (SQLite/memory) or expire (Redis)
+QUOTA_RETENTION_DAYS = 7
+
+
+def today():
+    return date.today().isoformat()
+
+
+class SqliteQuotaStore:
+    """Counts in a `quota (user_id, day, count)` table; one UPSERT per message."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._pruned_day = None
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quota ("
+                " user_id TEXT NOT NULL, day TEXT NOT NULL, count INTEGER NOT NULL,"
+                " PRIMARY KEY (user_id, day))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS quota_day ON quota (day)")
+
+    def _conn(self):
+        """One connection per thread; sqlite3 connections must not be shared across threads."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _prune(self, day):
+        """Deletes old day buckets, at most once per day per process."""
+        if self._pruned_day == day:
+            return
+        self._pruned_day = day
+        cutoff = (date.fromisoformat(day) - timedelta(days=QUOTA_RETENTION_DAYS)).isoformat()
+        self._conn().execute("DELETE FROM quota WHERE day < ?", (cutoff,))
+
+    def get(self, user_id, day=None):
+        row = self._conn().execute(
+            "SELECT count FROM quota WHERE user_id = ? AND day = ?", (user_id, day or today())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def try_consume(self, user_id, limit, day=None):
+        """Counts one message if the user is under `limit`. Returns (allowed, count)."""
+        day = day or today()
+        self._prune(day)
+        # The UPSERT only increments while under the limit, in a single atomic statement
+        row = self._conn().execute(
+            "INSERT INTO quota (user_id, day, count) VALUES (?, ?, 1)"
+            " ON CONFLICT (user_id, day) DO UPDATE SET count = count + 1 WHERE count < ?"
+            " RETURNING count",
+            (user_id, day, limit),
+        ).fetchone()
+        if row is None:
+            return False, self.get(user_id, day)
+        return True, row[0]
+
+    def refund(self, user_id, day=None):
+        """Gives back a message counted by try_consume (e.g. the request failed)."""
+        self._conn().execute(
+            "UPDATE quota SET count = count - 1 WHERE user_id = ? AND day = ? AND count > 0",
+            (user_id, day or today()),
+        )
+
+
+class RedisQuotaStore:
+    """Counts in `quota:<day>:<user_id>` keys that expire after QUOTA_RETENTION_DAYS."""
+
+    # INCR only while under the limit; the key gets its TTL when it is created
+    CONSUME_SCRIPT = """
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if count >= tonumber(ARGV[1]) then
+    return {0, count}
+end
+count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return {1, count}
+"""
+
+    def __init__(self, url):
+        import redis  # only needed for this backend
+        self.client = redis.Redis.from_url(url)
+        self._consume = self.client.register_script(self.CONSUME_SCRIPT)
+        self.ttl = QUOTA_RETENTION_DAYS * 24 * 3600
+
+    @staticmethod
+    def _key(user_id, day):
+        return f"quota:{day}:{user_id}"
+
+    def get(self, user_id, day=None):
+        value = self.client.get(self._key(user_id, day or today()))
+        return int(value) if value else 0
+
+    def try_consume(self, user_id, limit, day=None):
+        """Counts one message if the user is under `limit`. Returns (allowed, count)."""
+        allowed, count = self._consume(keys=[self._key(user_id, day or today())], args=[limit, self.ttl])
+        return bool(allowed), int(count)
+
+    def refund(self, user_id, day=None):
+        """Gives back a message counted by try_consume (e.g. the request failed)."""
+        key = self._key(user_id, day or today())
+        if self.client.decr(key) < 0:
+            self.client.set(key, 0, keepttl=True)
+
+
+class MemoryQuotaStore:
+    """Per-process counts; each worker enforces its own limit. Development only."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._pruned_day = None
+
+    def get(self, user_id, day=None):
+        with self._lock:
+            return self._counts.get((user_id, day or today()), 0)
+
+    def try_consume(self, user_id, limit, day=None):
+        """Counts one message if the user is under `limit`. Returns (allowed, count)."""
+        day = day or today()
+        with self._lock:
+            if self._pruned_day != day:
+                self._pruned_day = day
+                cutoff = (date.fromisoformat(day) - timedelta(days=QUOTA_RETENTION_DAYS)).isoformat()
+                self._counts = {key: n for key, n in self._counts.items() if key[1] >= cutoff}
+            count = self._counts.get((user_id, day), 0)
+            if count >= limit:
+                return False, count
+            self._counts[(user_id, day)] = count + 1
+            return True, count + 1
+
+    def refund(self, user_id, day=None):
+        """Gives back a message counted by try_consume (e.g. the request failed)."""
+        key = (user_id, day or today())
+        with self._lock:
+            if self._counts.get(key, 0) > 0:
+                self._counts[key] -= 1
+
+
+def create_quota_store(default_dir, backend=None):
+    """Builds the quota store selected by QUOTA_BACKEND."""
+    backend = (backend or QUOTA_BACKEND).lower()
+    if backend == "sqlite":
+        return SqliteQuotaStore(QUOTA_DB_PATH or os.path.join(default_dir, "quota.db"))
+    if backend == "redis":
+        return RedisQuotaStore(QUOTA_REDIS_URL)
+    if backend == "memory":
+        return MemoryQuotaStore()
+    raise ValueError(f"Unknown QUOTA_BACKEND: {backend}")
@@ -0,0 +1,284 @@
+"""
+Per-provider upstream rate limiter.
+
+Each provider has two token buckets, one for requests per minute and one for (estimated) tokens
+per minute. Requests that can't be sent right away wait in a short bounded queue, up to
+RATE_LIMIT_MAX_WAIT seconds; if they still can't go, RateLimitExceeded is raised without
+contacting the provider, and the router moves on to the next candidate. The router also puts
+providers with spare capacity first.
+
+The buckets start from the configured free-tier limits and are corrected from the providers'
+rate limit headers (x-ratelimit-remaining-*, x-ratelimit-reset-*, Retry-After) after every
+response, so a 429 blocks the provider until its reset time. Buckets are per process; the
+header corrections keep several workers from drifting far from the real remaining quota.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+
+from context_window import estimate_tokens
+from telemetry import log
+
+# --- RATE LIMIT CONFIG ---
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# How long a request may wait for capacity before the router skips the provider
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", "2"))
+# Requests allowed to wait per provider at once; more are rejected immediately
+RATE_LIMIT_QUEUE_SIZE = int(os.environ.get("RATE_LIMIT_QUEUE_SIZE", "16"))
+# Block after a 429 without Retry-After / reset headers
+RATE_LIMIT_DEFAULT_COOLDOWN = 20.0
+
+# Free-tier defaults; 0 disables that bucket. Override with e.g. GROQ_RPM / GROQ_TPM.
+DEFAULT_LIMITS = {
+    "gemini": {"rpm": 10, "tpm": 250000},
+    "groq": {"rpm": 30, "tpm": 5000},
+    "openrouter": {"rpm": 20, "tpm": 0},
+}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a provider has no capacity within RATE_LIMIT_MAX_WAIT."""
+
+
+def _limit(provider, kind):
+    default = DEFAULT_LIMITS.get(provider, {}).get(kind, 0)
+    return int(os.environ.get(f"{provider.upper()}_{kind.upper()}", str(default)))
+
+
+def parse_reset(value, now=None):
+    """
+    Seconds until a rate limit resets. Accepts durations ("7.66s", "2m59.56s", "120ms"),
+    plain seconds, and epoch timestamps in seconds or milliseconds (OpenRouter).
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if not parts:
+            return None
+        scale = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+        return sum(float(n) * scale[unit] for n, unit in parts)
+    now = time.time() if now is None else now
+    if number > 1e12:
+        return max(number / 1000 - now, 0.0)
+    if number > 1e9:
+        return max(number - now, 0.0)
+    return max(number, 0.0)
+
+
+def estimate_request_tokens(payload):
+    """Rough prompt size of a request body, for the tokens-per-minute bucket."""
+    if not payload:
+        return 0
+    return estimate_tokens(json.dumps(payload.get("messages") or payload.get("contents") or payload, ensure_ascii=False))
+
+
+class ProviderLimiter:
+    """Request and token buckets for one provider, refilled continuously."""
+
+    def __init__(self, name, rpm, tpm):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.blocked_until = 0.0
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self.sent = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.throttled = 0
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def _wait_time(self, tokens, now):
+        """Seconds until the request could be sent (0 means now). Call with the lock held."""
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.rpm and self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60 / self.rpm)
+        if self.tpm:
+            # A request larger than the whole bucket can still go once the bucket is full
+            needed = min(tokens, self.tpm)
+            if self.tokens < needed:
+                wait = max(wait, (needed - self.tokens) * 60 / self.tpm)
+        return wait
+
+    def _take(self, tokens):
+        if self.rpm:
+            self.requests -= 1
+        if self.tpm:
+            self.tokens -= min(tokens, self.tpm)
+        self.sent += 1
+
+    def _reserve(self, tokens, deadline, queued):
+        """
+        Takes capacity if available. Returns (True, 0), (False, wait) to wait and retry, or
+        raises RateLimitExceeded. Call with the lock held.
+        """
+        now = time.monotonic()
+        wait = self._wait_time(tokens, now)
+        if wait <= 0:
+            self._take(tokens)
+            return True, 0
+        if now + wait > deadline:
+            self.rejected += 1
+            raise RateLimitExceeded(f"{self.name} has no capacity for {wait:.1f}s")
+        if not queued and self.waiting >= RATE_LIMIT_QUEUE_SIZE:
+            self.rejected += 1
+            raise RateLimitExceeded(f"{self.name} rate limit queue is full")
+        return False, wait
+
+    def has_capacity(self, tokens=1):
+        with self._cond:
+            return self._wait_time(tokens, time.monotonic()) <= 0
+
+    def acquire(self, tokens, max_wait=RATE_LIMIT_MAX_WAIT):
+        """Blocks until the request may be sent, or raises RateLimitExceeded."""
+        deadline = time.monotonic() + max_wait
+        queued = False
+        with self._cond:
+            try:
+                while True:
+                    ok, wait = self._reserve(tokens, deadline, queued)
+                    if ok:
+                        return
+                    if not queued:
+                        queued = True
+                        self.waiting += 1
+                        self.delayed += 1
+                    self._cond.wait(wait)
+            finally:
+                if queued:
+                    self.waiting -= 1
+
+    async def acquire_async(self, tokens, max_wait=RATE_LIMIT_MAX_WAIT):
+        """Async counterpart of acquire(); waits with asyncio.sleep instead of blocking."""
+        deadline = time.monotonic() + max_wait
+        queued = False
+        try:
+            while True:
+                with self._cond:
+                    ok, wait = self._reserve(tokens, deadline, queued)
+                    if not ok and not queued:
+                        queued = True
+                        self.waiting += 1
+                        self.delayed += 1
+                if ok:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            if queued:
+                with self._cond:
+                    self.waiting -= 1
+
+    def observe(self, status_code, headers):
+        """Corrects the buckets from a response's status and rate limit headers."""
+        now = time.monotonic()
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        with self._cond:
+            self._refill(now)
+            limit_tokens = _int(headers.get("x-ratelimit-limit-tokens"))
+            if limit_tokens:
+                self.tpm = limit_tokens
+            remaining_tokens = _int(headers.get("x-ratelimit-remaining-tokens"))
+            if remaining_tokens is not None and self.tpm:
+                self.tokens = min(self.tokens, remaining_tokens)
+            remaining_requests = _int(headers.get("x-ratelimit-remaining-requests", headers.get("x-ratelimit-remaining")))
+            if remaining_requests is not None and self.rpm:
+                self.requests = min(self.requests, remaining_requests)
+            if remaining_requests == 0 or remaining_tokens == 0:
+                reset_header = "x-ratelimit-reset-requests" if remaining_requests == 0 else "x-ratelimit-reset-tokens"
+                reset = parse_reset(headers.get(reset_header, headers.get("x-ratelimit-reset")))
+                if reset:
+                    self.blocked_until = max(self.blocked_until, now + reset)
+            if status_code == 429:
+                self.throttled += 1
+                reset = parse_reset(headers.get("retry-after"))
+                if reset is None:
+                    reset = parse_reset(headers.get("x-ratelimit-reset-requests", headers.get("x-ratelimit-reset")))
+                self.blocked_until = max(self.blocked_until, now + (reset or RATE_LIMIT_DEFAULT_COOLDOWN))
+                log.warning("%s rate limited, pausing it for %.1fs", self.name, self.blocked_until - now)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "requests_available": round(self.requests, 2) if self.rpm else None,
+                "tokens_available": round(self.tokens) if self.tpm else None,
+                "blocked_for_s": round(max(self.blocked_until - now, 0.0), 1),
+                "waiting": self.waiting,
+                "sent": self.sent,
+                "delayed": self.delayed,
+                "rejected": self.rejected,
+                "throttled_429": self.throttled,
+            }
+
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider):
+    """Returns the provider's limiter, creating it from the configured limits on first use."""
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                limiter = _limiters[provider] = ProviderLimiter(provider, _limit(provider, "rpm"), _limit(provider, "tpm"))
+    return limiter
+
+
+def acquire(provider, payload=None):
+    """Waits for capacity to send `payload` to the provider, or raises RateLimitExceeded."""
+    if RATE_LIMIT_ENABLED:
+        get_limiter(provider).acquire(estimate_request_tokens(payload))
+
+
+async def acquire_async(provider, payload=None):
+    if RATE_LIMIT_ENABLED:
+        await get_limiter(provider).acquire_async(estimate_request_tokens(payload))
+
+
+def observe(provider, status_code, headers):
+    if RATE_LIMIT_ENABLED:
+        get_limiter(provider).observe(status_code, headers)
+
+
+def has_capacity(provider):
+    """True if a request to the provider could be sent right now."""
+    return not RATE_LIMIT_ENABLED or get_limiter(provider).has_capacity()
+
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {"enabled": RATE_LIMIT_ENABLED, "providers": {name: l.stats() for name, l in limiters.items()}}
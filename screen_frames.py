@@ -0,0 +1,143 @@
+"""
+Frame differencing for /process_screen_frame.
+
+While a student shares their screen, the page posts a screenshot every couple of seconds. Most
+of those frames show the same screen, and the rest usually arrive in bursts (typing, scrolling)
+where only the last frame matters. Each frame is reduced to a small grayscale thumbnail and
+compared with the previous frame and with the last frame that was analyzed:
+
+- unchanged since the last analysis: skipped, and the client is told to sample less often
+  (the interval doubles up to SCREEN_FRAME_MAX_INTERVAL);
+- still changing since the previous frame: skipped until the screen settles, so a burst
+  costs one vision call (a screen that never settles is analyzed after SCREEN_FRAME_MAX_SETTLE);
+- changed and settled: analyzed, at most once per SCREEN_FRAME_COOLDOWN and never while an
+  analysis for the same session is still running.
+
+State is per worker process and per (user, chat), and expires after SCREEN_SESSION_TTL.
+"""
+import os
+import threading
+import time
+
+from PIL import Image, ImageChops
+
+# --- SCREEN FRAME CONFIG ---
+# Sampling interval the client starts with and returns to when the screen changes (ms)
+SCREEN_FRAME_MIN_INTERVAL = int(os.environ.get("SCREEN_FRAME_MIN_INTERVAL", "2000"))
+SCREEN_FRAME_MAX_INTERVAL = int(os.environ.get("SCREEN_FRAME_MAX_INTERVAL", "16000"))
+# Share of thumbnail pixels that must differ for a frame to count as changed
+SCREEN_FRAME_CHANGE_RATIO = float(os.environ.get("SCREEN_FRAME_CHANGE_RATIO", "0.004"))
+# Seconds between two analyses of the same session
+SCREEN_FRAME_COOLDOWN = float(os.environ.get("SCREEN_FRAME_COOLDOWN", "10"))
+# Seconds a changing screen may keep changing before it is analyzed anyway
+SCREEN_FRAME_MAX_SETTLE = float(os.environ.get("SCREEN_FRAME_MAX_SETTLE", "12"))
+SCREEN_SESSION_TTL = float(os.environ.get("SCREEN_SESSION_TTL", "600"))
+
+THUMBNAIL_SIZE = (160, 90)
+# Grayscale difference (0-255) above which a thumbnail pixel counts as changed; below it is JPEG noise
+PIXEL_CHANGE_LEVEL = 24
+_CHANGED_LUT = [0 if level <= PIXEL_CHANGE_LEVEL else 255 for level in range(256)]
+
+
+def frame_thumbnail(image):
+    """The small grayscale thumbnail frames are compared by."""
+    image.draft("L", (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))  # JPEG: decode at reduced scale
+    return image.convert("L").resize(THUMBNAIL_SIZE, Image.BILINEAR)
+
+
+def changed_ratio(a, b):
+    """Share of pixels that differ between two thumbnails."""
+    changed = ImageChops.difference(a, b).point(_CHANGED_LUT).histogram()[255]
+    return changed / (THUMBNAIL_SIZE[0] * THUMBNAIL_SIZE[1])
+
+
+class FrameDecision:
+    """What to do with a frame: `analyze` it or not, why, and the client's next sampling interval."""
+
+    def __init__(self, analyze, reason, next_interval):
+        self.analyze = analyze
+        self.reason = reason
+        self.next_interval = next_interval
+
+
+class _ScreenSession:
+    def __init__(self):
+        self.previous = None
+        self.analyzed = None
+        self.changing_since = None
+        self.last_analysis = 0.0
+        self.busy = False
+        self.interval = SCREEN_FRAME_MIN_INTERVAL
+        self.seen = 0.0
+
+
+class ScreenFrameTracker:
+    """Per-session frame history deciding which screenshots are worth a vision call."""
+
+    def __init__(self, change_ratio=SCREEN_FRAME_CHANGE_RATIO, cooldown=SCREEN_FRAME_COOLDOWN,
+                 max_settle=SCREEN_FRAME_MAX_SETTLE):
+        self.change_ratio = change_ratio
+        self.cooldown = cooldown
+        self.max_settle = max_settle
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stats = {"frames": 0, "analyzed": 0, "unchanged": 0, "settling": 0, "cooldown": 0, "busy": 0}
+
+    def observe(self, key, thumbnail, now=None):
+        """Records a frame for session `key` and returns a FrameDecision."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._prune(now)
+            state = self._sessions.setdefault(key, _ScreenSession())
+            state.seen = now
+            previous, state.previous = state.previous, thumbnail
+            decision = self._decide(state, thumbnail, previous, now)
+            self._stats["frames"] += 1
+            self._stats["analyzed" if decision.analyze else decision.reason] += 1
+            return decision
+
+    def _decide(self, state, frame, previous, now):
+        if state.analyzed is not None and changed_ratio(frame, state.analyzed) < self.change_ratio:
+            state.changing_since = None
+            state.interval = min(state.interval * 2, SCREEN_FRAME_MAX_INTERVAL)
+            return FrameDecision(False, "unchanged", state.interval)
+
+        # The screen differs from what was last analyzed: sample at the base rate again
+        state.interval = SCREEN_FRAME_MIN_INTERVAL
+        if state.changing_since is None:
+            state.changing_since = now
+        still_moving = previous is not None and changed_ratio(frame, previous) >= self.change_ratio
+        if still_moving and now - state.changing_since < self.max_settle:
+            return FrameDecision(False, "settling", state.interval)
+        if state.busy:
+            return FrameDecision(False, "busy", state.interval)
+        if now - state.last_analysis < self.cooldown:
+            return FrameDecision(False, "cooldown", state.interval)
+
+        state.busy = True
+        state.last_analysis = now
+        state.analyzed = frame
+        state.changing_since = None
+        return FrameDecision(True, "changed", state.interval)
+
+    def finish(self, key, ok=True):
+        """Ends the analysis started by an `analyze` decision; a failed one is retried on a later frame."""
+        with self._lock:
+            state = self._sessions.get(key)
+            if state is None:
+                return
+            state.busy = False
+            if not ok:
+                state.analyzed = None
+                state.last_analysis = 0.0
+
+    def _prune(self, now):
+        expired = [key for key, state in self._sessions.items() if now - state.seen > SCREEN_SESSION_TTL]
+        for key in expired:
+            del self._sessions[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, sessions=len(self._sessions))
+        stats["frames_per_analysis"] = round(stats["frames"] / stats["analyzed"], 1) if stats["analyzed"] else None
+        return stats
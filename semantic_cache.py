@@ -0,0 +1,191 @@
+"""
+Semantic near-duplicate cache for /ask.
+
+Questions are embedded on the CPU as hashed character/word n-gram vectors (no model download,
+no extra dependency) and looked up in an inverted index of past first-turn Q&A pairs. When the
+cosine similarity of the best match is at least SEMANTIC_CACHE_THRESHOLD, its stored answer is
+reused, so paraphrases like "solve 3x+5=17" and "3x + 5 = 17 find x" share one answer.
+
+Problems that differ only in a number, a sign, a keyword or the order of their parts ("3x+5=17"
+vs "3x+5=18", simple vs compound interest, "r=3, h=7" vs "r=7, h=3", Ram and Shyam swapped) look
+almost identical to any text embedding. So a match also requires both questions to have the same
+math signature: their numbers and operators, and their content words, each in the order they
+appear. The embedding only decides between paraphrases that say the same thing.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+from answer_cache import normalize_instruction
+from telemetry import log
+
+# --- SEMANTIC CACHE CONFIG ---
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "50000"))
+# Optional JSONL file the index is loaded from and appended to
+SEMANTIC_CACHE_PATH = os.environ.get("SEMANTIC_CACHE_PATH", "")
+
+EMBEDDING_DIM = 1 << 20
+# Instruction words that don't change what is being asked
+FILLER_WORDS = {
+    "solve", "find", "calculate", "compute", "evaluate", "determine", "work", "out", "please", "the",
+    "value", "values", "of", "for", "what", "is", "are", "a", "an", "answer", "get", "me", "can",
+    "you", "help", "with", "question", "problem", "give", "show",
+}
+# Words that carry no meaning of their own in a question; all others are content words
+STOP_WORDS = {
+    "and", "as", "at", "be", "by", "do", "does", "did", "has", "have", "had", "how", "if", "in", "it",
+    "its", "on", "to", "then", "there", "their", "they", "this", "that", "which",
+}
+_WORD = re.compile(r"[a-z]+|\d+(?:\.\d+)?|[^\sa-z\d]")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_OPERATOR = re.compile(r"[+\-*/×÷=<>]")
+# Feature postings longer than this are too common to help ranking, so they are not scanned
+MAX_POSTING_SCAN = 5000
+
+
+def _hash_feature(feature):
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % EMBEDDING_DIM
+
+
+def content_words(text):
+    """The question's content words (not fillers or stop words), once each, in order of first appearance."""
+    words = re.findall(r"[a-z]+", normalize_instruction(text))
+    return tuple(dict.fromkeys(w for w in words if w not in FILLER_WORDS and w not in STOP_WORDS))
+
+
+def math_signature(text):
+    """
+    The numbers, operators and content words of a question, in order; two questions only match
+    if these are equal. Order matters: "120 km in 3 h" is not "3 km in 120 h".
+    """
+    normalized = normalize_instruction(text)
+    return tuple(_NUMBER.findall(normalized)), tuple(_OPERATOR.findall(normalized)), content_words(normalized)
+
+
+def embed(text):
+    """Embeds a question as an L2-normalized sparse vector {feature_index: weight}."""
+    tokens = [t for t in _WORD.findall(normalize_instruction(text)) if t not in FILLER_WORDS]
+    vector = defaultdict(float)
+    for token in tokens:
+        vector[_hash_feature("w:" + token)] += 1.0
+    compact = "".join(tokens)
+    for n in (2, 3):
+        for i in range(len(compact) - n + 1):
+            vector[_hash_feature(f"c{n}:" + compact[i:i + n])] += 1.0
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    if not norm:
+        return {}
+    return {index: w / norm for index, w in vector.items()}
+
+
+class SemanticCache:
+    """Inverted index of embedded first-turn questions, scoped by model choice and prompt version."""
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES, path=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()  # entry_id -> (scope, vector, math signature, answer)
+        # (scope, math signature, feature) -> entry ids; only same-signature entries can match,
+        # so keying postings on the signature keeps lookups from scanning unrelated problems
+        self._postings = defaultdict(set)
+        self._next_id = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def _load(self, path):
+        loaded = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._add(record['scope'], record['question'], record['answer'])
+                loaded += 1
+        log.info("Semantic cache: loaded %d Q&A pairs from %s", loaded, path)
+
+    def _add(self, scope, question, answer):
+        vector = embed(question)
+        if not vector:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            signature = math_signature(question)
+            self._entries[entry_id] = (scope, vector, signature, answer)
+            for feature in vector:
+                self._postings[(scope, signature, feature)].add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        entry_id, (scope, vector, signature, _) = self._entries.popitem(last=False)
+        for feature in vector:
+            key = (scope, signature, feature)
+            posting = self._postings.get(key)
+            if posting is not None:
+                posting.discard(entry_id)
+                if not posting:
+                    del self._postings[key]
+
+    def add(self, scope, question, answer):
+        """Indexes a Q&A pair (and appends it to SEMANTIC_CACHE_PATH if configured)."""
+        self._add(scope, question, answer)
+        if self.path:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'scope': scope, 'question': question, 'answer': answer}, ensure_ascii=False) + "\n")
+            except OSError as e:
+                log.warning("Semantic cache write failed: %s", e)
+
+    def lookup(self, scope, question):
+        """Returns (answer, similarity) for the closest stored question above the threshold, else (None, best)."""
+        vector = embed(question)
+        signature = math_signature(question)
+        scores = defaultdict(float)
+        with self._lock:
+            for feature, weight in vector.items():
+                posting = self._postings.get((scope, signature, feature))
+                if not posting or len(posting) > MAX_POSTING_SCAN:
+                    continue
+                for entry_id in posting:
+                    scores[entry_id] += weight * self._entries[entry_id][1][feature]
+            best_answer, best_score = None, 0.0
+            for entry_id, score in scores.items():
+                if score > best_score:
+                    best_answer, best_score = self._entries[entry_id][3], score
+            if best_answer is not None and best_score >= self.threshold:
+                self.hits += 1
+                return best_answer, best_score
+            self.misses += 1
+            return None, best_score
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": SEMANTIC_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def semantic_scope(model_choice, prompt_version):
+    return f"{prompt_version}|{model_choice}"
+
+
+def create_semantic_cache():
+    """Builds the semantic cache from the SEMANTIC_CACHE_* settings."""
+    return SemanticCache(path=SEMANTIC_CACHE_PATH or None)
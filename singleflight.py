@@ -0,0 +1,190 @@
+"""
+In-flight coalescing ("singleflight") of identical /ask questions.
+
+When a teacher posts a homework problem, many students ask it within seconds, before the first
+answer has finished and reached the answer cache. Questions that the cache would share anyway
+(answer_cache.is_cacheable, keyed by cache_key: normalized instruction, model choice, prompt
+version) share one upstream stream instead: the first one starts a flight, and duplicates that
+arrive while it is in the air follow it, getting every chunk from the start. The flight is
+cached when it lands, so later duplicates hit the answer cache.
+
+The upstream stream belongs to the flight, not to any one request: a student who stops their
+answer just stops following, and the upstream call is cancelled only when every follower has
+gone. Flights are per worker process.
+"""
+import asyncio
+import os
+import threading
+
+from cancellation import Generation
+from telemetry import log
+
+# --- SINGLEFLIGHT CONFIG ---
+SINGLEFLIGHT_ENABLED = os.environ.get("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+
+
+class Flight:
+    """One upstream answer and the requests following it."""
+
+    def __init__(self, key):
+        self.key = key
+        # Cancels the upstream stream once nobody follows the flight any more
+        self.cancel = Generation(("flight", key))
+        self.chunks = []
+        self.landed = False
+        self.followers = 0
+        self.task = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._listeners = []
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def _notify(self):
+        with self._lock:
+            self._changed.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def publish(self, chunk):
+        with self._lock:
+            self.chunks.append(chunk)
+        self._notify()
+
+    def land(self):
+        with self._lock:
+            self.landed = True
+        self._notify()
+
+    def _leave(self):
+        with self._lock:
+            self.followers -= 1
+            abandoned = self.followers == 0 and not self.landed
+        if abandoned:
+            self.cancel.cancel()
+
+    def _next(self, index):
+        with self._lock:
+            return self.chunks[index:], self.landed
+
+    def follow(self, cancel=None):
+        """Yields the flight's chunks from the first, until it lands or `cancel` (the request's Generation) is set."""
+        if cancel is not None:
+            cancel.add_callback(self._notify)
+        index = 0
+        try:
+            while cancel is None or not cancel.is_set():
+                with self._lock:
+                    if len(self.chunks) == index and not self.landed and not (cancel and cancel.is_set()):
+                        self._changed.wait()
+                chunks, landed = self._next(index)
+                index += len(chunks)
+                yield from chunks
+                if landed and index == len(self.chunks):
+                    return
+        finally:
+            self._leave()
+
+    async def afollow(self):
+        """Async follow(); the caller stops it by closing it (see asgi.stop_on_cancel)."""
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def listener():
+            loop.call_soon_threadsafe(changed.set)
+
+        with self._lock:
+            self._listeners.append(listener)
+        index = 0
+        try:
+            while True:
+                changed.clear()
+                chunks, landed = self._next(index)
+                index += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if landed and not chunks:
+                    return
+                if not chunks:
+                    await changed.wait()
+        finally:
+            with self._lock:
+                self._listeners.remove(listener)
+            self._leave()
+
+
+class FlightRegistry:
+    """The flights in the air in this process, by answer cache key."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        # upstream_calls_avoided: requests that followed a flight instead of calling a provider
+        self._stats = {"flights": 0, "upstream_calls_avoided": 0, "abandoned": 0}
+
+    def join(self, key):
+        """Returns (flight, leader). The leader must fly the flight (fly() or afly())."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight(key)
+                self._stats["flights"] += 1
+            else:
+                self._stats["upstream_calls_avoided"] += 1
+            flight.followers += 1
+        return flight, leader
+
+    def _landed(self, flight):
+        """The flight's answer if it completed (and should be cached), else None."""
+        return flight.text if flight.chunks and not flight.cancel.is_set() else None
+
+    def _finish(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if flight.cancel.is_set():
+                self._stats["abandoned"] += 1
+        flight.land()
+
+    def fly(self, flight, chunks, on_landed):
+        """
+        Publishes `chunks` (the upstream stream) to the flight on a thread of its own.
+        `on_landed(text)` runs on a complete answer before the flight is removed, so a
+        duplicate arriving meanwhile finds either the flight or the cached answer.
+        """
+        def run():
+            try:
+                for chunk in chunks:
+                    flight.publish(chunk)
+                text = self._landed(flight)
+                if text:
+                    on_landed(text)
+            except Exception as e:
+                log.error("Singleflight %s failed: %s", flight.key[:12], e)
+            finally:
+                self._finish(flight)
+        threading.Thread(target=run, name=f"flight-{flight.key[:8]}", daemon=True).start()
+
+    def afly(self, flight, chunks, on_landed):
+        """Async fly(): publishes an async stream from a task; `on_landed` is awaited."""
+        async def run():
+            try:
+                async for chunk in chunks:
+                    flight.publish(chunk)
+                text = self._landed(flight)
+                if text:
+                    await on_landed(text)
+            except Exception as e:
+                log.error("Singleflight %s failed: %s", flight.key[:12], e)
+            finally:
+                self._finish(flight)
+        # Kept on the flight: the loop only holds weak references to tasks
+        flight.task = asyncio.ensure_future(run())
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_air=len(self._flights))
@@ -0,0 +1,114 @@
+"""
+Server-sent event framing for the /ask and /upload_image answer streams.
+
+An answer is sent as `token` events carrying text deltas, closed by one `done` event with the
+answer's final metadata (stopped, provider, chars, elapsed time), or by an `error` event:
+
+    event: token
+    data: {"text": "The quadratic "}
+
+    event: done
+    data: {"stopped": false, "provider": "gemini", "chars": 812, "elapsed_ms": 2310}
+
+Upstream deltas are often a token or two each, and every event costs a write (one send() and
+at least one TCP segment) plus its framing. coalesce() joins deltas so that at most one event
+goes out per SSE_COALESCE_MS, or sooner once SSE_COALESCE_CHARS are waiting; a delta that
+arrives after a quiet spell is sent at once, so time to first token is unchanged.
+SSE_COALESCE_MS=0 sends every delta as it comes.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+# --- SSE CONFIG ---
+SSE_COALESCE_MS = float(os.environ.get("SSE_COALESCE_MS", "30"))
+SSE_COALESCE_CHARS = int(os.environ.get("SSE_COALESCE_CHARS", "512"))
+
+# Proxies (nginx, Render's edge) must pass events through as they are written
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# A comment line, which clients ignore; keeps idle connections from being timed out by proxies
+KEEPALIVE = ": keep-alive\n\n"
+
+
+def event(name, data, event_id=None):
+    """One SSE event. The data is JSON, which keeps newlines in the text out of the framing."""
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def token_event(text, event_id=None):
+    return event("token", {"text": text}, event_id)
+
+
+def done_event(**metadata):
+    return event("done", metadata)
+
+
+def error_event(message):
+    return event("error", {"message": message})
+
+
+def _settings(window_ms, max_chars):
+    window_ms = SSE_COALESCE_MS if window_ms is None else window_ms
+    return window_ms / 1000, SSE_COALESCE_CHARS if max_chars is None else max_chars
+
+
+def coalesce(chunks, window_ms=None, max_chars=None):
+    """
+    Joins text deltas into at most one piece per window (see the module docstring).
+    A sync generator can only flush when a delta arrives, so text held back during a burst
+    goes out with the next delta, or when the stream ends.
+    """
+    window, max_chars = _settings(window_ms, max_chars)
+    buffer, size, last_flush = [], 0, float("-inf")
+    try:
+        for chunk in chunks:
+            buffer.append(chunk)
+            size += len(chunk)
+            now = time.monotonic()
+            if size >= max_chars or now - last_flush >= window:
+                yield "".join(buffer)
+                buffer, size, last_flush = [], 0, now
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+async def acoalesce(chunks, window_ms=None, max_chars=None):
+    """Async coalesce(): held text is also flushed when its window closes, without waiting for the next delta."""
+    window, max_chars = _settings(window_ms, max_chars)
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    buffer, size, last_flush = [], 0, float("-inf")
+    next_chunk = None
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(last_flush + window - loop.time(), 0) if buffer else None
+            await asyncio.wait({next_chunk}, timeout=timeout)
+            if next_chunk.done():
+                finished, next_chunk = next_chunk, None
+                try:
+                    chunk = finished.result()
+                except StopAsyncIteration:
+                    break
+                buffer.append(chunk)
+                size += len(chunk)
+                if size < max_chars and loop.time() - last_flush < window:
+                    continue
+            yield "".join(buffer)
+            buffer, size, last_flush = [], 0, loop.time()
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if next_chunk is not None:
+            next_chunk.cancel()
+            with contextlib.suppress(asyncio.CancelledError, StopAsyncIteration):
+                await next_chunk
+        await iterator.aclose()
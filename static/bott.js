@@ -433,6 +433,72 @@ async function finalizeStreamingBotMessage(image_urls = []) {
 }
 
 
+// Reads an /ask or /upload_image answer stream: "token" events carry text deltas, and the
+// stream ends with a "done" event (final metadata, which is returned) or an "error" event (thrown).
+// The last event ID seen is kept in `position`, for resuming the stream
+async function readAnswerStream(response, onToken, position = {}) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    let end;
+    while ((end = buffered.indexOf("\n\n")) !== -1) {
+      const block = buffered.slice(0, end);
+      buffered = buffered.slice(end + 2);
+      let name = "message";
+      let data = "";
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) name = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+        else if (line.startsWith("id:")) position.lastEventId = line.slice(3).trim();
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (name === "token") await onToken(payload.text);
+      else if (name === "done") return payload;
+      else if (name === "error") throw Object.assign(new Error(payload.message), { fromServer: true });
+    }
+  }
+  throw new Error("The connection closed before the answer finished.");
+}
+
+const ANSWER_RESUME_ATTEMPTS = 5;
+
+function newMessageId() {
+  if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Follows an /ask answer. The server keeps generating it if the connection drops, so on a
+// network error this reconnects to /answer_stream and carries on from the last event received
+async function followAnswer(response, chatId, messageId, onToken, signal) {
+  const position = { lastEventId: "" };
+  let failures = 0;
+  while (true) {
+    try {
+      if (!response) {
+        response = await fetch(
+          `${window.location.origin}/answer_stream/${encodeURIComponent(chatId)}/${encodeURIComponent(messageId)}`,
+          { headers: { "Last-Event-ID": position.lastEventId }, signal }
+        );
+        if (!response.ok) {
+          const data = await response.json().catch(() => ({}));
+          throw Object.assign(new Error(data.error || "The answer could not be resumed."), { fromServer: true });
+        }
+      }
+      return await readAnswerStream(response, onToken, position);
+    } catch (error) {
+      if (error.name === "AbortError" || error.fromServer || ++failures > ANSWER_RESUME_ATTEMPTS) throw error;
+      console.warn(`Answer stream dropped (${error.message}), resuming...`);
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures));
+      response = null;
+    }
+  }
+}
+
 // AI Function Calls (stubs, assume backend handles actual API calls)
 async function askAI(instruction, modelChoice, performSearch = false) {
   // Added performSearch parameter
@@ -449,11 +515,14 @@ async function askAI(instruction, modelChoice, performSearch = false) {
   const signal = abortController.signal;
 
   try {
+    const chatId = currentChatId;
+    const messageId = newMessageId(); // lets the answer be resumed if the connection drops
     const formData = new FormData();
     formData.append("instruction", instruction);
-    formData.append("chat_id", currentChatId);
+    formData.append("chat_id", chatId);
     formData.append("model_choice", modelChoice); // Append model choice
     formData.append("web_search", performSearch); // Pass the web_search flag
+    formData.append("message_id", messageId);
 
     const response = await fetch(`${window.location.origin}/ask`, {
       method: "POST",
@@ -474,18 +543,7 @@ async function askAI(instruction, modelChoice, performSearch = false) {
     // Create the initial message container for streaming
     createStreamingBotMessage(new Date());
 
-    const reader = response.body.getReader();
-    const decoder = new TextDecoder();
-    let done = false;
-
-    while (!done) {
-      const { value, done: readerDone } = await reader.read();
-      done = readerDone;
-      const chunk = decoder.decode(value, { stream: true });
-      if (chunk) {
-        await appendToStreamingBotMessage(chunk);
-      }
-    }
+    await followAnswer(response, chatId, messageId, appendToStreamingBotMessage, signal);
 
     // Finalize the streaming message after stream finishes
     finalizeStreamingBotMessage();
@@ -609,6 +667,10 @@ async function uploadImage(file, caption) {
     });
 
     loader.style.display = "none";
+    if (!response.ok) {
+      const data = await response.json().catch(() => ({}));
+      throw new Error(data.error || data.response || `Server error: ${response.status}`);
+    }
 
     // ✅ NEW: Show the extraction pipeline clearly
     createStreamingBotMessage(new Date());
@@ -616,18 +678,7 @@ async function uploadImage(file, caption) {
     // ✅ Show pipeline stages to user
     await appendToStreamingBotMessage("🔍 **Vision Model Extracting Information...**\n\n");
     
-    const reader = response.body.getReader();
-    const decoder = new TextDecoder();
-    let done = false;
-
-    while (!done) {
-      const { value, done: readerDone } = await reader.read();
-      done = readerDone;
-      const chunk = decoder.decode(value, { stream: true });
-      if (chunk) {
-        await appendToStreamingBotMessage(chunk);
-      }
-    }
+    await readAnswerStream(response, appendToStreamingBotMessage);
 
     finalizeStreamingBotMessage();
   } catch (error) {
@@ -1332,7 +1383,7 @@ async function startScreenShare() {
     screenShareBtn.classList.add("screen-share-active");
     screenShareBtn.querySelector("i").className = "fas fa-stop-circle";
     screenShareStream.getVideoTracks()[0].onended = () => stopScreenShare();
-    screenShareInterval = setInterval(captureAndSendScreenFrame, 2000);
+    scheduleScreenFrame(SCREEN_FRAME_BASE_INTERVAL);
     addMessage("Screen sharing started. I will analyze your screen for issues.", "bot", null, new Date());
   } catch (err) {
     console.error("Error starting screen share:", err);
@@ -1346,7 +1397,7 @@ async function startScreenShare() {
 
 function stopScreenShare() {
   if (screenShareStream) { screenShareStream.getTracks().forEach(t => t.stop()); screenShareStream = null; }
-  if (screenShareInterval) { clearInterval(screenShareInterval); screenShareInterval = null; }
+  if (screenShareInterval) { clearTimeout(screenShareInterval); screenShareInterval = null; }
   isScreenSharing = false;
   if (screenShareBtn) {
     screenShareBtn.classList.remove("screen-share-active");
@@ -1356,6 +1407,18 @@ function stopScreenShare() {
   addMessage("Live talk ended.", "bot", null, new Date());
 }
 
+// The server skips frames that show nothing new and replies with the interval to use next
+// (longer while the screen is static, back to the base rate once it changes).
+const SCREEN_FRAME_BASE_INTERVAL = 2000;
+
+function scheduleScreenFrame(delay) {
+  if (!isScreenSharing) return;
+  screenShareInterval = setTimeout(async () => {
+    const nextDelay = await captureAndSendScreenFrame();
+    scheduleScreenFrame(nextDelay || SCREEN_FRAME_BASE_INTERVAL);
+  }, delay);
+}
+
 async function captureAndSendScreenFrame() {
   if (!screenShareVideoElement || !isScreenSharing) return;
   screenCaptureCanvas.width  = screenShareVideoElement.videoWidth;
@@ -1372,6 +1435,7 @@ async function captureAndSendScreenFrame() {
     if (data && data.response) {
       addMessage(`**Screen Analysis:** ${data.response}`, "bot", null, new Date());
     }
+    return data && data.next_interval_ms;
   } catch (error) {
     console.error("Error sending screen frame to AI:", error);
   }
@@ -1457,76 +1521,166 @@ applyCodeUpdateBtn.addEventListener("click", async () => {
   }
 });
 
+// The sidebar lists chats a page at a time (the server returns the total in X-Total-Count)
+const CHAT_LIST_PAGE_SIZE = 50;
+let chatListLoaded = 0;
+let chatListTotal = 0;
+let chatListLoading = false;
+let chatListObserver = null;
+
+async function fetchChatPage(offset, limit = CHAT_LIST_PAGE_SIZE) {
+  const response = await fetch(
+    `${window.location.origin}/get_chat_history_list?offset=${offset}&limit=${limit}`
+  );
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`);
+  }
+  const chatSummaries = await response.json();
+  const total = parseInt(response.headers.get("X-Total-Count"), 10);
+  return {
+    chatSummaries,
+    total: Number.isNaN(total) ? offset + chatSummaries.length : total,
+  };
+}
+
+function createChatLink(chatSummary) {
+  const chatLink = document.createElement("a");
+  chatLink.href = "#";
+  chatLink.className = `chat-link ${
+    chatSummary.id === currentChatId ? "active" : ""
+  }`;
+  chatLink.setAttribute("data-chat-id", chatSummary.id); // Store chat ID
+  chatLink.setAttribute("data-chat-title", chatSummary.title); // Store chat title
+  chatLink.setAttribute("role", "option");
+  chatLink.setAttribute(
+    "aria-selected",
+    chatSummary.id === currentChatId ? "true" : "false"
+  );
+  chatLink.setAttribute("tabindex", "0"); // Make it focusable
+
+  const chatTitleSpan = document.createElement("span");
+  chatTitleSpan.textContent = chatSummary.title;
+  chatLink.appendChild(chatTitleSpan);
+
+  const actionsDiv = document.createElement("div");
+  actionsDiv.className = "chat-link-actions";
+
+  const renameBtn = document.createElement("button");
+  renameBtn.className = "rename-chat-btn";
+  renameBtn.innerHTML = '<i class="fas fa-edit" aria-hidden="true"></i>';
+  renameBtn.title = "Rename Chat";
+  renameBtn.setAttribute(
+    "aria-label",
+    `Rename chat ${chatSummary.title}`
+  );
+  renameBtn.onclick = (e) => {
+    e.stopPropagation(); // Prevent loading chat when clicking rename
+    renameChat(chatSummary.id, chatSummary.title);
+  };
+  actionsDiv.appendChild(renameBtn);
+
+  const deleteBtn = document.createElement("button");
+  deleteBtn.className = "delete-chat-btn";
+  deleteBtn.innerHTML = '<i class="fas fa-trash" aria-hidden="true"></i>';
+  deleteBtn.title = "Delete Chat";
+  deleteBtn.setAttribute(
+    "aria-label",
+    `Delete chat ${chatSummary.title}`
+  );
+  deleteBtn.onclick = (e) => {
+    e.stopPropagation(); // Prevent loading chat when clicking delete
+    deleteChat(chatSummary.id, chatSummary.title);
+  };
+  actionsDiv.appendChild(deleteBtn);
+
+  chatLink.appendChild(actionsDiv);
+
+  chatLink.onclick = (e) => {
+    e.preventDefault();
+    loadChat(chatSummary.id);
+  };
+  return chatLink;
+}
+
+function appendChatLinks(chatSummaries) {
+  const chatHistoryList = document.getElementById("chat-history-list");
+  chatSummaries.forEach((chatSummary) => {
+    chatHistoryList.appendChild(createChatLink(chatSummary));
+  });
+  chatListLoaded += chatSummaries.length;
+  renderLoadMoreChats();
+}
+
+// A "Load more" entry at the end of the list while the server has more chats; it also loads
+// the next page by itself when scrolled into view
+function renderLoadMoreChats() {
+  const chatHistoryList = document.getElementById("chat-history-list");
+  let loadMoreBtn = document.getElementById("load-more-chats");
+  if (chatListLoaded >= chatListTotal) {
+    if (loadMoreBtn) loadMoreBtn.remove();
+    return;
+  }
+  if (!loadMoreBtn) {
+    loadMoreBtn = document.createElement("button");
+    loadMoreBtn.id = "load-more-chats";
+    loadMoreBtn.className = "chat-link load-more-chats";
+    loadMoreBtn.onclick = () => loadMoreChats();
+    if (!chatListObserver && "IntersectionObserver" in window) {
+      chatListObserver = new IntersectionObserver(
+        (entries) => {
+          if (entries.some((entry) => entry.isIntersecting)) loadMoreChats();
+        },
+        { root: chatHistoryList }
+      );
+    }
+  }
+  loadMoreBtn.textContent = `Load more (${chatListTotal - chatListLoaded})`;
+  loadMoreBtn.setAttribute("aria-label", "Load more chats");
+  chatHistoryList.appendChild(loadMoreBtn); // Keep it last
+  if (chatListObserver) chatListObserver.observe(loadMoreBtn);
+}
+
+async function loadMoreChats() {
+  if (chatListLoading || chatListLoaded >= chatListTotal) return;
+  chatListLoading = true;
+  try {
+    const page = await fetchChatPage(chatListLoaded);
+    chatListTotal = page.total;
+    appendChatLinks(page.chatSummaries);
+  } catch (error) {
+    console.error("Error fetching more chats:", error);
+  } finally {
+    chatListLoading = false;
+  }
+}
+
 async function updateChatHistory() {
   const chatHistoryList = document.getElementById("chat-history-list");
-  chatHistoryList.innerHTML = ""; // Clear existing history
   try {
-    const response = await fetch(
-      `${window.location.origin}/get_chat_history_list`
-    );
-    const chatSummaries = await response.json();
+    // Reload as many chats as were showing, so a chat opened from a later page stays listed
+    const wanted = Math.max(chatListLoaded, CHAT_LIST_PAGE_SIZE);
+    const chatSummaries = [];
+    let total = 0;
+    chatListLoading = true;
+    try {
+      do {
+        const page = await fetchChatPage(chatSummaries.length);
+        chatSummaries.push(...page.chatSummaries);
+        total = page.total;
+        if (page.chatSummaries.length === 0) break;
+      } while (chatSummaries.length < Math.min(wanted, total));
+    } finally {
+      chatListLoading = false;
+    }
 
+    if (chatListObserver) chatListObserver.disconnect();
+    chatHistoryList.innerHTML = ""; // Clear existing history
+    chatListLoaded = 0;
+    chatListTotal = total;
     if (chatSummaries.length === 0) {
       await startNewChat(true); // Start a new chat if no history
     } else {
-      chatSummaries.forEach((chatSummary) => {
-        const chatLink = document.createElement("a");
-        chatLink.href = "#";
-        chatLink.className = `chat-link ${
-          chatSummary.id === currentChatId ? "active" : ""
-        }`;
-        chatLink.setAttribute("data-chat-id", chatSummary.id); // Store chat ID
-        chatLink.setAttribute("data-chat-title", chatSummary.title); // Store chat title
-        chatLink.setAttribute("role", "option");
-        chatLink.setAttribute(
-          "aria-selected",
-          chatSummary.id === currentChatId ? "true" : "false"
-        );
-        chatLink.setAttribute("tabindex", "0"); // Make it focusable
-
-        const chatTitleSpan = document.createElement("span");
-        chatTitleSpan.textContent = chatSummary.title;
-        chatLink.appendChild(chatTitleSpan);
-
-        const actionsDiv = document.createElement("div");
-        actionsDiv.className = "chat-link-actions";
-
-        const renameBtn = document.createElement("button");
-        renameBtn.className = "rename-chat-btn";
-        renameBtn.innerHTML = '<i class="fas fa-edit" aria-hidden="true"></i>';
-        renameBtn.title = "Rename Chat";
-        renameBtn.setAttribute(
-          "aria-label",
-          `Rename chat ${chatSummary.title}`
-        );
-        renameBtn.onclick = (e) => {
-          e.stopPropagation(); // Prevent loading chat when clicking rename
-          renameChat(chatSummary.id, chatSummary.title);
-        };
-        actionsDiv.appendChild(renameBtn);
-
-        const deleteBtn = document.createElement("button");
-        deleteBtn.className = "delete-chat-btn";
-        deleteBtn.innerHTML = '<i class="fas fa-trash" aria-hidden="true"></i>';
-        deleteBtn.title = "Delete Chat";
-        deleteBtn.setAttribute(
-          "aria-label",
-          `Delete chat ${chatSummary.title}`
-        );
-        deleteBtn.onclick = (e) => {
-          e.stopPropagation(); // Prevent loading chat when clicking delete
-          deleteChat(chatSummary.id, chatSummary.title);
-        };
-        actionsDiv.appendChild(deleteBtn);
-
-        chatLink.appendChild(actionsDiv);
-
-        chatLink.onclick = (e) => {
-          e.preventDefault();
-          loadChat(chatSummary.id);
-        };
-        chatHistoryList.appendChild(chatLink);
-      });
+      appendChatLinks(chatSummaries);
 
       // Load the most recent chat if no current chat is active
       const isCurrentChatInList = chatSummaries.some(
@@ -2403,8 +2557,7 @@ function resetReadAloudButton(button) {
  */
 function stopReadAloud() {
     if (currentAudio) {
-        currentAudio.pause();
-        currentAudio.currentTime = 0;
+        currentAudio.stop();
         currentAudio = null;
     }
     if (currentSpeechButton) {
@@ -2451,28 +2604,8 @@ async function readMessageAloud(button) {
         button.setAttribute('aria-label', 'Generating voice...');
         console.log("🎤 Sending text to Piper:", textToSpeak.slice(0, 100) + "...");
 
-        // 5️⃣ Send text to Flask backend
-        const response = await fetch(`${window.location.origin}/synthesize_speech`, {
-            method: "POST",
-            headers: {
-                "Content-Type": "application/json"
-            },
-            body: JSON.stringify({
-                text: textToSpeak
-            }),
-        });
-
-        if (!response.ok) {
-            throw new Error(`Piper request failed: ${response.status}`);
-        }
-
-        const data = await response.json();
-        if (!data.audio) {
-            throw new Error("No audio data returned from Piper.");
-        }
-
-        // 6️⃣ Prepare audio element
-        currentAudio = new Audio(data.audio);
+        // 5️⃣ Stream it from /stream_tts: playback starts after the first sentence
+        currentAudio = new PiperSpeechStream();
 
         // Set button to stop mode
         button.innerHTML = stopSVG;
@@ -2481,21 +2614,18 @@ async function readMessageAloud(button) {
         button.style.color = 'var(--text-color, #10b981)'; // active highlight
         currentSpeechButton = button;
 
-        // 7️⃣ Handle playback events
-        currentAudio.onended = () => {
-            resetReadAloudButton(button);
-            currentAudio = null;
-            currentSpeechButton = null;
-        };
-        currentAudio.onerror = (err) => {
-            console.error("Audio playback error:", err);
+        // 6️⃣ Handle the end of playback
+        const stream = currentAudio;
+        stream.onended = () => {
+            if (currentAudio !== stream) return;
             resetReadAloudButton(button);
             currentAudio = null;
             currentSpeechButton = null;
         };
 
-        // 8️⃣ Start playback
-        await currentAudio.play();
+        // 7️⃣ Start playback
+        stream.push(textToSpeak);
+        stream.end();
         console.log("🎧 Piper playback started.");
 
     } catch (error) {
@@ -2583,6 +2713,7 @@ async function askAI(
   // Initialize AbortController for this request
   let abortController = new AbortController();
   const signal = abortController.signal;
+  let answerSpeech = null;
 
   try {
     const formData = new FormData();
@@ -2592,10 +2723,13 @@ async function askAI(
       ? `${instruction} [regenerate:${Date.now()}]`
       : instruction;
 
+    const chatId = currentChatId;
+    const messageId = newMessageId(); // lets the answer be resumed if the connection drops
     formData.append("instruction", finalInstruction);
-    formData.append("chat_id", currentChatId);
+    formData.append("chat_id", chatId);
     formData.append("model_choice", modelChoice);
     formData.append("web_search", performSearch);
+    formData.append("message_id", messageId);
 
     const response = await fetch(`${window.location.origin}/ask`, {
       method: "POST",
@@ -2615,24 +2749,25 @@ async function askAI(
 
     // Create the initial message container for streaming
     createStreamingBotMessage(new Date());
-
-    const reader = response.body.getReader();
-    const decoder = new TextDecoder();
-    let done = false;
-
-    while (!done) {
-      const { value, done: readerDone } = await reader.read();
-      done = readerDone;
-      const chunk = decoder.decode(value, { stream: true });
-      if (chunk) {
-        await appendToStreamingBotMessage(chunk);
-      }
+    if (readAnswersAloudEnabled()) {
+      stopReadAloud();
+      const speech = (answerSpeech = currentAudio = new PiperSpeechStream());
+      speech.onended = () => {
+        if (currentAudio === speech) currentAudio = null;
+      };
     }
 
+    await followAnswer(response, chatId, messageId, async (text) => {
+      await appendToStreamingBotMessage(text);
+      if (answerSpeech) answerSpeech.push(text);
+    }, signal);
+    if (answerSpeech) answerSpeech.end();
+
     // Finalize the streaming message after stream finishes
     finalizeStreamingBotMessage();
   } catch (error) {
     loader.style.display = "none";
+    if (answerSpeech) answerSpeech.stop();
     if (error.name === "AbortError") {
       console.log("Fetch aborted by user.");
       if (currentBotMessageContentDiv) {
@@ -3380,67 +3515,175 @@ window.enhanceAcademicPrompt = enhanceAcademicPrompt;
 // ===========================================
 // 🔊 Live Talk using Piper TTS Streaming
 // ===========================================
-
-async function playPiperTTSStream(text) {
-  try {
-    if (!text || !text.trim()) {
-      console.warn("⚠️ No text to speak.");
-      return;
+// /stream_tts answers with one complete WAV file per sentence, back to back. Each WAV is cut
+// out of the byte stream by its RIFF length, decoded, and scheduled right after the previous
+// one, so playback starts with the first sentence without gaps or overlaps.
+// When the server has no Piper (/stream_tts answers 503), the text is spoken with the
+// browser's speechSynthesis instead, and /stream_tts is not asked again on this page.
+
+const TTS_MIN_REQUEST_CHARS = 80; // text sent per /stream_tts request while an answer streams in
+
+class PiperSpeechStream {
+  constructor() {
+    this.audioContext = new (window.AudioContext || window.webkitAudioContext)();
+    this.controller = new AbortController();
+    this.nextStartTime = 0;
+    this.sources = new Set();
+    this.pendingText = "";
+    this.playback = Promise.resolve();
+    this.finished = false;
+    this.stopped = false;
+    this.onended = null;
+    this.utterances = 0; // browser speech still queued or speaking
+  }
+
+  static piperUnavailable = false;
+
+  // Queues text to speak. Complete sentences are sent right away, so an answer can be
+  // spoken while /ask is still streaming it; call end() when the text is complete.
+  push(text) {
+    if (this.stopped || !text) return;
+    this.pendingText += text;
+    const sentenceEnd = /[.!?।][\s]|\n/g;
+    let cut = -1;
+    let match;
+    while ((match = sentenceEnd.exec(this.pendingText)) !== null) {
+      cut = match.index + match[0].length;
+    }
+    if (cut >= TTS_MIN_REQUEST_CHARS) {
+      this._send(this.pendingText.slice(0, cut));
+      this.pendingText = this.pendingText.slice(cut);
     }
+  }
+
+  end() {
+    if (this.pendingText.trim()) this._send(this.pendingText);
+    this.pendingText = "";
+    this.playback = this.playback.then(() => {
+      this.finished = true;
+      this._maybeEnded();
+    });
+    return this.playback;
+  }
 
-    console.log("🎤 Sending text to Piper stream:", text.slice(0, 100) + "...");
+  stop() {
+    if (this.stopped) return;
+    this.stopped = true;
+    this.controller.abort();
+    this.sources.forEach((source) => source.stop());
+    this.sources.clear();
+    if (this.utterances) window.speechSynthesis.cancel();
+    this.audioContext.close();
+  }
 
-    const response = await fetch(`${window.location.origin}/stream_tts`, {
+  // Requests start at once (the server synthesizes in parallel) but are played in order
+  _send(text) {
+    if (PiperSpeechStream.piperUnavailable) {
+      this.playback = this.playback.then(() => this._speak(text)).catch((error) => {
+        console.error("❌ Speech fallback failed:", error);
+      });
+      return;
+    }
+    const response = fetch(`${window.location.origin}/stream_tts`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({ text }),
+      signal: this.controller.signal,
+    });
+    response.catch(() => {}); // reported when its turn to play comes
+    this.playback = this.playback.then(() => this._play(response, text)).catch((error) => {
+      if (error.name !== "AbortError") console.error("❌ Piper TTS streaming failed:", error);
     });
+  }
 
+  async _play(responsePromise, text) {
+    const response = await responsePromise;
+    if (response.status === 503) {
+      PiperSpeechStream.piperUnavailable = true;
+      return this._speak(text);
+    }
     if (!response.ok) throw new Error(`Piper stream failed: ${response.status}`);
-
-    const audioContext = new (window.AudioContext || window.webkitAudioContext)();
     const reader = response.body.getReader();
-
-    let audioChunks = [];
-    let streamClosed = false;
-
-    const processChunk = async (chunk) => {
-      try {
-        const blob = new Blob([chunk], { type: "audio/wav" });
-        const arrayBuffer = await blob.arrayBuffer();
-        const audioBuffer = await audioContext.decodeAudioData(arrayBuffer);
-        const source = audioContext.createBufferSource();
-        source.buffer = audioBuffer;
-        source.connect(audioContext.destination);
-        source.start();
-      } catch (err) {
-        console.error("⚠️ Error decoding audio chunk:", err);
+    let buffered = new Uint8Array(0);
+    while (!this.stopped) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      const joined = new Uint8Array(buffered.length + value.length);
+      joined.set(buffered);
+      joined.set(value, buffered.length);
+      buffered = joined;
+      // A WAV file is "RIFF", its little-endian size, then that many bytes
+      while (buffered.length >= 8) {
+        const size = new DataView(buffered.buffer, buffered.byteOffset).getUint32(4, true) + 8;
+        if (buffered.length < size) break;
+        await this._schedule(buffered.slice(0, size));
+        buffered = buffered.slice(size);
       }
+    }
+  }
+
+  async _schedule(wav) {
+    let audioBuffer;
+    try {
+      audioBuffer = await this.audioContext.decodeAudioData(wav.buffer);
+    } catch (err) {
+      console.error("⚠️ Error decoding audio chunk:", err);
+      return;
+    }
+    if (this.stopped) return;
+    const source = this.audioContext.createBufferSource();
+    source.buffer = audioBuffer;
+    source.connect(this.audioContext.destination);
+    const startAt = Math.max(this.nextStartTime, this.audioContext.currentTime);
+    source.start(startAt);
+    this.nextStartTime = startAt + audioBuffer.duration;
+    this.sources.add(source);
+    source.onended = () => {
+      this.sources.delete(source);
+      this._maybeEnded();
     };
+  }
 
-    // Read streaming chunks from the server
-    while (!streamClosed) {
-      const { done, value } = await reader.read();
-      if (done) {
-        streamClosed = true;
-        console.log("✅ Piper stream finished.");
-        break;
-      }
+  // Fallback when the server can't synthesize: the browser queues utterances in order
+  _speak(text) {
+    if (this.stopped) return;
+    if (!("speechSynthesis" in window)) throw new Error("No speech synthesis available");
+    const utterance = new SpeechSynthesisUtterance(text);
+    const done = () => {
+      this.utterances -= 1;
+      this._maybeEnded();
+    };
+    utterance.onend = done;
+    utterance.onerror = done;
+    this.utterances += 1;
+    window.speechSynthesis.speak(utterance);
+  }
 
-      if (value) {
-        await processChunk(value);
-      }
+  _maybeEnded() {
+    if (this.finished && !this.stopped && this.sources.size === 0 && this.utterances === 0) {
+      this.stopped = true;
+      this.audioContext.close();
+      if (this.onended) this.onended();
     }
-  } catch (error) {
-    console.error("❌ Piper TTS streaming failed:", error);
   }
 }
 
-// =====================================================
-// 🧠 Example: Hook this into your live talk pipeline
-// =====================================================
-// When your bot generates a live reply text, call this:
-// playPiperTTSStream(botReplyText);
+function playPiperTTSStream(text) {
+  if (!text || !text.trim()) {
+    console.warn("⚠️ No text to speak.");
+    return null;
+  }
+  console.log("🎤 Sending text to Piper stream:", text.slice(0, 100) + "...");
+  const stream = new PiperSpeechStream();
+  stream.push(text);
+  stream.end();
+  return stream;
+}
+
+// When "read answers aloud" is on, askAI speaks each answer while it streams in
+function readAnswersAloudEnabled() {
+  return localStorage.getItem("vexara_read_answers_aloud") === "true";
+}
 function showTypingIndicator() {
   const chatbox = document.getElementById("chatbox");
   const loader = document.getElementById("loader");
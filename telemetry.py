@@ -0,0 +1,114 @@
+"""
+Request stage timings, Prometheus metrics and non-blocking logging for the /ask pipeline.
+
+Each /ask request carries a RequestTrace labelled with the endpoint and model_choice. The
+pipeline times its stages on it (quota_check, history_load, web_search, message_build,
+upstream_connect, first_token, stream, history_save) into the vexara_stage_seconds histogram,
+labelled with the provider once one is chosen ("cache" for cached answers). /metrics serves the
+histograms in Prometheus' text format, and each finished request logs one line with its stage
+timings, so a slow answer shows where it spent its time. A stage costs two perf_counter() calls
+and one histogram observe, which is cheap enough to leave on.
+
+Log records go through a QueueHandler: the request thread only enqueues them, and a listener
+thread writes them to stdout, so a slow log pipe never stalls a stream.
+
+Metrics are per worker process; with several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR
+(an empty directory) so /metrics aggregates all of them.
+"""
+import atexit
+import logging
+import os
+import queue
+import sys
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+
+# --- TELEMETRY CONFIG ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+# Upstream stages take seconds, local ones milliseconds
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+STAGE_SECONDS = Histogram(
+    "vexara_stage_seconds", "Time spent in each stage of a request",
+    ["endpoint", "model_choice", "provider", "stage"], buckets=STAGE_BUCKETS,
+)
+REQUESTS = Counter(
+    "vexara_requests_total", "Requests by outcome",
+    ["endpoint", "model_choice", "provider", "outcome"],
+)
+
+log = logging.getLogger("vexara")
+_log_queue = queue.SimpleQueue()
+_listener = None
+
+
+def _start_listener():
+    global _listener
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = QueueListener(_log_queue, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+log.addHandler(QueueHandler(_log_queue))
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+_start_listener()
+atexit.register(_stop_listener)
+# The listener thread does not survive a fork (gunicorn --preload): start a new one in the child
+os.register_at_fork(after_in_child=_start_listener)
+
+
+class RequestTrace:
+    """Stage timings of one request. Stages may be observed from the router's worker threads."""
+
+    def __init__(self, endpoint, model_choice="none"):
+        self.endpoint = endpoint
+        self.model_choice = model_choice
+        self.provider = "none"
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    def observe(self, stage, seconds, provider=None):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        STAGE_SECONDS.labels(self.endpoint, self.model_choice, provider or self.provider, stage).observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def finish(self, outcome):
+        """Counts the request and logs its stage timings in one line."""
+        REQUESTS.labels(self.endpoint, self.model_choice, self.provider, outcome).inc()
+        stages = " ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in self.timings.items())
+        log.info("%s model=%s provider=%s outcome=%s total=%.0fms %s", self.endpoint, self.model_choice,
+                 self.provider, outcome, (time.perf_counter() - self.started) * 1000, stages)
+
+
+def observe(trace, stage, seconds, provider=None):
+    """trace.observe() for code paths where the trace is optional."""
+    if trace is not None:
+        trace.observe(stage, seconds, provider)
+
+
+def render_metrics():
+    """Returns the /metrics body and its content type."""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep importing api from writing chat history, caches and quotas into the checkout
+os.environ.setdefault("CHAT_HISTORY_DIR", tempfile.mkdtemp(prefix="vexara-tests-"))
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+import chat_store
+from chat_store import INDEX_FILE_NAME, create_chat_store
+
+
+@pytest.fixture(params=["jsonl", "sqlite"])
+def store(request, tmp_path):
+    return create_chat_store(str(tmp_path), request.param)
+
+
+def fill(store, chats):
+    for i in range(chats):
+        store.append("user", f"chat{i}", {"type": "user", "text": f"Question {i}"})
+
+
+def test_list_chats_pages_newest_first(store):
+    fill(store, 7)
+    store.append("user", "chat2", {"type": "ai", "text": "Answer"})
+
+    pages = [store.list_chats("user", offset, 3) for offset in (0, 3, 6)]
+
+    assert [[chat['id'] for chat in page] for page in pages] == [
+        ["chat2", "chat6", "chat5"], ["chat4", "chat3", "chat1"], ["chat0"],
+    ]
+    assert pages[0][0] == {
+        'id': "chat2", 'title': "Question 2", 'updated_at': pages[0][0]['updated_at'], 'message_count': 2,
+    }
+    assert store.list_chats("user", 7, 3) == []
+    assert store.count_chats("user") == 7
+    assert store.count_messages("user", "chat2") == 2
+
+
+def test_list_chats_without_limit(store):
+    fill(store, 4)
+    assert [chat['id'] for chat in store.list_chats("user")] == ["chat3", "chat2", "chat1", "chat0"]
+    assert store.list_chats("nobody") == [] and store.count_chats("nobody") == 0
+
+
+def test_saved_chats_are_listed_by_their_time(store):
+    fill(store, 2)
+    # Migrated chats keep their original time, older than anything appended since
+    store.save("user", "legacy", [{"type": "user", "text": "Old question"}], updated_at=1000)
+
+    assert [chat['id'] for chat in store.list_chats("user")] == ["chat1", "chat0", "legacy"]
+    assert store.count_chats("user") == 3
+
+
+def test_delete_all_empties_the_list(store):
+    fill(store, 3)
+    assert store.delete_all("user") == 3
+    assert store.list_chats("user") == [] and store.count_chats("user") == 0
+    fill(store, 1)
+    assert [chat['id'] for chat in store.list_chats("user")] == ["chat0"]
+
+
+def test_jsonl_index_is_rebuilt_when_missing(tmp_path):
+    store = create_chat_store(str(tmp_path), "jsonl")
+    fill(store, 3)
+    os.remove(tmp_path / "user" / INDEX_FILE_NAME)
+
+    assert [chat['id'] for chat in store.list_chats("user", 0, 2)] == ["chat2", "chat1"]
+    assert store.count_chats("user") == 3
+
+
+def test_jsonl_index_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(chat_store, "INDEX_COMPACT_BYTES", 1024)
+    store = create_chat_store(str(tmp_path), "jsonl")
+    fill(store, 3)
+    for i in range(100):
+        store.append("user", f"chat{i % 3}", {"type": "ai", "text": "Answer"})
+
+    index = (tmp_path / "user" / INDEX_FILE_NAME).read_text(encoding="utf-8").splitlines()
+    assert len(index) < 30
+    assert [chat['id'] for chat in store.list_chats("user")] == ["chat0", "chat2", "chat1"]
+    assert [chat['message_count'] for chat in store.list_chats("user")] == [35, 34, 34]
+    assert store.count_chats("user") == 3
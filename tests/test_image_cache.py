@@ -0,0 +1,73 @@
+import hashlib
+import io
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from image_cache import ImageSolutionCache, hamming, perceptual_hash
+
+
+def render(text, size=(800, 200)):
+    image = Image.new("RGB", size, "white")
+    ImageDraw.Draw(image).text((40, 40), text, fill="black", font=ImageFont.load_default(size=48))
+    return image
+
+
+def jpeg(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def problems():
+    first, second = jpeg(render("3x + 5 = 17")), jpeg(render("8x - 2 = 94"))
+    return {
+        "first": (sha256(first), perceptual_hash(Image.open(io.BytesIO(first)))),
+        "second": (sha256(second), perceptual_hash(Image.open(io.BytesIO(second)))),
+    }
+
+
+def test_only_identical_uploads_hit_by_default(tmp_path, problems):
+    cache = ImageSolutionCache(str(tmp_path))
+    sha_first, phash_first = problems["first"]
+    sha_second, _ = problems["second"]
+    cache.put(sha_first, phash_first, "solve", "x = 4", ocr_text="3x + 5 = 17")
+
+    assert cache.lookup(sha_first, "solve") == "x = 4"
+    assert cache.lookup(sha_first, "explain") is None
+    assert cache.lookup(sha_second, "solve") is None
+    # Off by default, even for the very same OCR text
+    assert cache.lookup_near_duplicate(phash_first, "3x + 5 = 17", "solve") is None
+
+
+def test_near_duplicate_needs_matching_ocr_text(tmp_path, problems):
+    cache = ImageSolutionCache(str(tmp_path), near_duplicates=True)
+    sha_first, phash_first = problems["first"]
+    cache.put(sha_first, phash_first, "solve", "x = 4", ocr_text="3x + 5 = 17")
+
+    # Different one-line problems can have the very same pHash
+    assert cache.lookup_near_duplicate(phash_first, "8x - 2 = 94", "solve") is None
+    assert cache.lookup_near_duplicate(phash_first, None, "solve") is None
+    assert cache.lookup_near_duplicate(phash_first, "3x  +  5 = 17\n", "solve") == "x = 4"
+    assert cache.stats()["near_duplicate_hits"] == 1
+
+
+def test_answers_without_ocr_text_are_never_near_duplicates(tmp_path, problems):
+    cache = ImageSolutionCache(str(tmp_path), near_duplicates=True)
+    sha_first, phash_first = problems["first"]
+    cache.put(sha_first, phash_first, "solve", "x = 4")  # answered by the vision model
+
+    assert cache.lookup_near_duplicate(phash_first, "3x + 5 = 17", "solve") is None
+
+
+def test_near_duplicate_index_is_loaded_from_disk(tmp_path, problems):
+    sha_first, phash_first = problems["first"]
+    ImageSolutionCache(str(tmp_path)).put(sha_first, phash_first, "solve", "x = 4", ocr_text="3x + 5 = 17")
+
+    cache = ImageSolutionCache(str(tmp_path), near_duplicates=True)
+    assert cache.lookup_near_duplicate(phash_first, "3x + 5 = 17", "solve") == "x = 4"
@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+import api
+from provider_router import route_stream
+
+
+class SlowResponse:
+    """A streaming upstream response that sends nothing until it is closed."""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def iter_chunks(self):
+        if self.closed.wait(5):
+            raise ConnectionError("connection closed")
+        yield "too late"
+
+    def close(self):
+        self.closed.set()
+
+
+@pytest.fixture
+def slow_gemini(monkeypatch):
+    calls = []
+    finished = threading.Event()
+
+    def call_gemini_api(messages, stream=False, encoded=None):
+        calls.append("stream" if stream else "generateContent")
+        return SlowResponse() if stream else None
+
+    def iter_gemini_stream(response):
+        try:
+            yield from response.iter_chunks()
+        finally:
+            finished.set()
+
+    monkeypatch.setattr(api, "GEMINI_STREAMING", True)
+    monkeypatch.setattr(api, "call_gemini_api", call_gemini_api)
+    monkeypatch.setattr(api, "iter_gemini_stream", iter_gemini_stream)
+    return calls, finished
+
+
+def fast_groq(on_open, cancel):
+    yield "x = 4"
+
+
+@pytest.mark.parametrize("policy", ["race", "hedged"])
+def test_losing_gemini_attempt_does_not_fall_back(slow_gemini, policy):
+    calls, finished = slow_gemini
+    candidates = [
+        ("gemini", lambda on_open, cancel: api.stream_gemini(None, on_open, cancel=cancel)),
+        ("groq", fast_groq),
+    ]
+
+    answer = "".join(route_stream(candidates, policy=policy, hedge_delay_ms=10))
+
+    assert answer == "x = 4"
+    assert finished.wait(5)
+    # Give the losing attempt's thread time to (wrongly) send its fallback request
+    threading.Event().wait(0.2)
+    assert calls == ["stream"]
+
+
+def test_gemini_falls_back_when_not_cancelled(slow_gemini, monkeypatch):
+    calls, _ = slow_gemini
+    cancel = threading.Event()
+
+    def call_gemini_api(messages, stream=False, encoded=None):
+        calls.append("stream" if stream else "generateContent")
+        return None
+
+    monkeypatch.setattr(api, "call_gemini_api", call_gemini_api)
+    assert list(api.stream_gemini(None, cancel=cancel)) == []
+    assert calls == ["stream", "generateContent"]
+
+    calls.clear()
+    cancel.set()
+    assert list(api.stream_gemini(None, cancel=cancel)) == []
+    assert calls == ["stream"]
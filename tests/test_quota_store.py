@@ -0,0 +1,81 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from quota_store import MemoryQuotaStore, SqliteQuotaStore
+
+LIMIT = 20
+DAY = "2026-01-05"
+
+
+def consume_many(db_path, attempts, results):
+    """Worker process: several threads racing try_consume on one shared database."""
+    store = SqliteQuotaStore(db_path)
+    allowed = []
+
+    def consume():
+        for _ in range(attempts):
+            allowed.append(store.try_consume("student", LIMIT, DAY)[0])
+
+    threads = [threading.Thread(target=consume) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(sum(allowed))
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request, tmp_path):
+    return SqliteQuotaStore(str(tmp_path / "quota.db")) if request.param == "sqlite" else MemoryQuotaStore()
+
+
+def test_try_consume_stops_at_the_limit(store):
+    results = [store.try_consume("student", 3, DAY) for _ in range(5)]
+
+    assert results == [(True, 1), (True, 2), (True, 3), (False, 3), (False, 3)]
+    assert store.get("student", DAY) == 3
+    assert store.get("other", DAY) == 0
+
+
+def test_refund_gives_back_one_message(store):
+    store.try_consume("student", 1, DAY)
+    store.refund("student", DAY)
+    store.refund("student", DAY)  # never below zero
+
+    assert store.get("student", DAY) == 0
+    assert store.try_consume("student", 1, DAY) == (True, 1)
+
+
+def test_concurrent_threads_never_exceed_the_limit(store):
+    allowed = []
+
+    def consume():
+        for _ in range(10):
+            allowed.append(store.try_consume("student", LIMIT, DAY)[0])
+
+    threads = [threading.Thread(target=consume) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(allowed) == LIMIT
+    assert store.get("student", DAY) == LIMIT
+
+
+def test_sqlite_upsert_is_atomic_across_processes(tmp_path):
+    db_path = str(tmp_path / "quota.db")
+    SqliteQuotaStore(db_path)  # creates the table before the workers race
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=consume_many, args=(db_path, 10, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    allowed = sum(results.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join()
+
+    assert allowed == LIMIT
+    assert SqliteQuotaStore(db_path).get("student", DAY) == LIMIT
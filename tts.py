@@ -0,0 +1,269 @@
+"""
+Text to speech for /stream_tts, with Piper running locally on the CPU.
+
+The text is split into sentences, which a process pool synthesizes a few at a time; each one is
+sent as a complete WAV file as soon as it (and every sentence before it) is ready, so playback
+starts after the first sentence instead of after the whole answer. The page reads the WAVs back
+out of the response by their RIFF length and plays them one after another; it can also post an
+answer sentence by sentence while /ask is still streaming it.
+
+Synthesized sentences are cached in memory by voice and text hash, bounded by TTS_CACHE_MAX_MB:
+answers share a lot of phrasing ("The final answer is", "Step 1:") and the same message is
+often read aloud more than once.
+
+Piper comes from requirements.txt (piper-tts) and needs a voice model at PIPER_VOICE, which the
+Docker image downloads. Without either, /stream_tts answers 503 and the page reads aloud with
+the browser's speechSynthesis instead.
+"""
+import hashlib
+import importlib.util
+import io
+import multiprocessing
+import os
+import re
+import threading
+import time
+import wave
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from telemetry import log
+
+# --- TTS CONFIG ---
+TTS_ENABLED = os.environ.get("TTS_ENABLED", "true").lower() == "true"
+PIPER_VOICE = os.environ.get("PIPER_VOICE", "voices/en_US-lessac-medium.onnx")
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "2"))
+# Sentences synthesized ahead of the one being sent
+TTS_LOOKAHEAD = int(os.environ.get("TTS_LOOKAHEAD", str(TTS_WORKERS * 2)))
+TTS_TIMEOUT = float(os.environ.get("TTS_TIMEOUT", "20"))
+TTS_MAX_CHARS = int(os.environ.get("TTS_MAX_CHARS", "6000"))
+# Long sentences are cut at a comma (or a space) so no single chunk delays playback for long
+TTS_SENTENCE_MAX_CHARS = int(os.environ.get("TTS_SENTENCE_MAX_CHARS", "220"))
+# Shorter pieces ("1.", "x = 4.") are joined with the next one
+TTS_SENTENCE_MIN_CHARS = 12
+TTS_CACHE_MAX_MB = float(os.environ.get("TTS_CACHE_MAX_MB", "64"))
+
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?।])\s+|\n+")
+_CODE_BLOCK = re.compile(r"```.*?```", re.S)
+_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_URL = re.compile(r"https?://\S+")
+_MARKUP = re.compile(r"[*_#`>|~]+|\\[()\[\]]|\$")
+_SPACES = re.compile(r"[ \t]+")
+
+
+class TTSUnavailable(RuntimeError):
+    """Raised when no speech engine is installed or the voice model is missing."""
+
+
+def clean_for_speech(text):
+    """Drops markdown, code blocks, URLs and LaTeX delimiters, which would otherwise be read out."""
+    text = _CODE_BLOCK.sub(" ", text)
+    text = _LINK.sub(r"\1", text)
+    text = _URL.sub(" ", text)
+    text = _MARKUP.sub(" ", text)
+    return _SPACES.sub(" ", text)
+
+
+def _cut_long(piece, max_chars):
+    while len(piece) > max_chars:
+        cut = max(piece.rfind(", ", 0, max_chars), piece.rfind("; ", 0, max_chars))
+        if cut < TTS_SENTENCE_MIN_CHARS:
+            cut = piece.rfind(" ", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars - 1
+        yield piece[:cut + 1].strip()
+        piece = piece[cut + 1:].strip()
+    if piece:
+        yield piece
+
+
+def split_sentences(text, max_chars=TTS_SENTENCE_MAX_CHARS):
+    """Splits text into the sentences it is synthesized (and cached) by."""
+    sentences = []
+    for part in _SENTENCE_BREAK.split(clean_for_speech(text)):
+        for piece in _cut_long(part.strip(), max_chars):
+            if sentences and len(sentences[-1]) < TTS_SENTENCE_MIN_CHARS:
+                sentences[-1] += " " + piece
+            else:
+                sentences.append(piece)
+    return sentences
+
+
+# --- PIPER (runs in the worker processes) ---
+_voices = {}
+
+
+def run_piper(text, voice_path):
+    """Synthesizes one sentence to WAV bytes. The voice is loaded once per worker process."""
+    voice = _voices.get(voice_path)
+    if voice is None:
+        from piper import PiperVoice
+        voice = _voices[voice_path] = PiperVoice.load(voice_path)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        if hasattr(voice, "synthesize_wav"):  # piper-tts 1.3+
+            voice.synthesize_wav(text, wav_file)
+        else:
+            voice.synthesize(text, wav_file)
+    return buffer.getvalue()
+
+
+def piper_available(voice_path=PIPER_VOICE):
+    return importlib.util.find_spec("piper") is not None and os.path.exists(voice_path)
+
+
+class _WavCache:
+    """LRU of synthesized sentences, bounded by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            wav = self._entries.get(key)
+            if wav is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return wav
+
+    def put(self, key, wav):
+        if len(wav) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            self.size -= len(old) if old else 0
+            self._entries[key] = wav
+            self.size += len(wav)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "mb": round(self.size / (1024 * 1024), 1),
+                    "hits": self.hits, "misses": self.misses}
+
+
+class SpeechSynthesizer:
+    """
+    Sentence-pipelined synthesis on a process pool (Piper's phonemizer is not thread-safe, and
+    synthesis is CPU-bound). `synthesize(text, voice)` must be a picklable function returning WAV bytes.
+    """
+
+    def __init__(self, synthesize=run_piper, voice=PIPER_VOICE, workers=TTS_WORKERS,
+                 lookahead=TTS_LOOKAHEAD, cache_mb=TTS_CACHE_MAX_MB):
+        self.synthesize = synthesize
+        self.voice = voice
+        self.workers = workers
+        self.lookahead = max(lookahead, 1)
+        self.cache = _WavCache(int(cache_mb * 1024 * 1024))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "sentences": 0, "synthesized": 0, "failures": 0,
+                       "synthesis_seconds": 0.0, "first_audio_seconds": 0.0}
+
+    def available(self):
+        return TTS_ENABLED and (self.synthesize is not run_piper or piper_available(self.voice))
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn: forking a threaded web worker can copy held locks into the child
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._executor
+
+    def _key(self, sentence):
+        return hashlib.sha256(f"{self.voice}\0{sentence}".encode("utf-8")).hexdigest()
+
+    def _submit(self, sentence):
+        key = self._key(sentence)
+        wav = self.cache.get(key)
+        if wav is not None:
+            future = Future()
+            future.set_result(wav)
+            return future
+        started = time.monotonic()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(self.synthesize, sentence, self.voice)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); replace the pool rather than fail every request
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            future = self._get_executor().submit(self.synthesize, sentence, self.voice)
+
+        def remember(done):
+            if done.cancelled() or done.exception() is not None:
+                return
+            self.cache.put(key, done.result())
+            with self._lock:
+                self._stats["synthesized"] += 1
+                self._stats["synthesis_seconds"] += time.monotonic() - started
+        future.add_done_callback(remember)
+        return future
+
+    def stream_wav(self, sentences):
+        """
+        Yields one WAV per sentence, in order, with up to `lookahead` sentences synthesizing
+        ahead. `sentences` may be any iterable. A sentence that fails to synthesize is skipped.
+        Closing the generator cancels the sentences not started yet.
+        """
+        if not self.available():
+            raise TTSUnavailable("Text to speech is not available.")
+        started = time.monotonic()
+        sentences = iter(sentences)
+        pending = deque()
+        first = True
+        with self._lock:
+            self._stats["requests"] += 1
+        try:
+            while True:
+                while len(pending) < self.lookahead:
+                    sentence = next(sentences, None)
+                    if sentence is None:
+                        break
+                    pending.append(self._submit(sentence))
+                if not pending:
+                    return
+                try:
+                    wav = pending.popleft().result(timeout=TTS_TIMEOUT)
+                except Exception as e:
+                    log.error("TTS sentence failed: %r", e)
+                    with self._lock:
+                        self._stats["failures"] += 1
+                    continue
+                with self._lock:
+                    self._stats["sentences"] += 1
+                    if first:
+                        self._stats["first_audio_seconds"] += time.monotonic() - started
+                first = False
+                yield wav
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        synthesized, requests = stats.pop("synthesized"), stats["requests"]
+        synthesis_seconds = stats.pop("synthesis_seconds")
+        first_audio_seconds = stats.pop("first_audio_seconds")
+        return {
+            "available": self.available(), "voice": os.path.basename(self.voice), "workers": self.workers,
+            **stats, "synthesized": synthesized,
+            "avg_synthesis_seconds": round(synthesis_seconds / synthesized, 3) if synthesized else None,
+            "avg_first_audio_seconds": round(first_audio_seconds / requests, 3) if requests else None,
+            "cache": self.cache.stats(),
+        }
@@ -0,0 +1,265 @@
+"""
+Web search for /ask (web_search=true) and /web_search.
+
+A query goes to Serper through the pooled provider session; the top WEB_SEARCH_PAGES result
+pages are then fetched concurrently with strict timeouts, reduced to their visible text and
+truncated, and the whole context is capped at WEB_CONTEXT_MAX_CHARS. Pages that fail, are not
+HTML, or are still loading WEB_FETCH_GRACE after the first page arrived fall back to the result
+snippet. Results are cached per normalized query
+for WEB_SEARCH_CACHE_TTL.
+
+start_search() returns a future at once, so the search and page fetches run while the endpoint
+loads the chat and builds the prompt; SearchJob.results() then waits at most until the overall
+WEB_SEARCH_DEADLINE, and the answer goes ahead without web context if it isn't ready by then.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from html.parser import HTMLParser
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import provider_client
+from answer_cache import AnswerCache, normalize_instruction
+from telemetry import log
+
+# --- WEB SEARCH CONFIG ---
+SERPER_API_KEY = os.environ.get("SERPER_API_KEY")
+SERPER_API_URL = os.environ.get("SERPER_API_URL", "https://google.serper.dev/search")
+SERPER_TIMEOUT = float(os.environ.get("SERPER_TIMEOUT", "3"))
+# Result pages fetched and read; the rest only contribute their snippets
+WEB_SEARCH_PAGES = int(os.environ.get("WEB_SEARCH_PAGES", "3"))
+WEB_SEARCH_RESULTS = 5
+WEB_FETCH_TIMEOUT = float(os.environ.get("WEB_FETCH_TIMEOUT", "2.5"))
+# Once the first page is in, the others get this long (seconds) before the search moves on
+WEB_FETCH_GRACE = float(os.environ.get("WEB_FETCH_GRACE", "0.5"))
+WEB_FETCH_MAX_BYTES = int(os.environ.get("WEB_FETCH_MAX_BYTES", str(512 * 1024)))
+# Total time a search may add to an answer, from start_search to results()
+WEB_SEARCH_DEADLINE = float(os.environ.get("WEB_SEARCH_DEADLINE", "4"))
+WEB_PAGE_MAX_CHARS = int(os.environ.get("WEB_PAGE_MAX_CHARS", "1500"))
+WEB_CONTEXT_MAX_CHARS = int(os.environ.get("WEB_CONTEXT_MAX_CHARS", "5000"))
+WEB_SEARCH_CACHE_TTL = int(os.environ.get("WEB_SEARCH_CACHE_TTL", "3600"))
+WEB_SEARCH_CACHE_SIZE = int(os.environ.get("WEB_SEARCH_CACHE_SIZE", "500"))
+WEB_FETCH_WORKERS = int(os.environ.get("WEB_FETCH_WORKERS", "8"))
+WEB_SEARCH_WORKERS = int(os.environ.get("WEB_SEARCH_WORKERS", "4"))
+
+FETCH_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; VexaraBot/1.0)", "Accept": "text/html"}
+_SKIPPED_TAGS = {"script", "style", "noscript", "svg", "nav", "header", "footer", "form", "aside", "template"}
+_BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "td"}
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+# Separate pools: a search waits on its page fetches, so they must not queue behind searches
+_search_executor = ThreadPoolExecutor(max_workers=WEB_SEARCH_WORKERS, thread_name_prefix="web-search")
+_fetch_executor = ThreadPoolExecutor(max_workers=WEB_FETCH_WORKERS, thread_name_prefix="web-fetch")
+_cache = AnswerCache(max_entries=WEB_SEARCH_CACHE_SIZE, ttl=WEB_SEARCH_CACHE_TTL)
+_fetch_session = None
+_fetch_session_lock = threading.Lock()
+_stats = {"searches": 0, "cache_hits": 0, "pages_fetched": 0, "page_failures": 0, "deadline_misses": 0}
+_stats_lock = threading.Lock()
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the visible text of an HTML page, skipping scripts, navigation and the like."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.title = ""
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == "title":
+            self._in_title = True
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == "title":
+            self._in_title = False
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip_depth:
+            self.parts.append(data)
+
+
+def extract_text(html, max_chars=WEB_PAGE_MAX_CHARS):
+    """Visible text of an HTML page, whitespace-collapsed and cut to `max_chars` at a word boundary."""
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass  # keep whatever was parsed before the markup broke
+    text = _SPACES.sub(" ", "".join(parser.parts))
+    text = _BLANK_LINES.sub("\n", "\n".join(line.strip() for line in text.splitlines())).strip()
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(" ", 1)[0] + " …"
+    return text
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def _get_fetch_session():
+    global _fetch_session
+    if _fetch_session is None:
+        with _fetch_session_lock:
+            if _fetch_session is None:
+                # No retries: a slow page is skipped, not waited for twice
+                adapter = HTTPAdapter(pool_connections=WEB_FETCH_WORKERS, pool_maxsize=WEB_FETCH_WORKERS, max_retries=0)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _fetch_session = session
+    return _fetch_session
+
+
+def search_serper(query, num=WEB_SEARCH_RESULTS):
+    """Returns Serper's organic results as [{"title", "link", "snippet"}]."""
+    response = provider_client.post(
+        "serper", SERPER_API_URL, json={"q": query, "num": num},
+        headers={"X-API-KEY": SERPER_API_KEY or "", "Content-Type": "application/json"},
+        timeout=(provider_client.PROVIDER_CONNECT_TIMEOUT, SERPER_TIMEOUT),
+    )
+    response.raise_for_status()
+    return [
+        {"title": item.get("title", ""), "link": item.get("link", ""), "snippet": item.get("snippet", "")}
+        for item in response.json().get("organic", [])[:num]
+        if item.get("link", "").startswith(("http://", "https://"))
+    ]
+
+
+def fetch_page_text(url, timeout=WEB_FETCH_TIMEOUT):
+    """Downloads an HTML page (bounded in time and size) and returns its visible text."""
+    deadline = time.monotonic() + timeout
+    with _get_fetch_session().get(url, headers=FETCH_HEADERS, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        if "html" not in response.headers.get("Content-Type", "text/html"):
+            raise ValueError(f"not HTML ({response.headers.get('Content-Type')})")
+        body = bytearray()
+        for block in response.iter_content(16 * 1024):
+            body += block
+            # The read timeout is per read; this bounds a page that trickles in
+            if len(body) >= WEB_FETCH_MAX_BYTES or time.monotonic() > deadline:
+                break
+        # requests assumes ISO-8859-1 for text/* without a charset; the web is mostly UTF-8
+        content_type = response.headers.get("Content-Type", "")
+        encoding = response.encoding if "charset" in content_type.lower() else "utf-8"
+    return extract_text(body.decode(encoding or "utf-8", errors="replace"))
+
+
+def _query_key(query):
+    return hashlib.sha256(normalize_instruction(query).encode("utf-8")).hexdigest()
+
+
+def run_search(query):
+    """Searches and reads the top pages. Returns [{"title", "link", "snippet", "text"}] (text may be "")."""
+    cached = _cache.get(_query_key(query))
+    if cached is not None:
+        _count("cache_hits")
+        return json.loads(cached)
+    if not SERPER_API_KEY:
+        raise RuntimeError("SERPER_API_KEY is not set")
+    _count("searches")
+
+    results = search_serper(query)
+    pages = {_fetch_executor.submit(fetch_page_text, r["link"]): r for r in results[:WEB_SEARCH_PAGES]}
+    for r in results:
+        r["text"] = ""
+    deadline = time.monotonic() + WEB_FETCH_TIMEOUT + 0.5
+    done, not_done = wait(pages, timeout=deadline - time.monotonic(), return_when=FIRST_COMPLETED)
+    if not_done:
+        # Don't let one slow site hold up the answer when other pages already arrived
+        grace = min(WEB_FETCH_GRACE, max(deadline - time.monotonic(), 0))
+        done, not_done = wait(pages, timeout=grace if done else max(deadline - time.monotonic(), 0))
+    for future in not_done:
+        future.cancel()
+    for future in pages:
+        if future in done and future.exception() is None:
+            pages[future]["text"] = future.result()
+            _count("pages_fetched")
+        else:
+            _count("page_failures")
+    _cache.put(_query_key(query), json.dumps(results, ensure_ascii=False))
+    return results
+
+
+def format_context(results, max_chars=WEB_CONTEXT_MAX_CHARS):
+    """Numbered sources with page text (or the snippet), cut to `max_chars` overall."""
+    sections, used = [], 0
+    for i, r in enumerate(results, 1):
+        body = r.get("text") or r.get("snippet", "")
+        section = f"[{i}] {r['title']} ({r['link']})\n{body}"
+        if used + len(section) > max_chars:
+            section = section[:max(max_chars - used, 0)]
+        if not section:
+            break
+        sections.append(section)
+        used += len(section)
+    return "\n\n".join(sections)
+
+
+def format_results_markdown(results):
+    """Search results as a markdown list, for /web_search."""
+    return "\n".join(f"{i}. [{r['title']}]({r['link']})\n   {r['snippet']}" for i, r in enumerate(results, 1))
+
+
+class SearchJob:
+    """A search started in the background; see start_search."""
+
+    def __init__(self, query, future):
+        self.query = query
+        self.future = future
+        self.deadline = time.monotonic() + WEB_SEARCH_DEADLINE
+
+    def results(self):
+        """Waits until the deadline at most. Returns the results, or [] if the search failed or is late."""
+        try:
+            return self.future.result(timeout=max(self.deadline - time.monotonic(), 0))
+        except FutureTimeout:
+            _count("deadline_misses")
+            log.warning("Web search for %r missed its deadline, answering without it", self.query[:50])
+        except Exception as e:
+            log.error("Web search failed: %s", e)
+        return []
+
+    async def results_async(self):
+        """Async counterpart of results()."""
+        try:
+            future = asyncio.wrap_future(self.future)
+            return await asyncio.wait_for(asyncio.shield(future), max(self.deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            _count("deadline_misses")
+            log.warning("Web search for %r missed its deadline, answering without it", self.query[:50])
+        except Exception as e:
+            log.error("Web search failed: %s", e)
+        return []
+
+
+def start_search(query):
+    """Starts run_search on the worker pool and returns a SearchJob right away."""
+    return SearchJob(query, _search_executor.submit(run_search, query))
+
+
+def search_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    return {"configured": bool(SERPER_API_KEY), **stats, "cache": _cache.stats()}